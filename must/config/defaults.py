@@ -213,6 +213,10 @@ _C.MODEL.HEAD_ACT = "softmax"
 # Activation checkpointing enabled or not to save GPU memory.
 _C.MODEL.ACT_CHECKPOINT = False
 
+# MViT stages whose blocks use activation checkpointing, stages start at the
+# blocks of MVIT.DIM_MUL. Empty checkpoints every stage.
+_C.MODEL.ACT_CHECKPOINT_STAGES = []
+
 # Activation checkpointing enabled or not to save GPU memory.
 _C.MODEL.KEEP_ALL_CHECKPOINTS = False
 
@@ -386,6 +390,12 @@ _C.MVIT.FULL_SELF_ATTENTION_TYPE = "cross_output"
 
 _C.MVIT.LOGIT_JOIN_TYPE = "mlp"
 
+# If True, the attention of the MViT blocks and of the cross-attention head uses
+# the fused kernels of `F.scaled_dot_product_attention`. If False, it is
+# computed explicitly, e.g. for debugging or on backends where the fused
+# kernels misbehave.
+_C.MVIT.FUSED_ATTN = True
+
 
 # -----------------------------------------------------------------------------
 # Multi-Temporal Attention Module
@@ -406,6 +416,10 @@ _C.MULTISCALEATTN.SELF_ATTN_NUM_HEADS = 4
 
 _C.MULTISCALEATTN.SELF_ATTN_LAYERS = 1
 
+# Run the cross-attention and self-attention of all the pyramid levels as
+# batched matmuls over stacked per-level weights, instead of one level at a time.
+_C.MULTISCALEATTN.FUSED = True
+
 # -----------------------------------------------------------------------------
 # Data options
 # -----------------------------------------------------------------------------
@@ -485,7 +499,8 @@ _C.DATA.TEST_CROP_SIZE = 256
 # frame sampling.
 _C.DATA.TARGET_FPS = 30
 
-# Decoding backend, options include `pyav` or `torchvision`
+# Decoding backend, options include `pyav` or `torchvision`. Videos of the
+# `video` ENDOVIS_DATASET.IMG_PROC_BACKEND are decoded with `pyav`.
 _C.DATA.DECODING_BACKEND = "pyav"
 
 # if True, sample uniformly in [1 / max_scale, 1 / min_scale] and take a
@@ -519,6 +534,16 @@ _C.DATA.ONLINE = False
 
 _C.DATA.FIXED_RESIZE = False
 
+# If True, the frames of a clip are stacked into a single uint8 array after the
+# geometric transforms and converted, augmented and normalized in one pass.
+# Otherwise every frame goes through the per-frame list transforms.
+_C.DATA.FUSED_PREPROCESSING = True
+
+# If True, the datasets return uint8 clips that are only resized and cropped,
+# and the flips, color augmentation and normalization are applied to whole
+# batches in the training and evaluation loops. Requires FUSED_PREPROCESSING.
+_C.DATA.BATCH_TRANSFORM = False
+
 
 
 # ---------------------------------------------------------------------------- #
@@ -639,6 +664,28 @@ _C.DATA_LOADER.PIN_MEMORY = True
 # Enable multi thread decoding.
 _C.DATA_LOADER.ENABLE_MULTI_THREAD_DECODE = False
 
+# Number of threads used by each data loader worker to read and decode the
+# frames of a clip when ENABLE_MULTI_THREAD_DECODE is True.
+_C.DATA_LOADER.NUM_DECODE_THREADS = 4
+
+# If True, JPEG frames are decoded at 1/2, 1/4 or 1/8 of their resolution
+# whenever their short side stays larger than the size used by the
+# preprocessing.
+_C.DATA_LOADER.REDUCED_DECODE = False
+
+# If True, training keyframes are shuffled in blocks of consecutive keyframes
+# of the same video, and every worker loads runs of nearby keyframes whose
+# clips share most of their frames. Batches still mix videos.
+_C.DATA_LOADER.VIDEO_BLOCK_SAMPLER = False
+
+# Number of consecutive keyframes of a block of VIDEO_BLOCK_SAMPLER.
+_C.DATA_LOADER.VIDEO_BLOCK_SIZE = 32
+
+# Size in MB of the LRU cache of decoded frames of every data loader worker, 0
+# disables it. Frames larger than needed are cached resized to the size of the
+# frame cache (see `must/datasets/frame_cache.py`).
+_C.DATA_LOADER.FRAME_LRU_MB = 0
+
 
 # -----------------------------------------------------------------------------
 # Endoscopic Surgical Dataset options
@@ -693,9 +740,38 @@ _C.ENDOVIS_DATASET.TEST_FORCE_FLIP = False
 # The name of the file to the ava groundtruth.
 _C.ENDOVIS_DATASET.GROUNDTRUTH_FILE = ""
 
-# Backend to process image, includes `pytorch` and `cv2`.
+# Backend to process image, includes `pytorch`, `cv2`, `frame_cache`
+# (read pre-resized frames from FRAME_CACHE_DIR, see tools/build_frame_cache.py)
+# and `video` (decode the frames from the videos in VIDEO_DIR).
 _C.ENDOVIS_DATASET.IMG_PROC_BACKEND = "cv2"
 
+# Directory of the videos, `<video name><VIDEO_EXT>` for every video of the
+# frame lists.
+_C.ENDOVIS_DATASET.VIDEO_DIR = ""
+
+# Extension of the video files.
+_C.ENDOVIS_DATASET.VIDEO_EXT = ".mp4"
+
+# Video frames per frame id of the frame lists, e.g. 25 for frame lists at 1 fps
+# of videos at 25 fps.
+_C.ENDOVIS_DATASET.VIDEO_FRAME_STRIDE = 1
+
+# Number of videos kept open by every dataloader worker.
+_C.ENDOVIS_DATASET.VIDEO_CACHE_SIZE = 8
+
+# Largest gap in video frames between two decoded frames that is decoded
+# through instead of seeking.
+_C.ENDOVIS_DATASET.VIDEO_SEEK_GAP = 64
+
+# Directory of the pre-resized frame cache.
+_C.ENDOVIS_DATASET.FRAME_CACHE_DIR = ""
+
+# Storage format of the cached frames, `raw` (uint8 pixels) or `jpg`.
+_C.ENDOVIS_DATASET.FRAME_CACHE_FORMAT = "raw"
+
+# Maximum size in GB of each frame cache shard.
+_C.ENDOVIS_DATASET.FRAME_CACHE_SHARD_SIZE = 4.0
+
 # Test annotation file of groundtruth in coco 
 _C.ENDOVIS_DATASET.TEST_COCO_ANNS = ""
 
@@ -725,6 +801,11 @@ _C.TASKS.TASKS = ["actions", "phases", "steps", "instruments"]
 # Task metrics
 _C.TASKS.METRICS = ["mAP@50_det", "mAP@50_seg", "mAP", "mIoU"]
 
+# If True, the predictions of every eval epoch are saved as json files. For
+# classification metrics they are written in the background, after the metrics
+# are computed from memory.
+_C.TASKS.SAVE_PREDICTIONS = True
+
 # Number of classes per extra head
 _C.TASKS.NUM_CLASSES = [14, 11, 21, 7]
 
@@ -762,6 +843,13 @@ _C.TEMPORAL_MODULE.NUM_FRAMES = 10
 _C.TEMPORAL_MODULE.FEATURE_PATH_TRAIN = ""
 _C.TEMPORAL_MODULE.FEATURE_PATH_VAL = ""
 
+# If True, the features of every annotated frame are loaded once into a shared
+# memory bank, read by all the dataloader workers and processes of a node.
+_C.TEMPORAL_MODULE.FEATURE_BANK = False
+
+# Shared-memory directory (tmpfs) the feature banks are stored in.
+_C.TEMPORAL_MODULE.FEATURE_BANK_DIR = "/dev/shm"
+
 
 _C.TEMPORAL_MODULE.TCM_D_MODEL=512
 _C.TEMPORAL_MODULE.TCM_CAT_DIM=512
@@ -770,6 +858,17 @@ _C.TEMPORAL_MODULE.TCM_NUM_LAYERS = 4
 _C.TEMPORAL_MODULE.TCM_NUM_HEADS = 8
 _C.TEMPORAL_MODULE.ONLINE_INFERENCE = False
 
+# If True, the TCM only attends to the current and previous frames of a chunk
+# and does not use absolute positional encodings, so its per-frame states do
+# not depend on the position of the frame within the chunk.
+_C.TEMPORAL_MODULE.CAUSAL = False
+
+# If True (requires CAUSAL and ONLINE_INFERENCE), inference streams every video
+# frame by frame, caching the embeddings of the last CHUNKS.CHUNK_SIZE - 1
+# frames instead of loading a full chunk per frame. Predictions are the same
+# as the online inference with full chunks.
+_C.TEMPORAL_MODULE.STREAMING = False
+
 
 # ---------------------------------------------------------------------------- #
 # TIME TRANSFORMER CHUNKS
@@ -791,6 +890,59 @@ _C.MVIT_FEATS.ENABLE = False
 # Path to the .pth file where mvit feats will be saved
 _C.MVIT_FEATS.PATH = ''
 
+# Storage format of the saved feats. Options include `packed` (one
+# memory-mappable array and frame index per video) and `pth` (one file per frame).
+_C.MVIT_FEATS.FORMAT = "packed"
+
+# Dtype of the packed feats. Options include `float32` and `float16`.
+_C.MVIT_FEATS.DTYPE = "float32"
+
+# Number of frames whose feats are buffered before being written to the
+# packed store by tools/extract_features.py.
+_C.MVIT_FEATS.CHUNK_SIZE = 4096
+
+# Task whose head gives the feats extracted by tools/extract_features.py. The
+# first task of TASKS.TASKS if empty.
+_C.MVIT_FEATS.TASK = ""
+
+# ---------------------------------------------------------------------------- #
+# CPU inference options
+# ---------------------------------------------------------------------------- #
+_C.CPU_INFERENCE = CfgNode()
+
+# If True and NUM_GPUS is 0, evaluate under torch.inference_mode with the
+# settings below.
+_C.CPU_INFERENCE.ENABLE = False
+
+# Number of intra-op threads. If 0, use one thread per physical core.
+_C.CPU_INFERENCE.NUM_THREADS = 0
+
+# If True, store 5D convolution weights and input clips as channels-last.
+_C.CPU_INFERENCE.CHANNELS_LAST = True
+
+# If True, run the forward pass under bfloat16 autocast.
+_C.CPU_INFERENCE.BFLOAT16 = False
+
+# ---------------------------------------------------------------------------- #
+# Benchmark options
+# ---------------------------------------------------------------------------- #
+_C.BENCHMARK = CfgNode()
+
+# Number of epochs for data loading benchmark.
+_C.BENCHMARK.NUM_EPOCHS = 5
+
+# Log period in iters for data loading benchmark.
+_C.BENCHMARK.LOG_PERIOD = 100
+
+# If True, shuffle dataloader for epoch during benchmark.
+_C.BENCHMARK.SHUFFLE = True
+
+# Number of warmup iterations of the inference benchmark.
+_C.BENCHMARK.WARMUP_ITERS = 5
+
+# Number of timed iterations of the inference benchmark.
+_C.BENCHMARK.NUM_ITERS = 20
+
 # Add custom config with default values.
 custom_config.add_custom_config(_C)
 
@@ -813,6 +965,16 @@ def assert_and_infer_cfg(cfg):
         cfg.SOLVER.WARMUP_START_LR *= cfg.NUM_SHARDS
         cfg.SOLVER.COSINE_END_LR *= cfg.NUM_SHARDS
 
+    # DATA assertions.
+    if cfg.DATA.BATCH_TRANSFORM:
+        assert cfg.DATA.FUSED_PREPROCESSING, "BATCH_TRANSFORM requires FUSED_PREPROCESSING"
+
+    # TEMPORAL_MODULE assertions.
+    if cfg.TEMPORAL_MODULE.STREAMING:
+        assert cfg.TEMPORAL_MODULE.CAUSAL, "Streaming inference requires a causal TCM"
+        assert cfg.TEMPORAL_MODULE.ONLINE_INFERENCE, "Streaming inference requires ONLINE_INFERENCE"
+        assert cfg.NUM_GPUS <= 1, "Streaming inference reads every video in order on a single GPU"
+
     # General assertions.
     assert cfg.SHARD_ID < cfg.NUM_SHARDS
     return cfg
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+"""
+Batched tensor transforms applied in the training and evaluation loops.
+
+With `DATA.BATCH_TRANSFORM` the datasets return uint8 clips, only resized and
+cropped, and `BatchTransform` does the flips, the color and PCA jitter and the
+normalization on the whole batch, on the device the batch is on.
+"""
+
+import torch
+
+from . import transform as transform
+
+
+class BatchTransform(object):
+    """
+    Flip, color augment and normalize batches of uint8 clips. Random
+    parameters are sampled per clip and shared by all the pathways (rates) of
+    the same sample.
+    """
+
+    def __init__(self, cfg, split):
+        """
+        Args:
+            cfg (CfgNode): configs.
+            split (str): `train` or `val`.
+        """
+        self.cfg = cfg
+        self._split = split
+        # BGR channel stored at every channel of the clips.
+        self._channels = [0, 1, 2] if cfg.ENDOVIS_DATASET.BGR else [2, 1, 0]
+        if cfg.DATA.REVERSE_INPUT_CHANNEL:
+            self._channels = self._channels[::-1]
+
+        self._mean = torch.tensor(
+            [cfg.DATA.MEAN[channel] for channel in self._channels]
+        ).view(1, 3, 1, 1, 1)
+        self._std = torch.tensor(
+            [cfg.DATA.STD[channel] for channel in self._channels]
+        ).view(1, 3, 1, 1, 1)
+        bgr_gray_weights = [0.114, 0.587, 0.299]
+        self._gray_weights = torch.tensor(
+            [bgr_gray_weights[channel] for channel in self._channels]
+        ).view(1, 3, 1, 1, 1)
+
+        if split == "train" and not cfg.DATA.JUST_CENTER:
+            self._flip_prob = 0.5 if cfg.DATA.RANDOM_FLIP else 0.0
+        elif not cfg.DATA.JUST_CENTER and cfg.ENDOVIS_DATASET.TEST_FORCE_FLIP:
+            self._flip_prob = 1.0
+        else:
+            self._flip_prob = 0.0
+
+        self._color_jitter = {}
+        self._lighting = False
+        if split == "train" and cfg.ENDOVIS_DATASET.TRAIN_USE_COLOR_AUGMENTATION:
+            if not cfg.ENDOVIS_DATASET.TRAIN_PCA_JITTER_ONLY:
+                self._color_jitter = {
+                    "brightness": 0.4,
+                    "contrast": 0.4,
+                    "saturation": 0.4,
+                }
+            self._lighting = True
+            self._alphastd = 0.1
+            self._eigval = torch.tensor(cfg.DATA.TRAIN_PCA_EIGVAL)
+            self._eigvec = torch.tensor(cfg.DATA.TRAIN_PCA_EIGVEC)
+
+    def __call__(self, inputs):
+        """
+        Args:
+            inputs (list): nested lists of clips. uint8 clips, with dimension
+                `batch` x `channel` x `num frames` x `height` x `width`, are
+                transformed, other tensors are returned as they are.
+        Returns:
+            inputs (list): the inputs with float32 normalized clips.
+        """
+        clip = self._first_clip(inputs)
+        if clip is None:
+            return inputs
+        params = self._sample_params(clip.shape[0], clip.device)
+        return self._map(inputs, params)
+
+    def _first_clip(self, inputs):
+        if isinstance(inputs, (list, tuple)):
+            for item in inputs:
+                clip = self._first_clip(item)
+                if clip is not None:
+                    return clip
+            return None
+        if torch.is_tensor(inputs) and inputs.dtype == torch.uint8:
+            return inputs
+        return None
+
+    def _map(self, inputs, params):
+        if isinstance(inputs, (list, tuple)):
+            return [self._map(item, params) for item in inputs]
+        if torch.is_tensor(inputs) and inputs.dtype == torch.uint8:
+            return self._transform(inputs, params)
+        return inputs
+
+    def _sample_params(self, batch_size, device):
+        """
+        Sample the random parameters of every clip of the batch.
+        """
+        params = {}
+        if self._flip_prob > 0:
+            params["flip"] = torch.rand(batch_size, device=device) < self._flip_prob
+        if len(self._color_jitter) > 0:
+            params["jitter_order"] = [
+                list(self._color_jitter)[idx]
+                for idx in torch.randperm(len(self._color_jitter)).tolist()
+            ]
+            for name, var in self._color_jitter.items():
+                params[name] = 1.0 + torch.empty(
+                    batch_size, device=device
+                ).uniform_(-var, var).view(-1, 1, 1, 1, 1)
+        if self._lighting:
+            alpha = torch.empty(batch_size, 3, device=device).normal_(
+                0, self._alphastd
+            )
+            eigvec = self._eigvec.to(device)
+            eigval = self._eigval.to(device)
+            # rgb[b, i] = sum_j eigvec[i, j] * alpha[b, j] * eigval[j].
+            rgb = (eigvec[None] * (alpha * eigval[None])[:, None, :]).sum(-1)
+            params["lighting"] = rgb[:, [2 - channel for channel in self._channels]]
+        return params
+
+    def _transform(self, clips, params):
+        """
+        Flip, color augment and normalize a batch of uint8 clips.
+        """
+        device = clips.device
+        if "flip" in params:
+            flip = params["flip"].view(-1, 1, 1, 1, 1)
+            clips = torch.where(flip, clips.flip(-1), clips)
+
+        clips = clips.float().div_(255.0)
+
+        for name in params.get("jitter_order", []):
+            alpha = params[name]
+            if name == "brightness":
+                clips.mul_(alpha)
+            elif name == "contrast":
+                gray = self._grayscale(clips)
+                # One mean gray level per frame.
+                clips = transform.blend(
+                    clips, gray.mean(dim=(3, 4), keepdim=True), alpha
+                )
+            elif name == "saturation":
+                clips = transform.blend(clips, self._grayscale(clips), alpha)
+
+        if "lighting" in params:
+            clips.add_(params["lighting"].view(-1, 3, 1, 1, 1))
+
+        clips.sub_(self._mean.to(device)).div_(self._std.to(device))
+        return clips
+
+    def _grayscale(self, clips):
+        return (clips * self._gray_weights.to(clips.device)).sum(
+            dim=1, keepdim=True
+        )
@@ -2,15 +2,15 @@
 # Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
 
 import itertools
-import os
 import logging
 import numpy as np
 
-from copy import deepcopy
 from .surgical_dataset import SurgicalDataset
+from .psi_ava import Psi_ava_transformer
 from . import utils as utils
 from .build import DATASET_REGISTRY
 import random
+import torch
 
 logger = logging.getLogger(__name__)
 
@@ -56,16 +56,8 @@ class YourDataset(SurgicalDataset):
         video_idx, sec_idx, sec, center_idx = self._keyframe_indices[idx]
         video_name = self._video_idx_to_name[video_idx]
 
-        # The complete name is how the name of your dataset is made {video_name}/{frame_number}.{jpg}. This depends on how the folders and frame names are.
-        complete_name = '{}/{}.{}'.format(video_name, str(sec).zfill(self.zero_fill), self.image_type) 
-
-        #TODO: REMOVE when all done
-        folder_to_images = "/".join(self._image_paths[video_idx][0].split('/')[:-2])
-        path_complete_name = os.path.join(folder_to_images,complete_name)
-        found_idx = self._image_paths[video_idx].index(path_complete_name)
-
-        assert path_complete_name == self._image_paths[video_idx][center_idx], f'Different paths {path_complete_name} & {self._image_paths[video_idx][center_idx]} & {sec_idx} & {sec}'
-        assert found_idx == center_idx, f'Different indexes {found_idx} & {center_idx}'
+        # The complete name is how the name of your dataset is made {video_name}/{frame_number}.{jpg}. Override `_keyframe_name` if your folders and frame names are different.
+        complete_name = self._keyframe_name(video_name, sec)
 
         # Get the frame idxs for current clip.
         seq = utils.get_sequence(
@@ -77,19 +69,13 @@ class YourDataset(SurgicalDataset):
         )
 
         assert center_idx in seq, f'Center index {center_idx} not in sequence {seq}'
-        clip_label_list = deepcopy(self._keyframe_boxes_and_labels[video_idx][sec_idx])
-        assert len(clip_label_list) > 0
-
         all_labels = {task:[] for task in self._region_tasks}
 
         for task in self._frame_tasks:
-            assert all(label[task]==clip_label_list[0][task] for label in clip_label_list), f'Inconsistent {task} labels for frame {complete_name}: {[label[task] for label in clip_label_list]}'
-            all_labels[task] = clip_label_list[0][task]
+            all_labels[task] = self._keyframe_indices.get_label(idx, task)
                 
         image_paths = [self._image_paths[video_idx][frame] for frame in seq]
-        imgs = utils.retry_load_images(
-            image_paths, backend=self.cfg.ENDOVIS_DATASET.IMG_PROC_BACKEND
-        )
+        imgs = self._load_images(image_paths)
         
         imgs = self._images_and_boxes_preprocessing_cv2(
             imgs
@@ -141,15 +127,7 @@ class YourDatasetpms(SurgicalDataset):
         # Get the path of the middle frame 
         video_idx, sec_idx, sec, center_idx = self._keyframe_indices[idx]
         video_name = self._video_idx_to_name[video_idx]
-        complete_name = '{}/{}.{}'.format(video_name, str(sec).zfill(self.zero_fill), self.image_type)
-
-        #TODO: REMOVE when all done
-        folder_to_images = "/".join(self._image_paths[video_idx][0].split('/')[:-2])
-        path_complete_name = os.path.join(folder_to_images,complete_name)
-        found_idx = self._image_paths[video_idx].index(path_complete_name)
-
-        assert path_complete_name == self._image_paths[video_idx][center_idx], f'Different paths {path_complete_name} & {self._image_paths[video_idx][center_idx]} & {sec_idx} & {sec}'
-        assert found_idx == center_idx, f'Different indexes {found_idx} & {center_idx}'
+        complete_name = self._keyframe_name(video_name, sec)
 
         sequence_pyramid = []
 
@@ -170,33 +148,20 @@ class YourDatasetpms(SurgicalDataset):
         assert center_idx in seq, f'Center index {center_idx} not in sequence {seq}'
 
         # Get the frame idxs for current clip.
-        images_pyramid = utils.process_sequences_parallel(
+        images_pyramid = utils.process_multi_rate_sequences(
             sequence_pyramid,
             video_idx,
             self.cfg,
             self._image_paths,
-            self._images_and_boxes_preprocessing_cv2
+            self._images_and_boxes_preprocessing_cv2,
+            load_fn=self._load_images,
         )
-        
-        clip_label_list = deepcopy(self._keyframe_boxes_and_labels[video_idx][sec_idx])
 
-        assert len(clip_label_list) > 0
-        
         # Add labels depending on the task
         all_labels = {task:[] for task in self._region_tasks} 
 
         for task in self._frame_tasks:
-            assert all(label[task]==clip_label_list[0][task] for label in clip_label_list), f'Inconsistent {task} labels for frame {complete_name}: {[label[task] for label in clip_label_list]}'
-            all_labels[task] = clip_label_list[0][task]
-                
-        # Load images of current clip.
-        images_pyramid = utils.process_sequences_parallel(
-            sequence_pyramid,
-            video_idx,
-            self.cfg,
-            self._image_paths,
-            self._images_and_boxes_preprocessing_cv2
-        )
+            all_labels[task] = self._keyframe_indices.get_label(idx, task)
 
         if self.cfg.NUM_GPUS>1:
             video_num = int(video_name.replace('video','')) # For running in more than one gpu, you need to extract the number of your video
@@ -221,10 +186,27 @@ class YourDatasettransformer(Psi_ava_transformer):
         self.zero_fill = 6 # The number of zeros your images are padded with
         self.image_type = "jpg" # The extension of your images (jpg, png, etc.)
         super().__init__(cfg,split)
+        self._feature_index = {}
     
     def keyframe_mapping(self, video_idx, sec_idx, sec):
         return sec 
-        
+
+    def _feature_idx(self, video_name, frame_name):
+        """
+        Position of a frame in the feature list of its video.
+
+        Args:
+            video_name (str): name of the video.
+            frame_name (str): frame name, e.g. `video01/000123.jpg`.
+
+        Returns:
+            (int): index of the frame in `self.feature_paths[video_name]`.
+        """
+        if video_name not in self._feature_index:
+            self._feature_index[video_name] = {
+                name: idx for idx, name in enumerate(self.feature_paths[video_name])
+            }
+        return self._feature_index[video_name][frame_name]
         
     def __getitem__(self, idx):
         """
@@ -244,10 +226,10 @@ class YourDatasettransformer(Psi_ava_transformer):
         # Get the path of the middle frame 
         video_idx, sec_idx, sec, center_idx = self._keyframe_indices[idx]
         video_name = self._video_idx_to_name[video_idx]
-        complete_name = '{}/{}.{}'.format(video_name, str(sec).zfill(self.zero_fill), self.image_type)
+        complete_name = self._keyframe_name(video_name, sec)
 
         video_feat_paths = self.feature_paths[video_name]
-        feat_idx = video_feat_paths.index(complete_name)
+        feat_idx = self._feature_idx(video_name, complete_name)
         
         seq_feats = utils.get_sequence(
             feat_idx,
@@ -257,16 +239,12 @@ class YourDatasettransformer(Psi_ava_transformer):
             length = self._seq_len
         )
         
-        clip_label_list = deepcopy(self._keyframe_boxes_and_labels[video_idx][sec_idx])
-        assert len(clip_label_list) > 0
-
         all_labels = {task:[] for task in self._region_tasks} 
         
         feature_names = [video_feat_paths[frame] for frame in seq_feats]
 
         for task in self._frame_tasks:
-            assert all(label[task]==clip_label_list[0][task] for label in clip_label_list), f'Inconsistent {task} labels for frame {complete_name}: {[label[task] for label in clip_label_list]}'
-            all_labels[task] = clip_label_list[0][task]
+            all_labels[task] = self._keyframe_indices.get_label(idx, task)
 
         extra_data = {}      
         
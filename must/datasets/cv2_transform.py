@@ -802,3 +802,226 @@ def revert_scaled_boxes(size, boxes, img_height, img_width):
     scale_ratio = scaled_aspect / size
     reverted_boxes = boxes * scale_ratio
     return reverted_boxes
+
+
+def get_short_side_scale_size(height, width, size):
+    """
+    Get the output size of a short side scale.
+    Args:
+        height (int): the height of the image.
+        width (int): the width of the image.
+        size (int): size to scale the short side to.
+    Returns:
+        new_height (int): the scaled height.
+        new_width (int): the scaled width.
+    """
+    if (width <= height and width == size) or (
+        height <= width and height == size
+    ):
+        return height, width
+    if width < height:
+        return int(math.floor((float(height) / width) * size)), size
+    return size, int(math.floor((float(width) / height) * size))
+
+
+def resize_clip(images, height, width):
+    """
+    Resize a list of images and stack them into a single clip. The frames are
+    resized directly into the clip, which keeps the dtype of the images.
+    Args:
+        images (list): list of images with dimension of
+            `height` x `width` x `channel`.
+        height (int): the output height.
+        width (int): the output width.
+    Returns:
+        clip (ndarray): the clip with dimension of
+            `num frames` x `height` x `width` x `channel`.
+    """
+    clip = np.empty(
+        (len(images), height, width, images[0].shape[2]), dtype=images[0].dtype
+    )
+    for idx, image in enumerate(images):
+        if image.shape[:2] == (height, width):
+            clip[idx] = image
+        else:
+            cv2.resize(
+                image,
+                (width, height),
+                dst=clip[idx],
+                interpolation=cv2.INTER_LINEAR,
+            )
+    return clip
+
+
+def random_crop_clip(clip, size):
+    """
+    Perform random crop on a clip. The same crop is used for every frame.
+    Args:
+        clip (ndarray): clip with dimension of
+            `num frames` x `height` x `width` x `channel`.
+        size (int): size to crop.
+    Returns:
+        (ndarray): view of the cropped clip.
+    """
+    height, width = clip.shape[1:3]
+    if height == size and width == size:
+        return clip
+    y_offset = 0
+    if height > size:
+        y_offset = int(np.random.randint(0, height - size))
+    x_offset = 0
+    if width > size:
+        x_offset = int(np.random.randint(0, width - size))
+    return clip[:, y_offset : y_offset + size, x_offset : x_offset + size]
+
+
+def center_crop_clip(clip, size):
+    """
+    Perform center crop on a clip.
+    Args:
+        clip (ndarray): clip with dimension of
+            `num frames` x `height` x `width` x `channel`.
+        size (int): size to crop.
+    Returns:
+        (ndarray): view of the cropped clip.
+    """
+    height, width = clip.shape[1:3]
+    y_offset = int(math.ceil((height - size) / 2))
+    x_offset = int(math.ceil((width - size) / 2))
+    cropped = clip[:, y_offset : y_offset + size, x_offset : x_offset + size]
+    assert cropped.shape[1] == size, "Image height not cropped properly"
+    assert cropped.shape[2] == size, "Image width not cropped properly"
+    return cropped
+
+
+def color_jitter_clip(
+    clip, img_brightness=0, img_contrast=0, img_saturation=0, gray_weights=None
+):
+    """
+    Perform color jitter in place on a clip. Same as `color_jitter_list`, with
+    every op applied to the whole clip at once.
+    Args:
+        clip (ndarray): float clip with dimension of
+            `channel` x `num frames` x `height` x `width`.
+        img_brightness (float): jitter ratio for brightness.
+        img_contrast (float): jitter ratio for contrast.
+        img_saturation (float): jitter ratio for saturation.
+        gray_weights (list): weight of every channel of the clip in the gray
+            scale image. Defaults to the BGR weights.
+    Returns:
+        clip (ndarray): the jittered clip.
+    """
+    if gray_weights is None:
+        gray_weights = [0.114, 0.587, 0.299]
+    gray_weights = np.asarray(gray_weights, dtype=clip.dtype)
+    jitter = []
+    if img_brightness != 0:
+        jitter.append("brightness")
+    if img_contrast != 0:
+        jitter.append("contrast")
+    if img_saturation != 0:
+        jitter.append("saturation")
+
+    if len(jitter) > 0:
+        order = np.random.permutation(np.arange(len(jitter)))
+        for idx in range(0, len(jitter)):
+            if jitter[order[idx]] == "brightness":
+                alpha = 1.0 + np.random.uniform(-img_brightness, img_brightness)
+                clip *= alpha
+            elif jitter[order[idx]] == "contrast":
+                alpha = 1.0 + np.random.uniform(-img_contrast, img_contrast)
+                gray = np.tensordot(gray_weights, clip, axes=1)
+                # One mean gray level per frame.
+                clip *= alpha
+                clip += (1 - alpha) * gray.mean(axis=(1, 2), keepdims=True)
+            elif jitter[order[idx]] == "saturation":
+                alpha = 1.0 + np.random.uniform(-img_saturation, img_saturation)
+                gray = np.tensordot(gray_weights, clip, axes=1)
+                gray *= 1 - alpha
+                clip *= alpha
+                clip += gray
+    return clip
+
+
+def normalize_clip(
+    clip,
+    mean,
+    stddev,
+    bgr=True,
+    color_jitter=None,
+    lighting=None,
+):
+    """
+    Convert a uint8 BGR clip into a normalized float32 clip in a single
+    output array: channels are reordered and moved first while casting,
+    and the scaling to [0, 1], the optional color augmentation and the
+    normalization are applied in place.
+    Args:
+        clip (ndarray): uint8 BGR clip with dimension of
+            `num frames` x `height` x `width` x `channel`.
+        mean (list): channel mean in BGR order.
+        stddev (list): channel stddev in BGR order.
+        bgr (bool): keep the BGR order, otherwise the output is RGB.
+        color_jitter (dict): optional. Arguments of `color_jitter_clip`.
+        lighting (dict): optional. `alphastd`, `eigval` and `eigvec` of the
+            PCA jitter, see `lighting_list`.
+    Returns:
+        out (ndarray): float32 clip with dimension of
+            `channel` x `num frames` x `height` x `width`.
+    """
+    num_channels = clip.shape[3]
+    assert len(mean) == num_channels, "channel mean not computed properly"
+    assert len(stddev) == num_channels, "channel stddev not computed properly"
+    # Channel of the input clip stored at every output channel.
+    channels = list(range(num_channels)) if bgr else list(range(num_channels))[::-1]
+
+    out = np.empty((num_channels,) + clip.shape[:3], dtype=np.float32)
+    for idx, channel in enumerate(channels):
+        out[idx] = clip[..., channel]
+    out /= 255.0
+
+    if color_jitter is not None:
+        bgr_weights = [0.114, 0.587, 0.299]
+        color_jitter_clip(
+            out,
+            gray_weights=[bgr_weights[channel] for channel in channels],
+            **color_jitter,
+        )
+
+    if lighting is not None and lighting["alphastd"] != 0:
+        alpha = np.random.normal(0, lighting["alphastd"], size=(1, 3))
+        eig_vec = np.array(lighting["eigvec"])
+        eig_val = np.reshape(lighting["eigval"], (1, 3))
+        rgb = np.sum(
+            eig_vec
+            * np.repeat(alpha, 3, axis=0)
+            * np.repeat(eig_val, 3, axis=0),
+            axis=1,
+        )
+        for idx, channel in enumerate(channels):
+            out[idx] += rgb[2 - channel]
+
+    for idx, channel in enumerate(channels):
+        out[idx] -= mean[channel]
+        out[idx] /= stddev[channel]
+    return out
+
+
+def clip_to_channels_first(clip, bgr=True):
+    """
+    Convert a uint8 BGR clip to a contiguous uint8 clip with the channels
+    first, without any normalization.
+    Args:
+        clip (ndarray): uint8 BGR clip with dimension of
+            `num frames` x `height` x `width` x `channel`.
+        bgr (bool): keep the BGR order, otherwise the output is RGB.
+    Returns:
+        out (ndarray): uint8 clip with dimension of
+            `channel` x `num frames` x `height` x `width`.
+    """
+    num_channels = clip.shape[3]
+    channels = list(range(num_channels)) if bgr else list(range(num_channels))[::-1]
+    out = np.empty((num_channels,) + clip.shape[:3], dtype=clip.dtype)
+    for idx, channel in enumerate(channels):
+        out[idx] = clip[..., channel]
+    return out
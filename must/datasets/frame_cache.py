@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+"""
+Cache of pre-resized frames.
+
+Frames are stored already resized to the size used by the preprocessing, as
+raw uint8 BGR pixels or re-encoded JPEG, in a few large shard files. An
+`index.json` maps every frame path of the frame lists (relative to
+`ENDOVIS_DATASET.FRAME_DIR`) to its shard, byte offset, byte size and shape,
+so frames are read by offset from memory-mapped shards.
+"""
+
+import cv2
+import json
+import logging
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from . import surgical_dataset_helper as data_helper
+from . import utils as utils
+from must.utils.env import pathmgr
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+
+
+def get_frame_cache_size(cfg):
+    """
+    Size the frames are stored at for the given config.
+    Args:
+        cfg (CfgNode): configs.
+    Returns:
+        fixed_size (int or None): side of the square frames when
+            `DATA.FIXED_RESIZE` is enabled.
+        short_side (int or None): short side of the frames otherwise.
+    """
+    if cfg.DATA.FIXED_RESIZE:
+        return data_helper.FIXED_RESIZE_SIZE, None
+    return None, max(cfg.DATA.TRAIN_JITTER_SCALES[1], cfg.DATA.TEST_CROP_SIZE)
+
+
+def resize_frame(img, fixed_size=None, short_side=None):
+    """
+    Resize a frame like the preprocessing does, either to a fixed square size
+    or keeping the aspect ratio with the given short side.
+    """
+    height, width = img.shape[:2]
+    if fixed_size is not None:
+        new_height, new_width = fixed_size, fixed_size
+    elif width < height:
+        new_width, new_height = short_side, int(np.floor(float(height) / width * short_side))
+    else:
+        new_width, new_height = int(np.floor(float(width) / height * short_side)), short_side
+    if (new_height, new_width) == (height, width):
+        return img
+    return cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+
+def _read_frame_list(list_file):
+    with pathmgr.open(list_file, "r") as f:
+        return [os.path.normpath(line.split()[3]) for line in f if len(line.split()) == 4]
+
+
+def build_frame_cache(cfg, num_threads=8, jpeg_quality=95):
+    """
+    Build the frame cache of the train and test frame lists of a config in
+    `ENDOVIS_DATASET.FRAME_CACHE_DIR`.
+    Args:
+        cfg (CfgNode): configs.
+        num_threads (int): number of threads decoding and resizing frames.
+        jpeg_quality (int): quality of the re-encoded frames when
+            `ENDOVIS_DATASET.FRAME_CACHE_FORMAT` is `jpg`.
+    """
+    cache_dir = cfg.ENDOVIS_DATASET.FRAME_CACHE_DIR
+    cache_format = cfg.ENDOVIS_DATASET.FRAME_CACHE_FORMAT
+    shard_size = int(cfg.ENDOVIS_DATASET.FRAME_CACHE_SHARD_SIZE * 1024 ** 3)
+    assert cache_format in ("raw", "jpg"), f"Unsupported frame cache format {cache_format}"
+    fixed_size, short_side = get_frame_cache_size(cfg)
+    decode_short_side = fixed_size if fixed_size is not None else short_side
+
+    frames = []
+    for list_name in (cfg.ENDOVIS_DATASET.TRAIN_LISTS, cfg.ENDOVIS_DATASET.TEST_LISTS):
+        frames.extend(_read_frame_list(os.path.join(cfg.ENDOVIS_DATASET.FRAME_LIST_DIR, list_name)))
+    frames = list(dict.fromkeys(frames))
+
+    def process(frame):
+        img = utils.load_image(os.path.join(cfg.ENDOVIS_DATASET.FRAME_DIR, frame), decode_short_side)
+        assert img is not None, f"Failed to load frame {frame}"
+        img = np.ascontiguousarray(resize_frame(img, fixed_size, short_side))
+        if cache_format == "jpg":
+            data = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])[1].tobytes()
+        else:
+            data = img.tobytes()
+        return data, img.shape[:2]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    index = {
+        "format": cache_format,
+        "fixed_size": fixed_size,
+        "short_side": short_side,
+        "shards": [],
+        "frames": {},
+    }
+    shard = None
+    offset = 0
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        for frame_idx, (frame, (data, (height, width))) in enumerate(
+            zip(frames, executor.map(process, frames))
+        ):
+            if shard is None or offset + len(data) > shard_size:
+                if shard is not None:
+                    shard.close()
+                index["shards"].append("shard_{:03d}.bin".format(len(index["shards"])))
+                shard = open(os.path.join(cache_dir, index["shards"][-1]), "wb")
+                offset = 0
+            shard.write(data)
+            index["frames"][frame] = [len(index["shards"]) - 1, offset, len(data), height, width]
+            offset += len(data)
+
+            if (frame_idx + 1) % 10000 == 0:
+                logger.info("Cached {}/{} frames".format(frame_idx + 1, len(frames)))
+    if shard is not None:
+        shard.close()
+
+    with open(os.path.join(cache_dir, INDEX_FILE), "w") as f:
+        json.dump(index, f)
+    logger.info("Cached {} frames in {} shards at {}".format(len(frames), len(index["shards"]), cache_dir))
+
+
+class FrameCache(object):
+    """
+    Reader of a frame cache. Shards are memory-mapped on first use, so every
+    dataloader worker maps its own view of them.
+    """
+
+    def __init__(self, cache_dir, frame_dir):
+        """
+        Args:
+            cache_dir (str): directory of the frame cache.
+            frame_dir (str): `ENDOVIS_DATASET.FRAME_DIR`, the frame paths of
+                the dataset are looked up relative to it.
+        """
+        self.cache_dir = cache_dir
+        self.frame_dir = frame_dir
+        with open(os.path.join(cache_dir, INDEX_FILE), "r") as f:
+            index = json.load(f)
+        self.format = index["format"]
+        self.fixed_size = index["fixed_size"]
+        self.short_side = index["short_side"]
+        self._shard_names = index["shards"]
+        self._frames = index["frames"]
+        self._shards = [None] * len(self._shard_names)
+
+    def check_size(self, cfg):
+        """
+        Check that the cache was built for the frame size of a config.
+        """
+        assert (self.fixed_size, self.short_side) == get_frame_cache_size(cfg), (
+            "Frame cache at {} was built for fixed size {} and short side {}, "
+            "rebuild it for the current config".format(self.cache_dir, self.fixed_size, self.short_side)
+        )
+
+    def _get_shard(self, shard_idx):
+        if self._shards[shard_idx] is None:
+            self._shards[shard_idx] = np.memmap(
+                os.path.join(self.cache_dir, self._shard_names[shard_idx]), dtype=np.uint8, mode="r"
+            )
+        return self._shards[shard_idx]
+
+    def load_image(self, image_path):
+        """
+        Read a frame from the cache.
+        Args:
+            image_path (str): path of the frame as given by the frame lists.
+        Returns:
+            img (ndarray): BGR frame in HWC. Raw frames are read-only views of
+                the memory-mapped shard.
+        """
+        shard_idx, offset, nbytes, height, width = self._frames[os.path.relpath(image_path, self.frame_dir)]
+        data = self._get_shard(shard_idx)[offset : offset + nbytes]
+        if self.format == "jpg":
+            return cv2.imdecode(data, flags=cv2.IMREAD_COLOR)
+        return data.reshape(height, width, 3)
+
+    def load_images(self, image_paths):
+        """
+        Read the frames of a clip from the cache.
+        """
+        return [self.load_image(image_path) for image_path in image_paths]
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""
+LRU cache of decoded frames, kept by every dataloader worker.
+
+The clips of nearby keyframes share most of their frames. With the
+`VideoBlockSampler`, a worker loads such keyframes one after the other and
+the cache returns the shared frames without reading and decoding them again.
+"""
+
+import logging
+import os
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class FrameLRU(object):
+    """
+    Decoded frames keyed by path, evicted in least recently used order once
+    they take more than `max_bytes`. Cached frames are read-only, since they
+    are shared by every clip that uses them.
+    """
+
+    def __init__(self, max_bytes, log_period=10000):
+        """
+        Args:
+            max_bytes (int): maximum size of the cached frames.
+            log_period (int): frame lookups between two logs of the hit rate.
+        """
+        self.max_bytes = max_bytes
+        self.log_period = log_period
+        self.reset()
+
+    def reset(self, worker_id=None):
+        """
+        Empty the cache and its counters, e.g. in a new dataloader worker.
+        """
+        self.worker_id = worker_id
+        self._frames = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._pid = os.getpid()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def _insert(self, path, img):
+        if img.nbytes > self.max_bytes:
+            return
+        img.flags.writeable = False
+        self._frames[path] = img
+        self.num_bytes += img.nbytes
+        while self.num_bytes > self.max_bytes:
+            self.num_bytes -= self._frames.popitem(last=False)[1].nbytes
+
+    def load(self, paths, load_fn, transform=None):
+        """
+        Load the frames of a clip, decoding only the frames not in the cache.
+        Args:
+            paths (list): paths of the frames, possibly repeated.
+            load_fn (callable): loads a list of paths and returns the list of
+                their decoded frames.
+            transform (callable or None): applied to every decoded frame
+                before it is cached, e.g. to resize it.
+        Returns:
+            imgs (list): the frames, in the order of `paths`.
+        """
+        # Frames are not shared with forked dataloader workers.
+        if self._pid != os.getpid():
+            self.reset()
+        imgs = [None] * len(paths)
+        missing = OrderedDict()
+        for idx, path in enumerate(paths):
+            img = self._frames.get(path)
+            if img is not None:
+                self._frames.move_to_end(path)
+                imgs[idx] = img
+                self.hits += 1
+            elif path in missing:
+                # Repeated frames of a clip are decoded once.
+                missing[path].append(idx)
+                self.hits += 1
+            else:
+                missing[path] = [idx]
+                self.misses += 1
+
+        if len(missing) > 0:
+            for path, img in zip(missing, load_fn(list(missing))):
+                if transform is not None:
+                    img = transform(img)
+                self._insert(path, img)
+                for idx in missing[path]:
+                    imgs[idx] = img
+
+        lookups = self.hits + self.misses
+        if self.log_period > 0 and lookups // self.log_period != (lookups - len(paths)) // self.log_period:
+            logger.info(
+                "Frame LRU of worker {}: {:.1%} hit rate over {} frames, {} frames in {:.0f} MB".format(
+                    self.worker_id, self.hit_rate, lookups, len(self._frames), self.num_bytes / 1024 ** 2
+                )
+            )
+        return imgs
@@ -7,7 +7,6 @@ import logging
 import numpy as np
 import torch
 
-from copy import deepcopy
 from .surgical_dataset import SurgicalDataset, SurgicalDatasetChunks
 from . import utils as utils
 from .build import DATASET_REGISTRY
@@ -38,7 +37,7 @@ class Grasp(SurgicalDataset):
             elif video_name=='CASE014':
                 complete_name = '{}/{}.{}'.format(video_name, str(sec).zfill(self.zero_fill), self.image_type)
                 complete_path = os.path.join(self.cfg.ENDOVIS_DATASET.FRAME_DIR,complete_name)
-                return self._image_paths[video_idx].index(complete_path)
+                return self._frame_idx(video_idx, complete_path)
             else:
                 return round((sec*30)/45) 
         except:
@@ -62,16 +61,7 @@ class Grasp(SurgicalDataset):
         # Get the path of the middle frame 
         video_idx, sec_idx, sec, center_idx = self._keyframe_indices[idx]
         video_name = self._video_idx_to_name[video_idx]
-        complete_name = '{}/{}.{}'.format(video_name, str(sec).zfill(self.zero_fill), self.image_type)
-
-        #TODO: REMOVE when all done
-        folder_to_images = "/".join(self._image_paths[video_idx][0].split('/')[:-2])
-        path_complete_name = os.path.join(folder_to_images,complete_name)
-        found_idx = self._image_paths[video_idx].index(path_complete_name)
-
-        assert path_complete_name == self._image_paths[video_idx][center_idx], f'Different paths {path_complete_name} & {self._image_paths[video_idx][center_idx]} & {sec_idx} & {sec}'
-        assert found_idx == center_idx, f'Different indexes {found_idx} & {center_idx}'
-        assert int(self._image_paths[video_idx][center_idx].split('/')[-1].replace('.'+self.image_type,''))==sec, f'Different {self._image_paths[video_idx][center_idx].split("/")[-1].replace("."+self.image_type,"")} {sec}'
+        complete_name = self._keyframe_name(video_name, sec)
 
         # Get the frame idxs for current clip.
         seq = utils.get_sequence(
@@ -83,23 +73,18 @@ class Grasp(SurgicalDataset):
         )
 
         assert center_idx in seq, f'Center index {center_idx} not in sequence {seq}'
-        clip_label_list = deepcopy(self._keyframe_boxes_and_labels[video_idx][sec_idx])
-        assert len(clip_label_list) > 0
 
         # Add labels depending on the task
         all_labels = {task:[] for task in self._region_tasks}
 
         for task in self._frame_tasks:
-            assert all(label[task]==clip_label_list[0][task] for label in clip_label_list), f'Inconsistent {task} labels for frame {complete_name}: {[label[task] for label in clip_label_list]}'
-            all_labels[task] = clip_label_list[0][task]
+            all_labels[task] = self._keyframe_indices.get_label(idx, task)
 
         extra_data = {}
                 
         # Load images of current clip.
         image_paths = [self._image_paths[video_idx][frame] for frame in seq]
-        imgs = utils.retry_load_images(
-            image_paths, backend=self.cfg.ENDOVIS_DATASET.IMG_PROC_BACKEND
-        )
+        imgs = self._load_images(image_paths)
         
         # Preprocess images and boxes
         imgs = self._images_and_boxes_preprocessing_cv2(
@@ -145,7 +130,7 @@ class Graspms(SurgicalDataset):
             elif video_name=='CASE014':
                 complete_name = '{}/{}.{}'.format(video_name, str(sec).zfill(self.zero_fill), self.image_type)
                 complete_path = os.path.join(self.cfg.ENDOVIS_DATASET.FRAME_DIR,complete_name)
-                return self._image_paths[video_idx].index(complete_path)
+                return self._frame_idx(video_idx, complete_path)
             else:
                 return round((sec*30)/45) 
         except:
@@ -168,16 +153,7 @@ class Graspms(SurgicalDataset):
         # Get the path of the middle frame 
         video_idx, sec_idx, sec, center_idx = self._keyframe_indices[idx]
         video_name = self._video_idx_to_name[video_idx]
-        complete_name = '{}/{}.{}'.format(video_name, str(sec).zfill(self.zero_fill), self.image_type)
-
-        #TODO: REMOVE when all done
-        folder_to_images = "/".join(self._image_paths[video_idx][0].split('/')[:-2])
-        path_complete_name = os.path.join(folder_to_images,complete_name)
-        found_idx = self._image_paths[video_idx].index(path_complete_name)
-
-        assert path_complete_name == self._image_paths[video_idx][center_idx], f'Different paths {path_complete_name} & {self._image_paths[video_idx][center_idx]} & {sec_idx} & {sec}'
-        assert found_idx == center_idx, f'Different indexes {found_idx} & {center_idx}'
-        assert int(self._image_paths[video_idx][center_idx].split('/')[-1].replace('.'+self.image_type,''))==sec, f'Different {self._image_paths[video_idx][center_idx].split("/")[-1].replace("."+self.image_type,"")} {sec}'
+        complete_name = self._keyframe_name(video_name, sec)
 
         sequence_pyramid = []
 
@@ -199,24 +175,20 @@ class Graspms(SurgicalDataset):
         assert center_idx in seq, f'Center index {center_idx} not in sequence {seq}'
 
         # Get the frame idxs for current clip.
-        images_pyramid = utils.process_sequences_parallel(
+        images_pyramid = utils.process_multi_rate_sequences(
             sequence_pyramid,
             video_idx,
             self.cfg,
             self._image_paths,
-            self._images_and_boxes_preprocessing_cv2
+            self._images_and_boxes_preprocessing_cv2,
+            load_fn=self._load_images,
         )
-        
-        clip_label_list = deepcopy(self._keyframe_boxes_and_labels[video_idx][sec_idx])
 
-        assert len(clip_label_list) > 0
-        
         # Add labels depending on the task
         all_labels = {task:[] for task in self._region_tasks} 
 
         for task in self._frame_tasks:
-            assert all(label[task]==clip_label_list[0][task] for label in clip_label_list), f'Inconsistent {task} labels for frame {complete_name}: {[label[task] for label in clip_label_list]}'
-            all_labels[task] = clip_label_list[0][task]
+            all_labels[task] = self._keyframe_indices.get_label(idx, task)
                 
 
         if self.cfg.NUM_GPUS>1:
@@ -243,6 +215,8 @@ class Graspchunks(SurgicalDatasetChunks):
         self.dataset_name = "Graspchunks"
 
         self.feature_paths = self.get_temporal_feature_paths_per_case(cfg.TEMPORAL_MODULE.FEATURE_PATH_TRAIN)
+        if cfg.TEMPORAL_MODULE.FEATURE_BANK:
+            self._get_feature_bank()
 
         self._sample_rate = cfg.TEMPORAL_MODULE.SAMPLING_RATE
         self._video_length = cfg.TEMPORAL_MODULE.NUM_FRAMES
@@ -257,10 +231,6 @@ class Graspchunks(SurgicalDatasetChunks):
         folder_to_images = "/".join(self._image_paths[video_idx][0].split('/')[:-2])
 
         seq_feats = chunk
-        
-        clip_label_list = deepcopy(self._keyframe_boxes_and_labels[video_idx][sec_idx])
-
-        assert len(clip_label_list) > 0
 
         # Add labels depending on the task
         all_labels = {task:[] for task in self._region_tasks} 
@@ -279,15 +249,15 @@ class Graspchunks(SurgicalDatasetChunks):
             fill_feats = [[0.] * 3072 for i in range(masked_num)]
 
         for task in self._frame_tasks:
-            all_labels[task] = clip_label_list[0][task]
+            all_labels[task] = self._keyframe_indices.get_label(idx, task)
 
         extra_data = {}
         extra_data["sequence_mask"] = chunk_mask                        
 
         feature_paths = image_paths
-        features = self._load_samples_features(feature_paths, self.cfg)
+        features = self._load_chunk_features(idx, feature_paths)
 
-        temporal_features = torch.tensor(np.array(features))
+        temporal_features = torch.from_numpy(features)
 
         frame_identifier = []
         for frame in image_paths:
@@ -13,6 +13,7 @@ from torch.utils.data.sampler import RandomSampler
 
 from . import utils as utils
 from .build import build_dataset
+from .sampler import VideoBlockSampler
 
 def detection_collate(batch):
     """
@@ -148,9 +149,9 @@ def shuffle_dataset(loader, cur_epoch):
             loader.sampler
         )
     assert isinstance(
-        sampler, (RandomSampler, DistributedSampler)
+        sampler, (RandomSampler, DistributedSampler, VideoBlockSampler)
     ), "Sampler type '{}' not supported".format(type(sampler))
     # RandomSampler handles shuffling automatically
-    if isinstance(sampler, DistributedSampler):
-        # DistributedSampler shuffles data based on epoch
+    if isinstance(sampler, (DistributedSampler, VideoBlockSampler)):
+        # DistributedSampler and VideoBlockSampler shuffle data based on epoch
         sampler.set_epoch(cur_epoch)
@@ -2,11 +2,9 @@
 # Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
 
 import itertools
-import os
 import logging
 import numpy as np
 
-from copy import deepcopy
 from .surgical_dataset import SurgicalDataset, SurgicalDatasetChunks
 from . import utils as utils
 from .build import DATASET_REGISTRY
@@ -56,17 +54,7 @@ class Misaw(SurgicalDataset):
         # Get the path of the middle frame 
         video_idx, sec_idx, sec, center_idx = self._keyframe_indices[idx]
         video_name = self._video_idx_to_name[video_idx]
-        complete_name = '{}/{}.{}'.format(video_name, str(sec).zfill(self.zero_fill), self.image_type)
-
-        #TODO: REMOVE when all done
-        folder_to_images = "/".join(self._image_paths[video_idx][0].split('/')[:-2])
-        path_complete_name = os.path.join(folder_to_images,complete_name)
-
-        found_idx = self._image_paths[video_idx].index(path_complete_name)
-
-        assert path_complete_name == self._image_paths[video_idx][center_idx], f'Different paths {path_complete_name} & {self._image_paths[video_idx][center_idx]} & {sec_idx} & {sec}'
-        assert found_idx == center_idx, f'Different indexes {found_idx} & {center_idx}'
-        assert int(self._image_paths[video_idx][center_idx].split('/')[-1].split('_')[-1].replace('.'+self.image_type,''))==sec, f'Different {self._image_paths[video_idx][center_idx].split("/")[-1].replace("."+self.image_type,"")} {sec}'
+        complete_name = self._keyframe_name(video_name, sec)
 
         # Get the frame idxs for current clip.
         seq = utils.get_sequence(
@@ -78,23 +66,18 @@ class Misaw(SurgicalDataset):
         )
 
         assert center_idx in seq, f'Center index {center_idx} not in sequence {seq}'
-        clip_label_list = deepcopy(self._keyframe_boxes_and_labels[video_idx][sec_idx])
-        assert len(clip_label_list) > 0
 
         # Add labels depending on the task
         all_labels = {task:[] for task in self._region_tasks}
 
         for task in self._frame_tasks:
-            assert all(label[task]==clip_label_list[0][task] for label in clip_label_list), f'Inconsistent {task} labels for frame {complete_name}: {[label[task] for label in clip_label_list]}'
-            all_labels[task] = clip_label_list[0][task]
+            all_labels[task] = self._keyframe_indices.get_label(idx, task)
 
         extra_data = {}
                 
         # Load images of current clip.
         image_paths = [self._image_paths[video_idx][frame] for frame in seq]
-        imgs = utils.retry_load_images(
-            image_paths, backend=self.cfg.ENDOVIS_DATASET.IMG_PROC_BACKEND
-        )
+        imgs = self._load_images(image_paths)
         
         # Preprocess images and boxes
         imgs = self._images_and_boxes_preprocessing_cv2(
@@ -149,17 +132,7 @@ class Misawms(SurgicalDataset):
         # Get the path of the middle frame 
         video_idx, sec_idx, sec, center_idx = self._keyframe_indices[idx]
         video_name = self._video_idx_to_name[video_idx]
-        complete_name = '{}/{}.{}'.format(video_name, str(sec).zfill(self.zero_fill), self.image_type)
-
-        #TODO: REMOVE when all done
-        folder_to_images = "/".join(self._image_paths[video_idx][0].split('/')[:-2])
-        path_complete_name = os.path.join(folder_to_images,complete_name)
-
-        found_idx = self._image_paths[video_idx].index(path_complete_name)
-
-        assert path_complete_name == self._image_paths[video_idx][center_idx], f'Different paths {path_complete_name} & {self._image_paths[video_idx][center_idx]} & {sec_idx} & {sec}'
-        assert found_idx == center_idx, f'Different indexes {found_idx} & {center_idx}'
-        assert int(self._image_paths[video_idx][center_idx].split('/')[-1].split('_')[-1].replace('.'+self.image_type,''))==sec, f'Different {self._image_paths[video_idx][center_idx].split("/")[-1].replace("."+self.image_type,"")} {sec}'
+        complete_name = self._keyframe_name(video_name, sec)
 
         sequence_pyramid = []
 
@@ -179,26 +152,23 @@ class Misawms(SurgicalDataset):
             sequence_pyramid.append(seq)
 
         assert center_idx in seq, f'Center index {center_idx} not in sequence {seq}'
-        clip_label_list = deepcopy(self._keyframe_boxes_and_labels[video_idx][sec_idx])
 
-        assert len(clip_label_list) > 0
-        
         # Add labels depending on the task
         all_labels = {task:[] for task in self._region_tasks} 
 
         for task in self._frame_tasks:
-            assert all(label[task]==clip_label_list[0][task] for label in clip_label_list), f'Inconsistent {task} labels for frame {complete_name}: {[label[task] for label in clip_label_list]}'
-            all_labels[task] = clip_label_list[0][task]
+            all_labels[task] = self._keyframe_indices.get_label(idx, task)
                 
 
 
         # Get the frame idxs for current clip.
-        images_pyramid = utils.process_sequences_parallel(
+        images_pyramid = utils.process_multi_rate_sequences(
             sequence_pyramid,
             video_idx,
             self.cfg,
             self._image_paths,
-            self._images_and_boxes_preprocessing_cv2
+            self._images_and_boxes_preprocessing_cv2,
+            load_fn=self._load_images,
         )
 
         extra_data = {}
@@ -228,6 +198,8 @@ class Misawchunks(SurgicalDatasetChunks):
         self.image_type = "jpg"
 
         self.feature_paths = self.get_temporal_feature_paths_per_case(cfg.TEMPORAL_MODULE.FEATURE_PATH_TRAIN)
+        if cfg.TEMPORAL_MODULE.FEATURE_BANK:
+            self._get_feature_bank()
 
         self._sample_rate = cfg.TEMPORAL_MODULE.SAMPLING_RATE
         self._video_length = cfg.TEMPORAL_MODULE.NUM_FRAMES
@@ -260,10 +232,6 @@ class Misawchunks(SurgicalDatasetChunks):
         folder_to_images = "/".join(self._image_paths[video_idx][0].split('/')[:-2])
 
         seq_feats = chunk
-        
-        clip_label_list = deepcopy(self._keyframe_boxes_and_labels[video_idx][sec_idx])
-
-        assert len(clip_label_list) > 0
 
         # Add labels depending on the task
         all_labels = {task:[] for task in self._region_tasks} 
@@ -282,15 +250,15 @@ class Misawchunks(SurgicalDatasetChunks):
             fill_feats = [[0.] * 3072 for i in range(masked_num)]
 
         for task in self._frame_tasks:
-            all_labels[task] = clip_label_list[0][task]
+            all_labels[task] = self._keyframe_indices.get_label(idx, task)
 
         extra_data = {}
         extra_data["sequence_mask"] = chunk_mask                        
 
         feature_paths = image_paths
-        features = self._load_samples_features(feature_paths, self.cfg)
+        features = self._load_chunk_features(idx, feature_paths)
 
-        temporal_features = torch.tensor(np.array(features))
+        temporal_features = torch.from_numpy(features)
 
         frame_identifier = []
         for frame in image_paths:
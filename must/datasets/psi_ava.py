@@ -2,157 +2,40 @@
 # Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
 
 import itertools
-import os
 import logging
 import numpy as np
 import time
 
 from copy import deepcopy
-from .surgical_dataset import SurgicalDataset
+from .surgical_dataset import SurgicalDataset, SurgicalDatasetChunks
 from . import utils as utils
 from .build import DATASET_REGISTRY
 import torch
-import json
 
 from scipy.optimize import linear_sum_assignment
 
-from tqdm import tqdm
-import glob
-
 logger = logging.getLogger(__name__)
 
 
 @DATASET_REGISTRY.register()
-class Psi_ava_transformer(SurgicalDataset):
+class Psi_ava_transformer(SurgicalDatasetChunks):
     """
     PSI-AVA dataloader.
     """
     def __init__(self, cfg, split, include_subvideo=True):
-        self.cfg = cfg
-        self.include_subvideo = include_subvideo
-
-        self.fps = 1
-        self.zero_fill = 9
-        self.image_type = "jpg"
-
-        self._split = split
-        self._num_classes = {key: n_class for key, n_class in zip(cfg.TASKS.TASKS, cfg.TASKS.NUM_CLASSES)}
+        super().__init__(cfg, split, include_subvideo)
 
         self.dataset_name = "GraSP Transformer"
-
-        self.fps_videos = {'CASE021','CASE041','CASE047','CASE050','CASE051','CASE053'}
-        super().__init__(cfg, split)
-
-        self.assignation = json.load(open("/media/lambda002/SSD6/srodriguezr2/endovis/tesis/TAPIS_official/TAPIS/association_30fps.json"))
         self.do_assignation = True if cfg.TRAIN.DATASET == "Psi_ava_transformer"  else False
 
         self.feature_paths = self.get_temporal_feature_paths_per_case(cfg.TEMPORAL_MODULE.FEATURE_PATH_TRAIN)
+        if cfg.TEMPORAL_MODULE.FEATURE_BANK:
+            self._get_feature_bank()
 
         self._sample_rate = cfg.TEMPORAL_MODULE.SAMPLING_RATE
         self._video_length = cfg.TEMPORAL_MODULE.NUM_FRAMES
         self._seq_len = self._video_length * self._sample_rate
 
-    def keyframe_mapping(self, video_idx, sec_idx, sec):
-        try:
-            video_name = self._video_idx_to_name[video_idx]
-            if video_name in self.fps_videos:
-                return sec
-            elif video_name=='CASE014':
-                complete_name = '{}/{}.{}'.format(video_name, str(sec).zfill(self.zero_fill), self.image_type)
-                complete_path = os.path.join(self.cfg.ENDOVIS_DATASET.FRAME_DIR,complete_name)
-                return self._image_paths[video_idx].index(complete_path)
-            else:
-                return round((sec*30)/45) 
-        except:
-            breakpoint()
-
-    def _load_samples_features(self, samples, cfg, include_subvideo=False):
-        if self._split == "train":
-            feat_path = cfg.TEMPORAL_MODULE.FEATURE_PATH_TRAIN
-        elif self._split == "val":
-            feat_path = cfg.TEMPORAL_MODULE.FEATURE_PATH_VAL
-
-        output_features = []
-
-        if self.do_assignation:
-            inverted_assignation = {value: key for key, value in self.assignation.items()}
-            key_list = list(inverted_assignation.keys())
-        
-        for img in samples:
-            #if self.do_assignation:
-                #img = inverted_assignation[img]
-            
-            if include_subvideo:
-                case, subvideo, frame = img.split("/")[-3:]
-
-                frame = f"{frame[:-4]}.pth"
-                
-                feature_path = os.path.join(feat_path, case, subvideo, frame)
-            else:
-                case, frame = img.split("/")[-2:]
-
-                frame = f"{frame[:-4]}.pth"
-                
-                feature_path = os.path.join(feat_path, case, frame)
-
-            feature_list = torch.load(feature_path)
-
-            feat = np.concatenate(feature_list)
-
-            output_features.append(feat.tolist())
-
-        return output_features
-    
-    def _load_features(self, cfg):
-        if self._split == "train":
-            feat_path = cfg.TEMPORAL_MODULE.FEATURE_PATH_TRAIN
-        elif self._split == "val":
-            feat_path = cfg.TEMPORAL_MODULE.FEATURE_PATH_VAL
-
-        videos_list = os.listdir(feat_path)
-        feats_dict = {}
-
-        for video in tqdm(videos_list, desc="Getting video features..."):
-            feat_paths = glob.glob(os.path.join(feat_path,video, '*.pth'))
-            for feature in feat_paths:
-                feat_list = torch.load(feature)
-                feat = np.concatenate(feat_list)
-
-                case, img_name = feature.split("/")[-2:]
-                img_key = f"{case}/{img_name[:-4]}.jpg"
-                feats_dict[img_key] = feat
-        
-        self._feats_dict = feats_dict
-    
-    def _get_feature_path_names(self, image_paths):
-        
-        features_paths = []
-        for original_path in image_paths:
-            path_parts = original_path.split('/')
-            case_folder = path_parts[-2]
-            image_filename = path_parts[-1]
-            new_path = os.path.join(case_folder, image_filename)
-            features_paths.append(new_path)
-
-        return features_paths
-
-    def get_temporal_feature_paths_per_case(self, feature_paths):
-        case_dict = {}
-
-        for case in os.listdir(feature_paths):
-            if case not in case_dict:
-                case_dict[case] = []
-            case_path = os.path.join(feature_paths, case)
-        
-            for frame in os.listdir(case_path):
-                frame_path = os.path.join(case, frame).replace('pth', self.image_type)
-                #if self.do_assignation:
-                    #frame_path = self.assignation[frame_path]
-                case_dict[case].append(frame_path)
-
-        return case_dict
-
-
     def __getitem__(self, idx):
         
         # Get the path of the middle frame 
@@ -162,10 +45,6 @@ class Psi_ava_transformer(SurgicalDataset):
         folder_to_images = "/".join(self._image_paths[video_idx][0].split('/')[:-2])
 
         seq_feats = chunk
-        
-        clip_label_list = deepcopy(self._keyframe_boxes_and_labels[video_idx][sec_idx])
-
-        assert len(clip_label_list) > 0
 
         # Add labels depending on the task
         all_labels = {task:[] for task in self._region_tasks} 
@@ -184,13 +63,13 @@ class Psi_ava_transformer(SurgicalDataset):
             fill_feats = [[0.] * 3072 for i in range(masked_num)]
 
         for task in self._frame_tasks:
-            all_labels[task] = clip_label_list[0][task]
+            all_labels[task] = self._keyframe_indices.get_label(idx, task)
 
         extra_data = {}
         extra_data["sequence_mask"] = chunk_mask                        
 
         feature_paths = image_paths
-        features = self._load_samples_features(feature_paths, self.cfg)
+        features = self._load_chunk_features(idx, feature_paths)
 
         temporal_features = torch.tensor(np.array(features))
 
@@ -241,16 +120,7 @@ class Psi_ava(SurgicalDataset):
         # Get the path of the middle frame 
         video_idx, sec_idx, sec, center_idx = self._keyframe_indices[idx]
         video_name = self._video_idx_to_name[video_idx]
-        complete_name = '{}/{}.{}'.format(video_name, str(sec).zfill(self.zero_fill), self.image_type)
-
-        #TODO: REMOVE when all done
-        folder_to_images = "/".join(self._image_paths[video_idx][0].split('/')[:-2])
-        path_complete_name = os.path.join(folder_to_images,complete_name)
-        found_idx = self._image_paths[video_idx].index(path_complete_name)
-
-        assert path_complete_name == self._image_paths[video_idx][center_idx], f'Different paths {path_complete_name} & {self._image_paths[video_idx][center_idx]}'
-        assert found_idx == center_idx, f'Different indexes {found_idx} & {center_idx}'
-        assert int(self._image_paths[video_idx][center_idx].split('/')[-1].replace('.'+self.image_type,''))==sec, f'Different {self._image_paths[video_idx][center_idx].split("/")[-1].replace("."+self.image_type,"")} {sec}'
+        complete_name = self._keyframe_name(video_name, sec)
 
         # Get the frame idxs for current clip.
         seq = utils.get_sequence(
@@ -259,12 +129,11 @@ class Psi_ava(SurgicalDataset):
             self._sample_rate,
             num_frames=len(self._image_paths[video_idx]),
         )
-        clip_label_list = deepcopy(self._keyframe_boxes_and_labels[video_idx][sec_idx])
-        assert len(clip_label_list) > 0
+        clip_label_list = self._keyframe_indices.get_annotations(idx) if len(self._region_tasks) else []
 
         # Get boxes and labels for current clip.
         boxes = []
-        
+
         # Add labels depending on the task
         all_labels = {task:[] for task in self._region_tasks} 
         
@@ -329,8 +198,7 @@ class Psi_ava(SurgicalDataset):
                 all_labels[task] = binary_task_label[1:]
 
         for task in self._frame_tasks:
-            assert all(label[task]==clip_label_list[0][task] for label in clip_label_list), f'Inconsistent {task} labels for frame {complete_name}: {[label[task] for label in clip_label_list]}'
-            all_labels[task] = clip_label_list[0][task]
+            all_labels[task] = self._keyframe_indices.get_label(idx, task)
 
         extra_data = {}
         if self.cfg.REGIONS.ENABLE:
@@ -348,9 +216,7 @@ class Psi_ava(SurgicalDataset):
                 
         # Load images of current clip.
         image_paths = [self._image_paths[video_idx][frame] for frame in seq]
-        imgs = utils.retry_load_images(
-            image_paths, backend=self.cfg.ENDOVIS_DATASET.IMG_PROC_BACKEND
-        )
+        imgs = self._load_images(image_paths)
         
         # Preprocess images and boxes
         imgs, boxes = self._images_and_boxes_preprocessing_cv2(
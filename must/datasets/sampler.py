@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+Sampler that keeps nearby keyframes of a video together.
+
+Consecutive keyframes of a video share most of the frames of their clips, but
+a `RandomSampler` scatters them across the dataloader workers, so every frame
+is decoded once for every clip it belongs to. `VideoBlockSampler` shuffles
+blocks of consecutive keyframes of the same video instead of single
+keyframes, and lays the blocks out so that every slot of the batches of a
+worker goes through a run of blocks. Batches still mix keyframes of different
+videos, while the frame cache of every worker sees the keyframes of a block
+one after the other.
+"""
+
+import math
+import numpy as np
+from torch.utils.data.sampler import Sampler
+
+import must.utils.distributed as du
+
+
+class VideoBlockSampler(Sampler):
+    """
+    Shuffles the samples of a dataset in blocks of `block_size` consecutive
+    samples of the same video. Like `DistributedSampler`, every process gets
+    an equal share of the samples and the order changes with `set_epoch`.
+    """
+
+    def __init__(
+        self,
+        video_idx,
+        sample_idx,
+        block_size,
+        batch_size,
+        num_workers,
+        num_replicas=None,
+        rank=None,
+        seed=0,
+    ):
+        """
+        Args:
+            video_idx (ndarray): video of every sample of the dataset.
+            sample_idx (ndarray): position of every sample in its video.
+            block_size (int): number of consecutive samples of a block.
+            batch_size (int): batch size of every process.
+            num_workers (int): number of dataloader workers of every process.
+            num_replicas (int or None): number of processes, the world size
+                if None.
+            rank (int or None): rank of the current process, the global rank
+                if None.
+            seed (int): seed of the shuffling, combined with the epoch.
+        """
+        assert block_size > 0, "Blocks need at least one sample"
+        self.num_replicas = du.get_world_size() if num_replicas is None else num_replicas
+        self.rank = du.get_rank() if rank is None else rank
+        self.seed = seed
+        self.epoch = 0
+
+        video_idx = np.asarray(video_idx)
+        order = np.lexsort((np.asarray(sample_idx), video_idx))
+        # Blocks start at every new video and every `block_size` samples.
+        video_starts = np.flatnonzero(np.diff(video_idx[order], prepend=-1) != 0)
+        video_ends = np.append(video_starts[1:], len(order))
+        starts = np.concatenate(
+            [np.arange(start, end, block_size) for start, end in zip(video_starts, video_ends)]
+        )
+        self.blocks = np.split(order, starts[1:])
+
+        self.num_samples = int(math.ceil(len(order) / self.num_replicas))
+        self.total_size = self.num_samples * self.num_replicas
+        # Worker `w` loads batches `w`, `w + num_workers`, ... and slot `s` of
+        # its batches reads stream `w * batch_size + s`.
+        self.num_streams = max(1, batch_size * max(1, num_workers))
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        indices = np.concatenate([self.blocks[idx] for idx in rng.permutation(len(self.blocks))])
+        # Pad by repeating the first samples, so every process gets the same
+        # number of samples, and give every process a contiguous share.
+        indices = np.resize(indices, self.total_size)
+        indices = indices[self.rank * self.num_samples : (self.rank + 1) * self.num_samples]
+
+        streams = np.array_split(indices, self.num_streams)
+        layout = np.full((len(streams), len(streams[0])), -1, dtype=np.int64)
+        for idx, stream in enumerate(streams):
+            layout[idx, : len(stream)] = stream
+        layout = layout.T.reshape(-1)
+        return iter(layout[layout >= 0].tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+    def set_epoch(self, epoch):
+        """
+        Set the epoch, which changes the order of the blocks.
+        """
+        self.epoch = epoch
@@ -10,7 +10,10 @@ import json
 
 from . import surgical_dataset_helper as data_helper
 from . import cv2_transform as cv2_transform
+from .frame_cache import FrameCache, get_frame_cache_size, resize_frame
+from .frame_lru import FrameLRU
 from . import utils as utils
+from must.utils.feature_store import FeatureBank, FeatureStoreReader
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +22,8 @@ class SurgicalDataset(torch.utils.data.Dataset):
     We adapt the AVA Dataset management in Slowfast to manage Endoscopic Vision databases.
     """
 
+    _fixed_resize_size = data_helper.FIXED_RESIZE_SIZE
+
     def __init__(self, cfg, split):
         self.cfg = cfg
         self._split = split
@@ -45,13 +50,139 @@ class SurgicalDataset(torch.utils.data.Dataset):
         else:
             self._crop_size = cfg.DATA.TEST_CROP_SIZE
             self._test_force_flip = cfg.ENDOVIS_DATASET.TEST_FORCE_FLIP
+
+        # Decoding params.
+        if cfg.ENDOVIS_DATASET.IMG_PROC_BACKEND == "frame_cache":
+            self._frame_cache = FrameCache(cfg.ENDOVIS_DATASET.FRAME_CACHE_DIR, cfg.ENDOVIS_DATASET.FRAME_DIR)
+            self._frame_cache.check_size(cfg)
+        self._decode_threads = (
+            cfg.DATA_LOADER.NUM_DECODE_THREADS if cfg.DATA_LOADER.ENABLE_MULTI_THREAD_DECODE else 1
+        )
+        self._video_reader = None
+        if cfg.ENDOVIS_DATASET.IMG_PROC_BACKEND == "video":
+            assert cfg.DATA.DECODING_BACKEND == "pyav", (
+                "Videos are decoded with pyav, got {}".format(cfg.DATA.DECODING_BACKEND)
+            )
+            from .video_reader import VideoReader
+
+            self._video_reader = VideoReader(
+                cache_size=cfg.ENDOVIS_DATASET.VIDEO_CACHE_SIZE,
+                max_gap=cfg.ENDOVIS_DATASET.VIDEO_SEEK_GAP,
+                num_threads=self._decode_threads,
+            )
+        self._frame_lru = None
+        if cfg.DATA_LOADER.FRAME_LRU_MB > 0:
+            self._frame_lru = FrameLRU(int(cfg.DATA_LOADER.FRAME_LRU_MB * 1024 ** 2))
+            self._lru_fixed_size, self._lru_short_side = get_frame_cache_size(cfg)
+        self._decode_short_side = None
+        if cfg.DATA_LOADER.REDUCED_DECODE:
+            # Smallest short side needed by `_images_and_boxes_preprocessing_cv2`.
+            if cfg.DATA.FIXED_RESIZE:
+                self._decode_short_side = self._fixed_resize_size
+            elif self._split == "train" and not cfg.DATA.JUST_CENTER:
+                self._decode_short_side = self._jitter_max_scale
+            else:
+                self._decode_short_side = self._crop_size
         
+        # Frame path -> position in the video, built per video on first lookup.
+        self._frame_index = {}
+        self._feature_bank = None
         self._load_data(cfg)
     
     @abstractmethod
     def keyframe_mapping(self, video_idx, sec_idx, sec):
         pass
 
+    def _keyframe_name(self, video_name, sec):
+        """
+        Name of the keyframe of a second, relative to the frames directory.
+
+        Args:
+            video_name (str): name of the video.
+            sec (int): second (frame number) of the keyframe.
+
+        Returns:
+            (str): the frame name, e.g. `video01/000123.jpg`.
+        """
+        return '{}/{}.{}'.format(video_name, str(sec).zfill(self.zero_fill), self.image_type)
+
+    def _frame_idx(self, video_idx, frame_path):
+        """
+        Position of a frame in the frame list of its video.
+
+        Args:
+            video_idx (int): index of the video.
+            frame_path (str): full path of the frame.
+
+        Returns:
+            (int): index of the frame in `self._image_paths[video_idx]`.
+        """
+        if video_idx not in self._frame_index:
+            self._frame_index[video_idx] = {
+                path: idx for idx, path in enumerate(self._image_paths[video_idx])
+            }
+        return self._frame_index[video_idx][frame_path]
+
+    def _get_feature_bank(self):
+        """
+        Shared-memory bank with the features of every annotated frame of the
+        split, whose rows are the frame rows of `self._keyframe_indices`.
+        Datasets call it at the end of `__init__`, so the bank is built (or
+        mapped) before the dataloader workers are forked.
+
+        Returns:
+            (FeatureBank): the feature bank of the split.
+        """
+        if self._feature_bank is None:
+            if self._split == "train":
+                feat_path = self.cfg.TEMPORAL_MODULE.FEATURE_PATH_TRAIN
+            else:
+                feat_path = self.cfg.TEMPORAL_MODULE.FEATURE_PATH_VAL
+            offsets = self._keyframe_indices.video_offsets
+            frame_names = [
+                self._keyframe_name(video_name, sec)
+                for video_idx, video_name in enumerate(self._video_idx_to_name)
+                for sec in self._keyframe_indices.frame_secs[offsets[video_idx] : offsets[video_idx + 1]].tolist()
+            ]
+            self._feature_bank = FeatureBank(feat_path, frame_names, self.cfg.TEMPORAL_MODULE.FEATURE_BANK_DIR)
+        return self._feature_bank
+
+    def _load_chunk_features(self, idx, image_paths):
+        """
+        Load the features of the frames of a chunk, gathered from the feature
+        bank with `TEMPORAL_MODULE.FEATURE_BANK` or read by
+        `_load_samples_features` otherwise.
+
+        Args:
+            idx (int): index of the chunk.
+            image_paths (list): frame names of the unmasked frames of the chunk.
+
+        Returns:
+            features (ndarray or list): the features of the frames.
+        """
+        if self.cfg.TEMPORAL_MODULE.FEATURE_BANK:
+            rows = self._keyframe_indices.frame_rows(idx)[: len(image_paths)]
+            return self._get_feature_bank().gather(rows)
+        return self._load_samples_features(image_paths, self.cfg)
+
+    def _verify_keyframes(self):
+        """
+        Check once that the center frame of every keyframe is the frame named
+        after its second, so `__getitem__` can trust the precomputed indices.
+        """
+        for video_idx, video_paths in enumerate(self._image_paths):
+            assert len(set(video_paths)) == len(video_paths), f'Repeated frames in video {self._video_idx_to_name[video_idx]}'
+
+        for idx in range(len(self._keyframe_indices)):
+            video_idx, sec_idx, sec, center_idx = self._keyframe_indices[idx]
+            video_paths = self._image_paths[video_idx]
+            folder_to_images = "/".join(video_paths[0].split('/')[:-2])
+            path_complete_name = os.path.join(
+                folder_to_images, self._keyframe_name(self._video_idx_to_name[video_idx], sec)
+            )
+            assert path_complete_name == video_paths[center_idx], f'Different paths {path_complete_name} & {video_paths[center_idx]} & {sec_idx} & {sec}'
+        logger.info("Verified {} keyframes".format(len(self._keyframe_indices)))
+
     def _load_data(self, cfg):
         """
         Load frame paths and annotations from files
@@ -63,7 +194,18 @@ class SurgicalDataset(torch.utils.data.Dataset):
         (
             self._image_paths,
             self._video_idx_to_name,
-        ) = data_helper.load_image_lists(cfg, is_train=(self._split == "train"))
+            frame_ids,
+        ) = data_helper.load_image_lists(cfg, is_train=(self._split == "train"), return_frame_ids=True)
+        if self._video_reader is not None:
+            # Frame path -> (video file, frame index in the video).
+            stride = cfg.ENDOVIS_DATASET.VIDEO_FRAME_STRIDE
+            self._video_frames = {}
+            for video_idx, video_name in enumerate(self._video_idx_to_name):
+                video_path = os.path.join(
+                    cfg.ENDOVIS_DATASET.VIDEO_DIR, video_name + cfg.ENDOVIS_DATASET.VIDEO_EXT
+                )
+                for path, frame_id in zip(self._image_paths[video_idx], frame_ids[video_idx]):
+                    self._video_frames[path] = (video_path, frame_id * stride)
 
         # Loading annotations for boxes and labels.
         boxes_and_labels = data_helper.load_boxes_and_labels(
@@ -78,20 +220,20 @@ class SurgicalDataset(torch.utils.data.Dataset):
 
         # Get indices of keyframes and corresponding boxes and labels.
         if cfg.TEMPORAL_MODULE.CHUNKS==False:
-            (
-                self._keyframe_indices,
-                self._keyframe_boxes_and_labels,
-            ) = data_helper.get_keyframe_data(boxes_and_labels, self.keyframe_mapping)
+            self._keyframe_indices = data_helper.get_keyframe_data(
+                boxes_and_labels,
+                self.keyframe_mapping,
+                [task for task in cfg.TASKS.TASKS if task in self._frame_tasks],
+                keep_annotations=len(self._region_tasks) > 0,
+            )
         else:
-            (
-                self._keyframe_indices,
-                self._keyframe_boxes_and_labels,
-            ) = data_helper.get_keyframe_data_chunks(boxes_and_labels, self.keyframe_mapping, self.cfg, self._split)
-
-                # Calculate the number of used boxes.
-        self._num_boxes_used = data_helper.get_num_boxes_used(
-            self._keyframe_indices, self._keyframe_boxes_and_labels
-        )
+            self._keyframe_indices = data_helper.get_keyframe_data_chunks(boxes_and_labels, self.keyframe_mapping, self.cfg, self._split)
+
+        if cfg.DATA.VERIFICATIONS and not cfg.TEMPORAL_MODULE.CHUNKS:
+            self._verify_keyframes()
+
+        # Calculate the number of used boxes.
+        self._num_boxes_used = self._keyframe_indices.num_boxes
 
         self.print_summary()
 
@@ -121,6 +263,82 @@ class SurgicalDataset(torch.utils.data.Dataset):
         """
         return len(self._keyframe_indices)
 
+    def _load_images(self, image_paths):
+        """
+        Read and decode the frames of a clip.
+
+        Args:
+            image_paths (list): paths of the frames.
+
+        Returns:
+            imgs (list or tensor): the decoded frames.
+        """
+        if self._frame_lru is None:
+            return self._decode_images(image_paths, self.cfg.ENDOVIS_DATASET.IMG_PROC_BACKEND)
+        imgs = self._frame_lru.load(
+            image_paths,
+            lambda paths: self._decode_images(paths, "cv2"),
+            transform=self._resize_cached_frame,
+        )
+        if self.cfg.ENDOVIS_DATASET.IMG_PROC_BACKEND == "pytorch":
+            imgs = torch.as_tensor(np.stack(imgs))
+        return imgs
+
+    def _decode_images(self, image_paths, backend):
+        """
+        Read and decode frames with the configured backend.
+
+        Args:
+            image_paths (list): paths of the frames.
+            backend (str): `pytorch` to get the frames as a tensor, or `cv2`.
+
+        Returns:
+            imgs (list or tensor): the decoded frames.
+        """
+        if self.cfg.ENDOVIS_DATASET.IMG_PROC_BACKEND == "frame_cache":
+            return self._frame_cache.load_images(image_paths)
+        if self._video_reader is not None:
+            return self._load_video_frames(image_paths)
+        return utils.retry_load_images(
+            image_paths,
+            backend=backend,
+            num_threads=self._decode_threads,
+            min_short_side=self._decode_short_side,
+        )
+
+    def _resize_cached_frame(self, img):
+        """
+        Shrink a frame to the size the preprocessing resizes it to, as the
+        frame cache does, before keeping it in the frame LRU.
+        """
+        if self._lru_fixed_size is None and min(img.shape[:2]) <= self._lru_short_side:
+            return img
+        return resize_frame(img, self._lru_fixed_size, self._lru_short_side)
+
+    def _load_video_frames(self, image_paths):
+        """
+        Decode the frames of a clip from their videos. The frames of a clip
+        usually belong to one video and are decoded in a single pass.
+
+        Args:
+            image_paths (list): paths of the frames in the frame lists.
+
+        Returns:
+            imgs (list): the decoded BGR frames.
+        """
+        frames_per_video = {}
+        for idx, path in enumerate(image_paths):
+            video_path, frame_idx = self._video_frames[path]
+            frames_per_video.setdefault(video_path, ([], []))
+            frames_per_video[video_path][0].append(idx)
+            frames_per_video[video_path][1].append(frame_idx)
+
+        imgs = [None] * len(image_paths)
+        for video_path, (rows, frame_indices) in frames_per_video.items():
+            for row, img in zip(rows, self._video_reader.load_frames(video_path, frame_indices)):
+                imgs[row] = img
+        return imgs
+
     def _images_and_boxes_preprocessing_cv2(self, imgs):
         """
         This function performs preprocessing for the input images and
@@ -132,13 +350,15 @@ class SurgicalDataset(torch.utils.data.Dataset):
         Returns:
             imgs (tensor): list of preprocessed images.
         """
+        if self.cfg.DATA.FUSED_PREPROCESSING:
+            return self._clip_preprocessing_cv2(imgs)
 
         height, width, _ = imgs[0].shape
 
         # The image now is in HWC, BGR format.
         if self._split == "train" and not self.cfg.DATA.JUST_CENTER:  # "train"
             if self.cfg.DATA.FIXED_RESIZE:
-                imgs = [cv2_transform.scale_resize(250, img) for img in imgs]
+                imgs = [cv2_transform.scale_resize(self._fixed_resize_size, img) for img in imgs]
 
             else:
                 imgs = cv2_transform.random_short_side_scale_jitter_list(
@@ -159,7 +379,7 @@ class SurgicalDataset(torch.utils.data.Dataset):
         elif self._split == "val" or self.cfg.DATA.JUST_CENTER:
             # Short side to test_scale. Non-local and STRG uses 256.
             if self.cfg.DATA.FIXED_RESIZE:
-                imgs = [cv2_transform.scale_resize(250, img) for img in imgs]
+                imgs = [cv2_transform.scale_resize(self._fixed_resize_size, img) for img in imgs]
             else:
                 imgs = [cv2_transform.scale(self._crop_size, img) for img in imgs]
 
@@ -232,6 +452,100 @@ class SurgicalDataset(torch.utils.data.Dataset):
 
         return imgs
 
+    def _clip_preprocessing_cv2(self, imgs):
+        """
+        Same preprocessing as `_images_and_boxes_preprocessing_cv2` on a single
+        clip array. The frames are resized into one uint8 clip, cropped and
+        flipped as views, and converted to a normalized float32 clip with a
+        single allocation.
+
+        Args:
+            imgs (list): the BGR images in HWC.
+
+        Returns:
+            imgs (tensor): the preprocessed clip in CTHW. uint8 and neither
+                flipped nor normalized when `DATA.BATCH_TRANSFORM` is enabled.
+        """
+        height, width, _ = imgs[0].shape
+
+        if self._split == "train" and not self.cfg.DATA.JUST_CENTER:  # "train"
+            if self.cfg.DATA.FIXED_RESIZE:
+                size = (self._fixed_resize_size, self._fixed_resize_size)
+            else:
+                short_side = int(
+                    round(
+                        1.0
+                        / np.random.uniform(
+                            1.0 / self._jitter_max_scale,
+                            1.0 / self._jitter_min_scale,
+                        )
+                    )
+                )
+                size = cv2_transform.get_short_side_scale_size(
+                    height, width, short_side
+                )
+            clip = cv2_transform.resize_clip(imgs, *size)
+            clip = cv2_transform.random_crop_clip(clip, self._crop_size)
+
+            if (
+                self.random_horizontal_flip
+                and not self.cfg.DATA.BATCH_TRANSFORM
+                and np.random.uniform() < 0.5
+            ):
+                clip = clip[:, :, ::-1]
+        elif self._split == "val" or self.cfg.DATA.JUST_CENTER:
+            if self.cfg.DATA.FIXED_RESIZE:
+                size = (self._fixed_resize_size, self._fixed_resize_size)
+            else:
+                size = cv2_transform.get_short_side_scale_size(
+                    height, width, self._crop_size
+                )
+            clip = cv2_transform.resize_clip(imgs, *size)
+            clip = cv2_transform.center_crop_clip(clip, self._crop_size)
+
+            if (
+                not self.cfg.DATA.JUST_CENTER
+                and self._test_force_flip
+                and not self.cfg.DATA.BATCH_TRANSFORM
+            ):
+                clip = clip[:, :, ::-1]
+        else:
+            raise NotImplementedError(
+                "Unsupported split mode {}".format(self._split)
+            )
+
+        if self.cfg.DATA.BATCH_TRANSFORM:
+            # Flips, color augmentation and normalization are done on the
+            # batch by `BatchTransform`.
+            return torch.from_numpy(
+                cv2_transform.clip_to_channels_first(clip, bgr=self._use_bgr)
+            )
+
+        color_jitter = None
+        lighting = None
+        if self._split == "train" and self._use_color_augmentation:
+            if not self._pca_jitter_only:
+                color_jitter = {
+                    "img_brightness": 0.4,
+                    "img_contrast": 0.4,
+                    "img_saturation": 0.4,
+                }
+            lighting = {
+                "alphastd": 0.1,
+                "eigval": np.array(self._pca_eigval).astype(np.float32),
+                "eigvec": np.array(self._pca_eigvec).astype(np.float32),
+            }
+
+        clip = cv2_transform.normalize_clip(
+            clip,
+            self._data_mean,
+            self._data_std,
+            bgr=self._use_bgr,
+            color_jitter=color_jitter,
+            lighting=lighting,
+        )
+        return torch.from_numpy(clip)
+
 class SurgicalDatasetChunks(SurgicalDataset):
     """
     PSI-AVA dataloader.
@@ -263,67 +577,42 @@ class SurgicalDatasetChunks(SurgicalDataset):
             elif video_name=='CASE014':
                 complete_name = '{}/{}.{}'.format(video_name, str(sec).zfill(self.zero_fill), self.image_type)
                 complete_path = os.path.join(self.cfg.ENDOVIS_DATASET.FRAME_DIR,complete_name)
-                return self._image_paths[video_idx].index(complete_path)
+                return self._frame_idx(video_idx, complete_path)
             else:
                 return round((sec*30)/45) 
         except:
             breakpoint()
 
     def _load_samples_features(self, samples, cfg, include_subvideo=False):
+        """
+        Load the MTFE features of a chunk of frames, sliced from the
+        memory-mapped arrays of their videos in the packed feature store.
+        Args:
+            samples (list): frame names relative to the frames directory.
+            cfg (CfgNode): configs.
+            include_subvideo (bool): whether frames are nested in a
+                `case/subvideo` folder.
+        Returns:
+            features (ndarray): float32 features with shape
+                `len(samples)` x `feature dim`.
+        """
         if self._split == "train":
             feat_path = cfg.TEMPORAL_MODULE.FEATURE_PATH_TRAIN
         elif self._split == "val":
             feat_path = cfg.TEMPORAL_MODULE.FEATURE_PATH_VAL
 
-        output_features = []
-
-        if self.do_assignation:
-            inverted_assignation = {value: key for key, value in self.assignation.items()}
-            key_list = list(inverted_assignation.keys())
-        
-        for img in samples:
-            
-            if include_subvideo:
-                case, subvideo, frame = img.split("/")[-3:]
-
-                frame = f"{frame[:-4]}.pth"
-                
-                feature_path = os.path.join(feat_path, case, subvideo, frame)
-            else:
-                case, frame = img.split("/")[-2:]
-
-                frame = f"{frame[:-4]}.pth"
-                
-                feature_path = os.path.join(feat_path, case, frame)
-
-            feature_list = torch.load(feature_path)
-
-            feat = np.concatenate(feature_list)
-
-            output_features.append(feat.tolist())
-
-        return output_features
-    
-    def _load_features(self, cfg):
-        if self._split == "train":
-            feat_path = cfg.TEMPORAL_MODULE.FEATURE_PATH_TRAIN
-        elif self._split == "val":
-            feat_path = cfg.TEMPORAL_MODULE.FEATURE_PATH_VAL
-
-        videos_list = os.listdir(feat_path)
-        feats_dict = {}
+        if getattr(self, "_feature_store", None) is None or self._feature_store.root != feat_path:
+            self._feature_store = FeatureStoreReader(feat_path)
 
-        for video in tqdm(videos_list, desc="Getting video features..."):
-            feat_paths = glob.glob(os.path.join(feat_path,video, '*.pth'))
-            for feature in feat_paths:
-                feat_list = torch.load(feature)
-                feat = np.concatenate(feat_list)
+        depth = 3 if include_subvideo else 2
+        videos, frames = zip(*[
+            ("/".join(img.split("/")[-depth:-1]), os.path.splitext(img.split("/")[-1])[0])
+            for img in samples
+        ])
 
-                case, img_name = feature.split("/")[-2:]
-                img_key = f"{case}/{img_name[:-4]}.jpg"
-                feats_dict[img_key] = feat
-        
-        self._feats_dict = feats_dict
+        if len(set(videos)) == 1:
+            return self._feature_store.get(videos[0], list(frames))
+        return np.stack([self._feature_store.get(video, [frame])[0] for video, frame in zip(videos, frames)])
     
     def _get_feature_path_names(self, image_paths):
         
@@ -338,16 +627,26 @@ class SurgicalDatasetChunks(SurgicalDataset):
         return features_paths
 
     def get_temporal_feature_paths_per_case(self, feature_paths):
-        case_dict = {}
-
-        for case in os.listdir(feature_paths):
-            if case not in case_dict:
-                case_dict[case] = []
-            case_path = os.path.join(feature_paths, case)
-        
-            for frame in os.listdir(case_path):
-                frame_path = os.path.join(case, frame).replace('pth', self.image_type)
-
-                case_dict[case].append(frame_path)
-
+        """
+        Frame names with stored features, per video of the feature store.
+        Videos are read from the index of the packed store, so nested
+        `case/subvideo` videos are included.
+        Args:
+            feature_paths (str): directory of the feature store.
+        Returns:
+            case_dict (dict): frame names relative to the frames directory,
+                in row order, as `{video: [frame names]}`.
+        """
+        feature_store = FeatureStoreReader(feature_paths)
+        case_dict = {
+            video: [
+                "{}/{}.{}".format(video, frame, self.image_type)
+                for frame in feature_store.frame_names(video)
+            ]
+            for video in feature_store.videos()
+        }
+        assert len(case_dict) > 0, (
+            "No packed features in {0}, per-frame .pth features can be packed "
+            "with `python -m must.utils.feature_store {0}`".format(feature_paths)
+        )
         return case_dict
\ No newline at end of file
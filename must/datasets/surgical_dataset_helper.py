@@ -9,10 +9,13 @@ import torch
 import logging
 from collections import defaultdict
 from must.utils.env import pathmgr
-import math
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# Size of the frames when DATA.FIXED_RESIZE is enabled.
+FIXED_RESIZE_SIZE = 250
+
 def load_features_boxes(cfg,split):
     """
     Load boxes features from region proposal model.
@@ -58,24 +61,28 @@ def load_features_boxes(cfg,split):
     return features
 
 
-def load_image_lists(cfg, is_train):
+def load_image_lists(cfg, is_train, return_frame_ids=False):
     """
     Loading image paths from corresponding files.
 
     Args:
         cfg (CfgNode): config.
         is_train (bool): if it is training dataset or not.
+        return_frame_ids (bool): also return the frame id of every image.
 
     Returns:
         image_paths (list[list]): a list of items. Each item (also a list)
             corresponds to one video and contains the paths of images for
             this video.
         video_idx_to_name (list): a list which stores video names.
+        frame_ids (list[list]): frame ids of the images of every video, only
+            if `return_frame_ids`.
     """
     list_filenames = [
         os.path.join(cfg.ENDOVIS_DATASET.FRAME_LIST_DIR, cfg.ENDOVIS_DATASET.TRAIN_LISTS if is_train else cfg.ENDOVIS_DATASET.TEST_LISTS)
     ]
     image_paths = defaultdict(list)
+    frame_ids = defaultdict(list)
     video_name_to_idx = {}
     video_idx_to_name = []
     for list_filename in list_filenames:
@@ -94,10 +101,13 @@ def load_image_lists(cfg, is_train):
 
                 data_key = video_name_to_idx[video_name]
                 image_paths[data_key].append(os.path.join(cfg.ENDOVIS_DATASET.FRAME_DIR,row[3]))
+                frame_ids[data_key].append(int(row[2]))
 
     image_paths = [image_paths[i] for i in range(len(image_paths))]
     logger.info("Finished loading image paths from: %s" % ", ".join(list_filenames))
 
+    if return_frame_ids:
+        return image_paths, video_idx_to_name, [frame_ids[i] for i in range(len(image_paths))]
     return image_paths, video_idx_to_name
 
 
@@ -224,7 +234,126 @@ def verify_annots(annotation,cfg,filter):
     return tasks
 
 
-def get_keyframe_data_chunks(boxes_and_labels,keyframe_mapping, cfg, split):
+class KeyframeIndex(object):
+    """
+    Keyframes (or chunks of keyframes) of a dataset and their labels, stored
+    as flat numpy arrays so samples are sliced instead of copied from nested
+    python lists and dicts.
+
+    Every annotated frame of every video is a row of the frame arrays
+    (`frame_secs` and the per task `frame_labels` columns), with the frames of
+    video `v` in rows `video_offsets[v]:video_offsets[v + 1]`. Every sample
+    is a row of the sample arrays: a keyframe with its center frame index in
+    the video, or a chunk of consecutive keyframes starting at `chunk_start`.
+    """
+
+    def __init__(self, boxes_and_labels, tasks, keep_annotations=False):
+        """
+        Args:
+            boxes_and_labels (list[dict]): a list which maps from video_idx to
+                a dict. Each dict maps `frame_sec` to a list of boxes and
+                corresponding labels.
+            tasks (list): tasks whose labels are stored as columns. The label
+                of a frame is the label of its first annotation.
+            keep_annotations (bool): keep the list of annotations of every
+                frame, needed by the region tasks.
+        """
+        frame_secs = []
+        video_offsets = [0]
+        num_annotations = []
+        annotations = []
+        labels = {task: [] for task in tasks}
+        for video_boxes_and_labels in boxes_and_labels:
+            for sec, frame_annotations in video_boxes_and_labels.items():
+                frame_secs.append(sec)
+                num_annotations.append(len(frame_annotations))
+                for task in tasks:
+                    labels[task].append(frame_annotations[0][task])
+                if keep_annotations:
+                    annotations.append(frame_annotations)
+            video_offsets.append(len(frame_secs))
+
+        self.frame_secs = np.array(frame_secs, dtype=np.int64)
+        self.video_offsets = np.array(video_offsets, dtype=np.int64)
+        self.num_annotations = np.array(num_annotations, dtype=np.int32)
+        self.frame_labels = {task: _to_label_column(values) for task, values in labels.items()}
+        self.annotations = annotations if keep_annotations else None
+
+        self.chunk_size = None
+        self.video_idx = np.zeros(0, dtype=np.int32)
+        self.sec_idx = np.zeros(0, dtype=np.int32)
+        self.center_idx = np.zeros(0, dtype=np.int64)
+        self.chunk_start = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.video_idx)
+
+    def __getitem__(self, idx):
+        """
+        Returns:
+            (tuple): `(video_idx, sec_idx, sec, center_idx)` for keyframes or
+                `(video_idx, sec_idx, chunk)` for chunks, where `chunk` is the
+                list of seconds of the chunk.
+        """
+        if idx >= len(self):
+            raise IndexError(idx)
+        video_idx = int(self.video_idx[idx])
+        sec_idx = int(self.sec_idx[idx])
+        if self.chunk_size is None:
+            return video_idx, sec_idx, int(self.frame_secs[self.frame_rows(idx)]), int(self.center_idx[idx])
+        return video_idx, sec_idx, self.frame_secs[self.frame_rows(idx)].tolist()
+
+    def frame_rows(self, idx):
+        """
+        Rows of the frame arrays of a sample: an int for keyframes and an
+        array of `chunk_size` ints for chunks.
+        """
+        video_start = self.video_offsets[self.video_idx[idx]]
+        if self.chunk_size is None:
+            return video_start + self.sec_idx[idx]
+        # Positions before the start of the video repeat its first frame.
+        return video_start + np.maximum(self.chunk_start[idx] + np.arange(self.chunk_size), 0)
+
+    def get_label(self, idx, task):
+        """
+        Label of a sample for a frame task: the label of the keyframe, or the
+        list of labels of the frames of the chunk.
+        """
+        return self.frame_labels[task][self.frame_rows(idx)].tolist()
+
+    def get_annotations(self, idx):
+        """
+        Annotations of the keyframe of a sample. Must not be modified.
+        """
+        assert self.annotations is not None, "Annotations were not kept"
+        return self.annotations[self.frame_rows(idx)]
+
+    @property
+    def num_boxes(self):
+        """
+        Total number of annotations (boxes) used by the samples.
+        """
+        if self.chunk_size is None:
+            return int(self.num_annotations[self.frame_rows(np.arange(len(self)))].sum())
+        return len(self)
+
+
+def _to_label_column(values):
+    """
+    Stack the labels of a task into an array. Labels that do not have a
+    common shape are kept in an object array.
+    """
+    try:
+        column = np.array(values)
+    except ValueError:
+        column = None
+    if column is None or column.dtype == object:
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+    return column
+
+
+def get_keyframe_data_chunks(boxes_and_labels, keyframe_mapping, cfg, split):
     """
     Getting keyframe indices, boxes and labels in the dataset.
 
@@ -233,170 +362,91 @@ def get_keyframe_data_chunks(boxes_and_labels,keyframe_mapping, cfg, split):
             Each dict `frame_sec` to a list of boxes and corresponding labels.
 
     Returns:
-        keyframe_indices (list): a list of indices of the keyframes.
-        keyframe_boxes_and_labels (list[list[list]]): a list of list which maps from
-            video_idx and sec_idx to a list of boxes and corresponding labels.
+        keyframe_index (KeyframeIndex): the chunks of every video and the
+            labels of their frames.
     """
+    keyframe_index = KeyframeIndex(boxes_and_labels, cfg.TASKS.TASKS)
+    video_idxs = []
+    chunk_idxs = []
+    chunk_starts = []
 
     if split == 'train' or cfg.TEMPORAL_MODULE.ONLINE_INFERENCE==False:
-
-        keyframe_indices = []
-        keyframe_boxes_and_labels = []
-        count = 0
+        chunk_size = cfg.CHUNKS.CHUNK_SIZE
+        overlapping = cfg.CHUNKS.OVERLAPPING
 
         for video_idx in range(len(boxes_and_labels)):
-            keyframe_boxes_and_labels.append([])
-            all_keyframes = list(boxes_and_labels[video_idx].keys())
-
-            chunk_size = cfg.CHUNKS.CHUNK_SIZE
-            overlapping = cfg.CHUNKS.OVERLAPPING
-            
-            max_chunks = math.floor(len(all_keyframes)/(chunk_size - overlapping)) - (chunk_size/(chunk_size - overlapping))
-
-            all_chunks = []
-
-            chunk_idx = 0
+            num_keyframes = len(boxes_and_labels[video_idx])
+            starts = []
             last_idx = 0
-
             while True:
-                if chunk_idx == 0:
-                    start_idx = 0
-                else:
-                    start_idx = last_idx - overlapping
-                
+                start_idx = 0 if len(starts) == 0 else last_idx - overlapping
                 last_idx = start_idx + chunk_size
 
-                if last_idx < len(all_keyframes):
-                    chunk = all_keyframes[start_idx : last_idx]
-                    all_chunks.append(chunk)
-
-                    chunk_idx += 1
-
-                else:
-                    chunk = all_keyframes[start_idx : ]
-                    chunk_remaining = (chunk_size - len(chunk))
-
-                    start_idx -= chunk_remaining
-                    last_idx -= chunk_remaining
-
-                    chunk = all_keyframes[start_idx:last_idx]
-
-                    all_chunks.append(chunk)
-
+                if last_idx >= num_keyframes:
+                    # Shift the last chunk back so it ends at the last keyframe.
+                    start_idx -= last_idx - num_keyframes
+                    starts.append(start_idx)
                     break
+                starts.append(start_idx)
 
-            for chunk_idx,chunk in enumerate(all_chunks):
-                keyframe_indices.append((video_idx, chunk_idx, chunk))
-
-                label = [boxes_and_labels[video_idx][chunk_sec] if chunk_sec != -1 else -1 for chunk_sec in chunk]
-                label = [{"phases":[i[0]['phases'] if i != -1 else -1 for i in label]}]
-
+            assert starts[-1] >= 0, "Chunks are not being properly generated!"
+            video_idxs.extend([video_idx] * len(starts))
+            chunk_idxs.extend(range(len(starts)))
+            chunk_starts.extend(starts)
 
-                assert len(label[0]["phases"]) == cfg.CHUNKS.CHUNK_SIZE, "Chunks labels are not being properly generated!"
-                assert len(chunk) == cfg.CHUNKS.CHUNK_SIZE, "Chunks are not being properly generated!"
-
-
-
-                keyframe_boxes_and_labels[video_idx].append(
-                    label
-                )
-            
-                count += 1
-
-        logger.info("%d chunks used." % count)
-    
+        logger.info("%d chunks used." % len(chunk_starts))
 
     elif split != 'train' and cfg.TEMPORAL_MODULE.ONLINE_INFERENCE==True:
-
-        keyframe_indices = []
-        keyframe_boxes_and_labels = []
-        count = 0
+        # Streaming inference only needs the newest frame of each window.
+        chunk_size = 1 if cfg.TEMPORAL_MODULE.STREAMING else cfg.CHUNKS.CHUNK_SIZE
 
         for video_idx in range(len(boxes_and_labels)):
-            keyframe_boxes_and_labels.append([])
-            all_keyframes = list(boxes_and_labels[video_idx].keys())
-
-            chunk_size = cfg.CHUNKS.CHUNK_SIZE
-            overlapping = chunk_size - 1
-
-            all_chunks = []
+            num_keyframes = len(boxes_and_labels[video_idx])
+            # The chunk of every keyframe ends at it, the first chunks repeat
+            # the first keyframe of the video.
+            video_idxs.extend([video_idx] * num_keyframes)
+            chunk_idxs.extend(range(num_keyframes))
+            chunk_starts.extend(range(1 - chunk_size, num_keyframes + 1 - chunk_size))
 
-            for chunk_idx in range(len(all_keyframes)):
-                if chunk_idx >= chunk_size:
-                    chunk = all_keyframes[chunk_idx - chunk_size + 1 : chunk_idx + 1]
-                else:
-                    chunk = all_keyframes[ 0  : chunk_idx + 1]
-                    chunk_repeat = [chunk[0]]  * (chunk_size - len(chunk))
-                    chunk = chunk_repeat + chunk
-                    
-                assert chunk[-1] == all_keyframes[chunk_idx]
-                all_chunks.append(chunk)
+    keyframe_index.chunk_size = chunk_size
+    keyframe_index.video_idx = np.array(video_idxs, dtype=np.int32)
+    keyframe_index.sec_idx = np.array(chunk_idxs, dtype=np.int32)
+    keyframe_index.chunk_start = np.array(chunk_starts, dtype=np.int64)
+    return keyframe_index
 
-            
-            for chunk_idx,chunk in enumerate(all_chunks):
-                keyframe_indices.append((video_idx, chunk_idx, chunk))
-
-                label = [boxes_and_labels[video_idx][chunk_sec] if chunk_sec != -1 else -1 for chunk_sec in chunk]
-                label = [{"phases":[i[0]['phases'] if i != -1 else -1 for i in label]}]
-
-                assert len(label[0]["phases"]) == cfg.CHUNKS.CHUNK_SIZE, "Chunks labels are not being properly generated!"
-                assert len(chunk) == cfg.CHUNKS.CHUNK_SIZE, "Chunks are not being properly generated!"
-
-                keyframe_boxes_and_labels[video_idx].append(
-                    label
-                )
-            
-                count += 1
 
-    return keyframe_indices, keyframe_boxes_and_labels
-
-def get_keyframe_data(boxes_and_labels,keyframe_mapping):
+def get_keyframe_data(boxes_and_labels, keyframe_mapping, frame_tasks, keep_annotations=False):
     """
     Getting keyframe indices, boxes and labels in the dataset.
 
     Args:
         boxes_and_labels (list[dict]): a list which maps from video_idx to a dict.
             Each dict `frame_sec` to a list of boxes and corresponding labels.
+        keyframe_mapping (callable): maps `video_idx`, `sec_idx` and `sec` to
+            the index of the keyframe in the frames of the video.
+        frame_tasks (list): tasks with one label per frame. Every annotation
+            of a frame must have the same label for them.
+        keep_annotations (bool): keep the annotations of every keyframe, for
+            the region tasks.
 
     Returns:
-        keyframe_indices (list): a list of indices of the keyframes.
-        keyframe_boxes_and_labels (list[list[list]]): a list of list which maps from
-            video_idx and sec_idx to a list of boxes and corresponding labels.
+        keyframe_index (KeyframeIndex): the keyframes of every video and their
+            labels.
     """
-
-    keyframe_indices = []
-    keyframe_boxes_and_labels = []
-    count = 0
+    keyframe_index = KeyframeIndex(boxes_and_labels, frame_tasks, keep_annotations=keep_annotations)
+    video_idxs = []
+    sec_idxs = []
+    center_idxs = []
     for video_idx in range(len(boxes_and_labels)):
-        keyframe_boxes_and_labels.append([])
-        for sec_idx,sec in enumerate(boxes_and_labels[video_idx]):
-            keyframe_indices.append((video_idx, sec_idx, sec, keyframe_mapping(video_idx, sec_idx, sec)))
-            keyframe_boxes_and_labels[video_idx].append(
-                boxes_and_labels[video_idx][sec]
-            )
-            count += 1
-    logger.info("%d keyframes used." % count)
-
-    return keyframe_indices, keyframe_boxes_and_labels
-
-def get_num_boxes_used(keyframe_indices, keyframe_boxes_and_labels):
-    """
-    Get total number of used boxes.
-
-    Args:
-        keyframe_indices (list): a list of indices of the keyframes.
-        keyframe_boxes_and_labels (list[list[list]]): a list of list which maps from
-            video_idx and sec_idx to a list of boxes and corresponding labels.
-
-    Returns:
-        count (int): total number of used boxes.
-    """
-
-    count = 0
-    try:
-        for video_idx, sec_idx, _, _ in keyframe_indices:
-            count += len(keyframe_boxes_and_labels[video_idx][sec_idx])
-    except:
-        for video_idx, sec_idx, _ in keyframe_indices:
-            count += len(keyframe_boxes_and_labels[video_idx][sec_idx])
-    return count
\ No newline at end of file
+        for sec_idx, (sec, frame_annotations) in enumerate(boxes_and_labels[video_idx].items()):
+            for task in frame_tasks:
+                assert all(label[task]==frame_annotations[0][task] for label in frame_annotations), f'Inconsistent {task} labels for frame {sec} of video {video_idx}: {[label[task] for label in frame_annotations]}'
+            video_idxs.append(video_idx)
+            sec_idxs.append(sec_idx)
+            center_idxs.append(keyframe_mapping(video_idx, sec_idx, sec))
+    logger.info("%d keyframes used." % len(video_idxs))
+
+    keyframe_index.video_idx = np.array(video_idxs, dtype=np.int32)
+    keyframe_index.sec_idx = np.array(sec_idxs, dtype=np.int32)
+    keyframe_index.center_idx = np.array(center_idxs, dtype=np.int64)
+    return keyframe_index
\ No newline at end of file
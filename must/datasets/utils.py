@@ -2,6 +2,7 @@
 
 import os
 import cv2
+import itertools
 import time
 import random
 import logging
@@ -15,41 +16,164 @@ from concurrent.futures import ThreadPoolExecutor
 import torchvision.transforms as transforms
 
 from . import transform as transform
+from .sampler import VideoBlockSampler
 from must.utils.env import pathmgr
 from torch.utils.data.distributed import DistributedSampler
 
 logger = logging.getLogger(__name__)
 
 
-def retry_load_images(image_paths, retry=10, backend="pytorch"):
+_DECODE_POOL = None
+_DECODE_POOL_PID = None
+_DECODE_POOL_THREADS = None
+
+# JPEG start-of-frame markers, which hold the size of the image.
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _get_decode_pool(num_threads):
+    """
+    Get the thread pool used to decode images in the current process. The pool
+    is created lazily, so every dataloader worker owns its own pool, and is
+    rebuilt when `num_threads` changes.
+    Args:
+        num_threads (int): maximum number of decoding threads.
+    """
+    global _DECODE_POOL, _DECODE_POOL_PID, _DECODE_POOL_THREADS
+    if _DECODE_POOL is None or _DECODE_POOL_PID != os.getpid():
+        _DECODE_POOL = None
+    elif _DECODE_POOL_THREADS != num_threads:
+        # Pending decodes still run, the pool is only closed to new ones.
+        _DECODE_POOL.shutdown(wait=False)
+        _DECODE_POOL = None
+    if _DECODE_POOL is None:
+        _DECODE_POOL = ThreadPoolExecutor(max_workers=num_threads)
+        _DECODE_POOL_PID = os.getpid()
+        _DECODE_POOL_THREADS = num_threads
+    return _DECODE_POOL
+
+
+def get_jpeg_size(img_bytes):
+    """
+    Read the size of a JPEG image from its header without decoding it.
+    Args:
+        img_bytes (bytes): encoded image.
+    Returns:
+        size (tuple or None): `(height, width)` of the image, or None if the
+            buffer is not a JPEG image.
+    """
+    if len(img_bytes) < 4 or img_bytes[0] != 0xFF or img_bytes[1] != 0xD8:
+        return None
+    idx = 2
+    while idx + 9 < len(img_bytes):
+        if img_bytes[idx] != 0xFF:
+            return None
+        marker = img_bytes[idx + 1]
+        if marker == 0xFF:
+            # Fill byte.
+            idx += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without payload.
+            idx += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height = (img_bytes[idx + 5] << 8) + img_bytes[idx + 6]
+            width = (img_bytes[idx + 7] << 8) + img_bytes[idx + 8]
+            return height, width
+        idx += 2 + (img_bytes[idx + 2] << 8) + img_bytes[idx + 3]
+    return None
+
+
+def get_decode_flag(img_bytes, min_short_side=None):
+    """
+    Choose the `cv2.imdecode` flag for an image. JPEG images are decoded at
+    1/2, 1/4 or 1/8 of their resolution when their short side stays larger
+    than `min_short_side`.
+    Args:
+        img_bytes (bytes): encoded image.
+        min_short_side (int or None): smallest short side needed by the
+            preprocessing. If None, images are decoded at full resolution.
+    """
+    if min_short_side is None:
+        return cv2.IMREAD_COLOR
+    size = get_jpeg_size(img_bytes)
+    if size is None:
+        return cv2.IMREAD_COLOR
+    for factor, flag in (
+        (8, cv2.IMREAD_REDUCED_COLOR_8),
+        (4, cv2.IMREAD_REDUCED_COLOR_4),
+        (2, cv2.IMREAD_REDUCED_COLOR_2),
+    ):
+        if min(size) // factor >= min_short_side:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def load_image(image_path, min_short_side=None):
+    """
+    Read and decode a single image.
+    Args:
+        image_path (str): path of the image.
+        min_short_side (int or None): smallest short side needed by the
+            preprocessing, see `get_decode_flag`.
+    Returns:
+        img (ndarray or None): BGR image in HWC, or None if it could not be
+            read or decoded.
+    """
+    try:
+        with pathmgr.open(image_path, "rb") as f:
+            img_bytes = f.read()
+    except OSError as e:
+        logger.warn("Reading {} failed: {}".format(image_path, e))
+        return None
+    img_str = np.frombuffer(img_bytes, np.uint8)
+    try:
+        return cv2.imdecode(img_str, flags=get_decode_flag(img_bytes, min_short_side))
+    except cv2.error as e:
+        logger.warn("Decoding {} failed: {}".format(image_path, e))
+        return None
+
+
+def retry_load_images(image_paths, retry=10, backend="pytorch", num_threads=1, min_short_side=None):
     """
     This function is to load images with support of retrying for failed load.
+    Images are read and decoded concurrently, and only the images that
+    failed are read again.
 
     Args:
         image_paths (list): paths of images needed to be loaded.
         retry (int, optional): maximum time of loading retrying. Defaults to 10.
         backend (str): `pytorch` or `cv2`.
+        num_threads (int): number of threads used to read and decode the images.
+        min_short_side (int or None): if given, JPEG images are decoded at a
+            reduced resolution whose short side is at least this size.
 
     Returns:
         imgs (list): list of loaded images.
     """
+    imgs = [None] * len(image_paths)
+    pending = list(range(len(image_paths)))
     for i in range(retry):
-        imgs = []
-        for image_path in image_paths:
-            with pathmgr.open(image_path, "rb") as f:
-                img_str = np.frombuffer(f.read(), np.uint8)
-                img = cv2.imdecode(img_str, flags=cv2.IMREAD_COLOR)
-            imgs.append(img)
-
-        if all(img is not None for img in imgs):
+        pending_paths = [image_paths[idx] for idx in pending]
+        if num_threads > 1 and len(pending_paths) > 1:
+            decoded = _get_decode_pool(num_threads).map(
+                lambda path: load_image(path, min_short_side), pending_paths
+            )
+        else:
+            decoded = [load_image(path, min_short_side) for path in pending_paths]
+        for idx, img in zip(pending, decoded):
+            imgs[idx] = img
+        pending = [idx for idx in pending if imgs[idx] is None]
+
+        if len(pending) == 0:
             if backend == "pytorch":
                 imgs = torch.as_tensor(np.stack(imgs))
             return imgs
         else:
-            logger.warn("Reading failed. Will retry.")
+            logger.warn("Reading {} images failed. Will retry.".format(len(pending)))
             time.sleep(1.0)
-        if i == retry - 1:
-            raise Exception("Failed to load images {}".format(image_paths))
+    raise Exception("Failed to load images {}".format([image_paths[idx] for idx in pending]))
 
 
 def get_sequence(center_idx, half_len, sample_rate, num_frames, length, online=False):
@@ -347,17 +471,35 @@ def create_sampler(dataset, shuffle, cfg):
     Returns:
         sampler (Sampler): the created sampler.
     """
+    keyframe_indices = getattr(dataset, "_keyframe_indices", None)
+    if shuffle and cfg.DATA_LOADER.VIDEO_BLOCK_SAMPLER and keyframe_indices is not None:
+        return VideoBlockSampler(
+            keyframe_indices.video_idx,
+            keyframe_indices.sec_idx,
+            block_size=cfg.DATA_LOADER.VIDEO_BLOCK_SIZE,
+            batch_size=int(cfg.TRAIN.BATCH_SIZE / max(1, cfg.NUM_GPUS)),
+            num_workers=cfg.DATA_LOADER.NUM_WORKERS,
+            seed=cfg.RNG_SEED,
+        )
     sampler = DistributedSampler(dataset) if cfg.NUM_GPUS > 1 else None
 
     return sampler
 
 
+def _init_worker_frame_lru(worker_id):
+    dataset = torch.utils.data.get_worker_info().dataset
+    dataset._frame_lru.reset(worker_id)
+
+
 def loader_worker_init_fn(dataset):
     """
-    Create init function passed to pytorch data loader.
+    Create init function passed to pytorch data loader. Every worker starts
+    with an empty frame LRU of its own.
     Args:
         dataset (torch.utils.data.Dataset): the given dataset.
     """
+    if getattr(dataset, "_frame_lru", None) is not None:
+        return _init_worker_frame_lru
     return None
 
 
@@ -431,47 +573,37 @@ def get_best_features(box_labels, box_features):
     return best_box
 
 
-def process_sequence(sequence, video_idx, cfg, image_paths, preprocess_fn):
+def process_multi_rate_sequences(sequence_pyramid, video_idx, cfg, image_paths, preprocess_fn, load_fn=None):
     """
-    Process a single sequence: load images, preprocess them, and pack the output.
-    
-    Args:
-        sequence (list): List of frame indices in the sequence.
-        video_idx (int): Index of the video in the dataset.
-        cfg (object): Configuration object with dataset and preprocessing details.
-        image_paths (list): Nested list of image paths organized by video and frame.
-        preprocess_fn (callable): Function to preprocess images and boxes.
-
-    Returns:
-        list: Preprocessed images packed in the required pathway format.
-    """
-    image_paths_seq = [image_paths[video_idx][frame] for frame in sequence]
-    imgs = retry_load_images(image_paths_seq, backend=cfg.ENDOVIS_DATASET.IMG_PROC_BACKEND)
-    imgs = preprocess_fn(imgs)  # Assuming `boxes` is None
-    imgs = pack_pathway_output(cfg, imgs)
-    return imgs[0]
-
+    Load the clips of every sampling rate decoding and preprocessing each
+    unique frame only once. The union of the frame indices is preprocessed
+    as a single clip, so every rate shares the same augmentation parameters,
+    and the result is scattered back into one clip per rate.
 
-def process_sequences_parallel(sequence_pyramid, video_idx, cfg, image_paths, preprocess_fn):
-    """
-    Parallel processing of sequences in a pyramid.
-    
     Args:
-        sequence_pyramid (list): List of sequences to process.
+        sequence_pyramid (list): List of sequences (frame indices) to process.
         video_idx (int): Index of the video in the dataset.
         cfg (object): Configuration object with dataset and preprocessing details.
         image_paths (list): Nested list of image paths organized by video and frame.
         preprocess_fn (callable): Function to preprocess images and boxes.
+        load_fn (callable): Function to load a list of image paths. Defaults
+            to `retry_load_images`.
 
     Returns:
         list: List of preprocessed images for all sequences.
     """
+    unique_frames = sorted(set(itertools.chain.from_iterable(sequence_pyramid)))
+    frame_position = {frame: idx for idx, frame in enumerate(unique_frames)}
+
+    image_paths_seq = [image_paths[video_idx][frame] for frame in unique_frames]
+    if load_fn is None:
+        imgs = retry_load_images(image_paths_seq, backend=cfg.ENDOVIS_DATASET.IMG_PROC_BACKEND)
+    else:
+        imgs = load_fn(image_paths_seq)
+    imgs = preprocess_fn(imgs)
+
     images_pyramid = []
-    with ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(process_sequence, sequence, video_idx, cfg, image_paths, preprocess_fn)
-            for sequence in sequence_pyramid
-        ]
-        for future in futures:
-            images_pyramid.append(future.result())
-    return images_pyramid
\ No newline at end of file
+    for sequence in sequence_pyramid:
+        positions = torch.as_tensor([frame_position[frame] for frame in sequence])
+        images_pyramid.append(pack_pathway_output(cfg, imgs.index_select(1, positions))[0])
+    return images_pyramid
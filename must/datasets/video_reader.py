@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+Frames decoded directly from the surgery videos.
+
+With `ENDOVIS_DATASET.IMG_PROC_BACKEND` set to `video`, the frame lists still
+define the frames of every video, but frames are decoded from
+`<ENDOVIS_DATASET.VIDEO_DIR>/<video name><ENDOVIS_DATASET.VIDEO_EXT>` instead of
+being read from frame folders. The frame id of every row of the frame lists,
+times `ENDOVIS_DATASET.VIDEO_FRAME_STRIDE`, is the index of the frame in the
+video.
+
+The frames of a clip are decoded by seeking to the keyframe before the first
+of them and decoding forward. Every dataloader worker keeps its containers
+open, and a clip that starts shortly after the last decoded frame of its video
+continues decoding from there without seeking.
+"""
+
+import os
+from collections import OrderedDict
+
+import av
+
+
+class _OpenVideo(object):
+    """
+    Open container of a video and the position of its decoder.
+    """
+
+    def __init__(self, path, num_threads):
+        self.container = av.open(path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self.stream.thread_count = num_threads
+        self.fps = float(self.stream.average_rate)
+        self.time_base = float(self.stream.time_base)
+        self.start_pts = self.stream.start_time or 0
+        self.frames = None
+        # Index of the last decoded frame.
+        self.position = None
+
+    def frame_index(self, frame):
+        return int(round((frame.pts - self.start_pts) * self.time_base * self.fps))
+
+    def seek(self, frame_idx):
+        """
+        Seek to the keyframe at or before a frame.
+        """
+        pts = self.start_pts + int(frame_idx / self.fps / self.time_base)
+        self.container.seek(pts, backward=True, any_frame=False, stream=self.stream)
+        self.frames = self.container.decode(self.stream)
+        self.position = None
+
+    def close(self):
+        self.container.close()
+
+
+class VideoReader(object):
+    """
+    Decodes frames from videos, keeping up to `cache_size` containers open
+    per process.
+    """
+
+    def __init__(self, cache_size=8, max_gap=64, num_threads=1):
+        """
+        Args:
+            cache_size (int): number of containers kept open.
+            max_gap (int): frames between two requested frames up to which
+                decoding continues instead of seeking.
+            num_threads (int): decoding threads of every container.
+        """
+        self.cache_size = cache_size
+        self.max_gap = max_gap
+        self.num_threads = num_threads
+        self._videos = OrderedDict()
+        self._pid = None
+
+    def _open(self, path):
+        # Containers are not shared with forked dataloader workers.
+        if self._pid != os.getpid():
+            self._videos = OrderedDict()
+            self._pid = os.getpid()
+        if path in self._videos:
+            self._videos.move_to_end(path)
+        else:
+            if len(self._videos) >= self.cache_size:
+                self._videos.popitem(last=False)[1].close()
+            self._videos[path] = _OpenVideo(path, self.num_threads)
+        return self._videos[path]
+
+    def load_frames(self, path, frame_indices):
+        """
+        Decode some frames of a video.
+        Args:
+            path (str): path of the video.
+            frame_indices (list): indices of the frames in the video, in any
+                order and possibly repeated.
+        Returns:
+            imgs (list): BGR frames in HWC, in the order of `frame_indices`.
+        """
+        video = self._open(path)
+        wanted = sorted(set(frame_indices))
+        decoded = {}
+        for frame_idx in wanted:
+            if (
+                video.position is None
+                or frame_idx <= video.position
+                or frame_idx - video.position > self.max_gap
+            ):
+                video.seek(frame_idx)
+            for frame in video.frames:
+                video.position = video.frame_index(frame)
+                if video.position >= frame_idx:
+                    # Missing frames (variable frame rate) get the next one.
+                    decoded[frame_idx] = frame.to_ndarray(format="bgr24")
+                    break
+            else:
+                video.position = None
+                raise IndexError("Frame {} is past the end of {}".format(frame_idx, path))
+        return [decoded[frame_idx] for frame_idx in frame_indices]
@@ -0,0 +1,150 @@
+"""Operations for numpy arrays of COCO run-length encoded (RLE) masks.
+
+Masks are kept as compressed RLE dictionaries and compared with pycocotools,
+without decoding them to [height, width] arrays.
+
+Example mask operations that are supported:
+  * Areas: compute mask areas
+  * IOU: pairwise intersection-over-union scores
+  * Union, intersection and difference of masks
+"""
+import numpy as np
+import pycocotools.mask as m
+
+
+def to_rle(mask, height=800, width=1280):
+    """Converts a mask to a compressed RLE.
+
+  Args:
+    mask: A compressed or uncompressed RLE dictionary, a list of polygons or a
+      [height, width] array with values in {0,1}.
+    height: height of the image, used for polygons.
+    width: width of the image, used for polygons.
+
+  Returns:
+    A compressed RLE dictionary.
+  """
+    if isinstance(mask, dict):
+        if isinstance(mask["counts"], list):
+            return m.frPyObjects(mask, *mask["size"])
+        return mask
+    if isinstance(mask, list):
+        polys = [np.array(p).flatten().tolist() for p in mask]
+        return m.merge(m.frPyObjects(polys, height, width))
+    return m.encode(np.asfortranarray(mask, dtype=np.uint8))
+
+
+def encode(masks, height=800, width=1280):
+    """Converts masks to a numpy array of compressed RLEs.
+
+  Args:
+    masks: An iterable of masks in any format supported by to_rle.
+    height: height of the image, used for polygons.
+    width: width of the image, used for polygons.
+
+  Returns:
+    An object numpy array of shape [N] holding N RLE dictionaries.
+  """
+    rles = [to_rle(mask, height, width) for mask in masks]
+    # Filled element-wise so that numpy does not try to broadcast the dicts.
+    array = np.empty(len(rles), dtype=object)
+    array[:] = rles
+    return array
+
+
+def decode(rles):
+    """Decodes RLEs to a uint8 numpy array of shape [N, height, width]."""
+    return np.array([m.decode(rle) for rle in rles], dtype=np.uint8)
+
+
+def area(rles):
+    """Computes area of masks.
+
+  Args:
+    rles: A numpy array with shape [N] holding N RLE masks.
+
+  Returns:
+    a numpy array with shape [N*1] representing mask areas.
+  """
+    if len(rles) == 0:
+        return np.zeros(0, dtype=np.float32)
+    return m.area(list(rles)).astype(np.float32)
+
+
+def _same_size(rles1, rles2):
+    sizes = {tuple(rle["size"]) for rle in rles1}
+    sizes.update(tuple(rle["size"]) for rle in rles2)
+    return len(sizes) <= 1
+
+
+def iou(rles1, rles2):
+    """Computes pairwise intersection-over-union between mask collections.
+
+  Args:
+    rles1: a numpy array with shape [N] holding N RLE masks.
+    rles2: a numpy array with shape [M] holding M RLE masks.
+
+  Returns:
+    a numpy array with shape [N, M] representing pairwise iou scores.
+
+  Raises:
+    ValueError: If the masks do not all have the same size.
+  """
+    if len(rles1) == 0 or len(rles2) == 0:
+        return np.zeros((len(rles1), len(rles2)), dtype=np.float32)
+    if not _same_size(rles1, rles2):
+        raise ValueError("rles1 and rles2 should have the same size")
+    ious = m.iou(list(rles1), list(rles2), [0] * len(rles2))
+    return np.asarray(ious, dtype=np.float32).reshape(len(rles1), len(rles2))
+
+
+def union(rles):
+    """Union of a collection of RLE masks, None if it is empty."""
+    if len(rles) == 0:
+        return None
+    if len(rles) == 1:
+        return rles[0]
+    return m.merge(list(rles), intersect=False)
+
+
+def intersection(rle1, rle2):
+    """Intersection of two RLE masks."""
+    return m.merge([rle1, rle2], intersect=True)
+
+
+def _string_to_counts(string):
+    """Decodes the counts of a compressed RLE, as pycocotools rleFrString."""
+    if isinstance(string, str):
+        string = string.encode()
+    counts = []
+    p = 0
+    while p < len(string):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = string[p] - 48
+            x |= (c & 0x1F) << (5 * k)
+            more = c & 0x20
+            p += 1
+            k += 1
+            if not more and (c & 0x10):
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
+
+
+def complement(rle):
+    """Complement of an RLE mask, computed on its run lengths."""
+    counts = _string_to_counts(rle["counts"])
+    # Runs alternate starting with zeros.
+    counts = counts[1:] if len(counts) > 0 and counts[0] == 0 else [0] + counts
+    height, width = rle["size"]
+    return m.frPyObjects({"size": [height, width], "counts": counts}, height, width)
+
+
+def difference(rle1, rle2):
+    """Pixels of rle1 that are not in rle2."""
+    return intersection(rle1, complement(rle2))
@@ -39,7 +39,7 @@ import numpy as np
 from abc import ABCMeta, abstractmethod
 import pycocotools.mask as m
 
-from . import label_map_util, metrics, per_image_evaluation, standard_fields
+from . import label_map_util, metrics, np_rle_ops, per_image_evaluation, standard_fields
 
 def transform_coded_masks_to_array(masks, height=800, width=1280):
     all_masks = []
@@ -258,9 +258,11 @@ class ObjectDetectionEvaluator(DetectionEvaluator):
           of the format [ymin, xmin, ymax, xmax] in absolute image coordinates.
         standard_fields.DetectionResultFields.detection_scores: float32 numpy
           array of shape [num_boxes] containing detection scores for the boxes.
-        standard_fields.DetectionResultFields.detection_classes: integer numpy
-          array of shape [num_boxes] containing 1-indexed detection classes for
-          the boxes.
+        standard_fields.DetectionResultFields.detection_classes: (optional)
+          integer numpy array of shape [num_boxes] containing 1-indexed
+          detection classes for the boxes. If missing, detection_scores has
+          shape [num_boxes, num_classes] and every box is scored for every
+          class.
         standard_fields.DetectionResultFields.detection_masks: uint8 numpy
           array of shape [num_boxes, height, width] containing `num_boxes` masks
           of values ranging between 0 and 1.
@@ -268,12 +270,14 @@ class ObjectDetectionEvaluator(DetectionEvaluator):
     Raises:
       ValueError: If detection masks are not in detections dictionary.
     """
-        detection_classes = (
-            detections_dict[
-                standard_fields.DetectionResultFields.detection_classes
-            ]
-            - self._label_id_offset
-        )
+        detection_classes = None
+        if standard_fields.DetectionResultFields.detection_classes in detections_dict:
+            detection_classes = (
+                detections_dict[
+                    standard_fields.DetectionResultFields.detection_classes
+                ]
+                - self._label_id_offset
+            )
         detection_masks = None
         if self._evaluate_masks:
             if (
@@ -665,9 +669,10 @@ class ObjectDetectionEvaluation(object):
         containing `num_boxes` detection boxes of the format
         [ymin, xmin, ymax, xmax] in absolute image coordinates.
       detected_scores: float32 numpy array of shape [num_boxes] containing
-        detection scores for the boxes.
+        detection scores for the boxes, or of shape [num_boxes, num_classes]
+        with the score of every class when detected_class_labels is None.
       detected_class_labels: integer numpy array of shape [num_boxes] containing
-        0-indexed detection classes for the boxes.
+        0-indexed detection classes for the boxes, or None.
       detected_masks: np.uint8 numpy array of shape [num_boxes, height, width]
         containing `num_boxes` detection masks with values ranging
         between 0 and 1.
@@ -676,9 +681,10 @@ class ObjectDetectionEvaluation(object):
       ValueError: if the number of boxes, scores and class labels differ in
         length.
     """
-        if len(detected_boxes) != len(detected_scores) or len(
-            detected_boxes
-        ) != len(detected_class_labels):
+        if len(detected_boxes) != len(detected_scores) or (
+            detected_class_labels is not None
+            and len(detected_boxes) != len(detected_class_labels)
+        ):
             raise ValueError(
                 "detected_boxes, detected_scores and "
                 "detected_class_labels should all have same lengths. Got"
@@ -701,10 +707,11 @@ class ObjectDetectionEvaluation(object):
             # Masks are popped instead of look up. The reason is that we do not want
             # to keep all masks in memory which can cause memory overflow.
             groundtruth_masks = self.groundtruth_masks.pop(image_key)
+            # Masks are compared as RLEs, without decoding them.
             if groundtruth_masks is not None:
-                groundtruth_masks = transform_coded_masks_to_array(groundtruth_masks)
+                groundtruth_masks = np_rle_ops.encode(groundtruth_masks)
             if detected_masks is not None:
-                detected_masks = transform_coded_masks_to_array(detected_masks)
+                detected_masks = np_rle_ops.encode(detected_masks)
             groundtruth_is_difficult_list = self.groundtruth_is_difficult_list[
                 image_key
             ]
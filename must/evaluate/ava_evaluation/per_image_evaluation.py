@@ -31,8 +31,9 @@ import numpy as np
 from . import (
     np_box_list,
     np_box_list_ops,
-    np_box_mask_list,
-    np_box_mask_list_ops,
+    np_box_ops,
+    np_mask_ops,
+    np_rle_ops,
 )
 
 import skimage.io as io
@@ -81,7 +82,9 @@ class PerImageEvaluation(object):
       detected_scores: A float numpy array of shape [N, 1], representing
           the confidence scores of the detected N object instances.
       detected_class_labels: A integer numpy array of shape [N, 1], repreneting
-          the class labels of the detected N object instances.
+          the class labels of the detected N object instances. If None,
+          `detected_scores` has shape [N, num_classes] and every detection is
+          evaluated once per class with the score of that class.
       groundtruth_boxes: A float numpy array of shape [M, 4], representing M
           regions of object instances in ground truth
       groundtruth_class_labels: An integer numpy array of shape [M, 1],
@@ -115,6 +118,17 @@ class PerImageEvaluation(object):
             detected_class_labels,
             detected_masks,
         )
+        if detected_class_labels is None:
+            return self._compute_tp_fp_all_classes(
+                detected_boxes=detected_boxes,
+                detected_scores=detected_scores,
+                groundtruth_boxes=groundtruth_boxes,
+                groundtruth_class_labels=groundtruth_class_labels,
+                groundtruth_is_difficult_list=groundtruth_is_difficult_list,
+                groundtruth_is_group_of_list=groundtruth_is_group_of_list,
+                detected_masks=detected_masks,
+                groundtruth_masks=groundtruth_masks,
+            )
         scores, tp_fp_labels = self._compute_tp_fp(
             detected_boxes=detected_boxes,
             detected_scores=detected_scores,
@@ -242,6 +256,118 @@ class PerImageEvaluation(object):
             result_tp_fp_labels.append(tp_fp_labels)
         return result_scores, result_tp_fp_labels
 
+    def _compute_tp_fp_all_classes(
+        self,
+        detected_boxes,
+        detected_scores,
+        groundtruth_boxes,
+        groundtruth_class_labels,
+        groundtruth_is_difficult_list,
+        groundtruth_is_group_of_list,
+        detected_masks=None,
+        groundtruth_masks=None,
+    ):
+        """Labels true/false positives of detections scored for every class.
+
+    Equivalent to `_compute_tp_fp` with every detection repeated once per
+    class, but the overlaps between detections and groundtruth are computed
+    once and sliced per class instead of recomputed for every copy.
+
+    Args:
+      detected_boxes: A float numpy array of shape [N, 4].
+      detected_scores: A float numpy array of shape [N, num_classes], with
+          the score of every detection for every class.
+      groundtruth_boxes: A float numpy array of shape [M, 4].
+      groundtruth_class_labels: An integer numpy array of shape [M].
+      groundtruth_is_difficult_list: A boolean numpy array of length M.
+      groundtruth_is_group_of_list: A boolean numpy array of length M.
+      detected_masks: (optional) A uint8 numpy array of shape
+        [N, height, width]. If not None, true positives must match
+        groundtruth both by box and by mask.
+      groundtruth_masks: (optional) A uint8 numpy array of shape
+        [M, height, width].
+
+    Returns:
+      result_scores: A list of float numpy arrays with the scores of the
+          evaluated detections of every class.
+      result_tp_fp_labels: A list of boolean numpy arrays with their
+          True/False positive labels.
+    """
+        if (detected_masks is None) != (groundtruth_masks is None):
+            raise ValueError(
+                "Detected and groundtruth masks must be both available or both missing."
+            )
+        num_detections = detected_boxes.shape[0]
+        box_iou = None
+        mask_iou = None
+        if num_detections > 0 and groundtruth_boxes.size > 0:
+            box_iou = np_box_ops.iou(detected_boxes, groundtruth_boxes)
+
+        result_scores = []
+        result_tp_fp_labels = []
+        for i in range(self.num_groundtruth_classes):
+            if num_detections == 0 or i >= detected_scores.shape[1]:
+                result_scores.append(np.array([], dtype=float))
+                result_tp_fp_labels.append(np.array([], dtype=bool))
+                continue
+            scores = detected_scores[:, i]
+            selected = groundtruth_class_labels == i
+            if not selected.any():
+                result_scores.append(scores)
+                result_tp_fp_labels.append(np.zeros(num_detections, dtype=bool))
+                continue
+            # Columns of the non group-of groundtruth of the class.
+            columns = np.flatnonzero(selected & ~groundtruth_is_group_of_list)
+            difficult = groundtruth_is_difficult_list[columns]
+
+            tp_fp_labels, is_ignored = self._match_detections(
+                box_iou[:, columns], difficult
+            )
+            if detected_masks is not None and tp_fp_labels[~is_ignored].any():
+                if mask_iou is None:
+                    mask_iou = self._mask_iou(detected_masks, groundtruth_masks)
+                tp_fp_labels_mask, is_ignored_mask = self._match_detections(
+                    mask_iou[:, columns], difficult
+                )
+                assert (is_ignored == is_ignored_mask).all()
+                tp_fp_labels = np.logical_and(tp_fp_labels, tp_fp_labels_mask)
+
+            result_scores.append(scores[~is_ignored])
+            result_tp_fp_labels.append(tp_fp_labels[~is_ignored])
+        return result_scores, result_tp_fp_labels
+
+    def _match_detections(self, iou, groundtruth_is_difficult_list):
+        """Greedily matches detections, in order, to their most overlapping
+    groundtruth.
+
+    Args:
+      iou: A float numpy array of shape [N, M] with the overlaps between N
+          detections and M non group-of groundtruth instances.
+      groundtruth_is_difficult_list: A boolean numpy array of length M.
+
+    Returns:
+      tp_fp_labels: A boolean numpy array of length N, True for true positives.
+      is_matched_to_difficult_box: A boolean numpy array of length N, True for
+          detections matched to a difficult instance, which are ignored.
+    """
+        num_detected_boxes = iou.shape[0]
+        tp_fp_labels = np.zeros(num_detected_boxes, dtype=bool)
+        is_matched_to_difficult_box = np.zeros(num_detected_boxes, dtype=bool)
+        if iou.shape[1] == 0:
+            return tp_fp_labels, is_matched_to_difficult_box
+        max_overlap_gt_ids = np.argmax(iou, axis=1)
+        max_overlaps = iou[np.arange(num_detected_boxes), max_overlap_gt_ids]
+        is_gt_box_detected = np.zeros(iou.shape[1], dtype=bool)
+        for i in np.flatnonzero(max_overlaps >= self.matching_iou_threshold):
+            gt_id = max_overlap_gt_ids[i]
+            if not groundtruth_is_difficult_list[gt_id]:
+                if not is_gt_box_detected[gt_id]:
+                    tp_fp_labels[i] = True
+                    is_gt_box_detected[gt_id] = True
+            else:
+                is_matched_to_difficult_box[i] = True
+        return tp_fp_labels, is_matched_to_difficult_box
+
     def _get_overlaps_and_scores_box_mode(
         self,
         detected_boxes,
@@ -403,15 +529,27 @@ class PerImageEvaluation(object):
       scores: The score of the detected boxlist.
       num_boxes: Number of non-maximum suppressed detected boxes.
     """
-        detected_boxmasklist = np_box_mask_list.BoxMaskList(detected_boxes, detected_masks)
-        detected_boxmasklist.add_field("scores", detected_scores)
-        gt_non_group_of_boxmasklist = np_box_mask_list.BoxMaskList(
-            groundtruth_boxes[~groundtruth_is_group_of_list], groundtruth_masks[~groundtruth_is_group_of_list]
+        iou = self._mask_iou(
+            detected_masks, groundtruth_masks[~groundtruth_is_group_of_list]
         )
-        iou = np_box_mask_list_ops.iou(detected_boxmasklist, gt_non_group_of_boxmasklist)
-        scores = detected_boxmasklist.get_field("scores")
-        num_boxes = detected_boxmasklist.num_boxes()
-        return iou, None, scores, num_boxes
+        return iou, None, detected_scores, detected_boxes.shape[0]
+
+    def _mask_iou(self, detected_masks, groundtruth_masks):
+        """Computes overlaps between detected and groundtruth masks, on their
+    RLEs when masks are given as RLE arrays and on the decoded masks otherwise.
+
+    Args:
+      detected_masks: A numpy array of shape [N] holding RLE masks, or a uint8
+        numpy array of shape [N, height, width].
+      groundtruth_masks: A numpy array of shape [M] holding RLE masks, or a
+        uint8 numpy array of shape [M, height, width].
+
+    Returns:
+      iou: A float numpy array of size [N, M].
+    """
+        if detected_masks.dtype == object:
+            return np_rle_ops.iou(detected_masks, groundtruth_masks)
+        return np_mask_ops.iou(detected_masks, groundtruth_masks)
 
     def _compute_tp_fp_for_single_class_mask(
         self,
@@ -599,7 +737,8 @@ class PerImageEvaluation(object):
         )
         detected_boxes = detected_boxes[valid_indices]
         detected_scores = detected_scores[valid_indices]
-        detected_class_labels = detected_class_labels[valid_indices]
+        if detected_class_labels is not None:
+            detected_class_labels = detected_class_labels[valid_indices]
         if detected_masks is not None:
             detected_masks = detected_masks[valid_indices]
         return [
@@ -1,83 +1,87 @@
 import numpy as np
-from sklearn.preprocessing import label_binarize
-from sklearn.metrics import precision_recall_curve, average_precision_score, precision_score, recall_score, f1_score, balanced_accuracy_score, roc_auc_score
-from tqdm import tqdm
+from sklearn.metrics import average_precision_score, precision_score, recall_score
 
-def eval_classification(task, coco_anns, preds, img_ann_dict, mask_path):
-    
-    classes = coco_anns[f'{task}_categories']
+def get_classification_labels(task, coco_anns):
+    """
+    Image names and classes of the annotations of a classification task, in
+    annotation order.
+    """
+    image_names = np.array([ann["image_name"] for ann in coco_anns["annotations"]])
+    labels = np.array([int(ann[task]) for ann in coco_anns["annotations"]], dtype=np.int64)
+    return image_names, labels
+
+def match_predictions(image_names, pred_names, pred_scores):
+    """
+    Scores of every annotated image, matched by name with a sorted search.
+    Returns:
+        scores (ndarray): scores of every image, zero if not predicted.
+        found (ndarray): whether every image was predicted.
+    """
+    pred_names = np.asarray(pred_names)
+    pred_scores = np.asarray(pred_scores, dtype=np.float64).reshape(len(pred_names), -1)
+    order = np.argsort(pred_names)
+    sorted_names = pred_names[order]
+    pos = np.minimum(np.searchsorted(sorted_names, image_names), max(len(sorted_names) - 1, 0))
+    found = sorted_names[pos] == image_names if len(sorted_names) else np.zeros(len(image_names), dtype=bool)
+    scores = np.zeros((len(image_names), pred_scores.shape[1]))
+    scores[found] = pred_scores[order[pos[found]]]
+    for name in image_names[~found]:
+        print("Image {} not found in predictions lists".format(name))
+    return scores, found
+
+def _dict_to_arrays(task, preds):
+    pred_names = []
+    pred_scores = []
+    for name, pred in preds.items():
+        these_probs = pred['{}_score_dist'.format(task)]
+        if len(these_probs) == 0:
+            print("Prediction not found for image {}".format(name))
+            continue
+        pred_names.append(name)
+        pred_scores.append(these_probs)
+    return pred_names, pred_scores
+
+def classification_metrics(task, classes, labels, scores):
+    """
+    Per class average precision of one-hot labels and class scores.
+    Args:
+        task (str): task name.
+        classes (list): categories of the task.
+        labels (ndarray): class of every sample.
+        scores (ndarray): scores with dimension `num samples` x `num classes`.
+    """
     num_classes = len(classes)
-    bin_labels = np.zeros((len(coco_anns["annotations"]), num_classes))
-    bin_preds = np.zeros((len(coco_anns["annotations"]), num_classes))
-    evaluated_frames = []
-    bar = tqdm(total=len(coco_anns["annotations"]))
-    for idx, ann in enumerate(coco_anns["annotations"]):
-        ann_class = int(ann[task])
-        bin_labels[idx, :] = label_binarize([ann_class], classes=list(range(0, num_classes)))
-
-        if  ann["image_name"] in preds.keys():
-            these_probs = preds[ann["image_name"]]['{}_score_dist'.format(task)]
-            if len(these_probs) == 0:
-                print("Prediction not found for image {}".format(ann["image_name"]))
-                these_probs = np.zeros((1, num_classes))
-            else:
-                evaluated_frames.append(idx)
-
-            bin_preds[idx, :] = these_probs
-        else:
-            print("Image {} not found in predictions lists".format(ann["image_name"]))
-    
-        bar.update(1)
-            
-    bin_labels = bin_labels[evaluated_frames]
-    bin_preds = bin_preds[evaluated_frames]
-    
-    precision = {}
-    recall = {}
-    threshs = {}
+    labels = np.asarray(labels)
+    # Labels outside the categories get a zero row, as with label_binarize.
+    valid = (labels >= 0) & (labels < num_classes)
+    bin_labels = np.zeros((len(labels), num_classes))
+    bin_labels[np.flatnonzero(valid), labels[valid]] = 1
+
     ap = {}
     for c in range(0, num_classes):
-        precision[c], recall[c], threshs[c] = precision_recall_curve(bin_labels[:, c], bin_preds[:, c])
-        ap[c] = average_precision_score(bin_labels[:, c], bin_preds[:, c])
+        ap[c] = average_precision_score(bin_labels[:, c], scores[:, c])
 
     mAP = np.nanmean(list(ap.values()))
-    
+
     cat_names = [f"{cat['name']}-AP" for cat in classes]
-    
+
     return mAP, dict(zip(cat_names,list(ap.values())))
 
-def eval_precision(task, coco_anns, preds, img_ann_dict, mask_path):
-    classes = coco_anns[f'{task}_categories']
-    num_classes = len(classes)
+def precision_metrics(task, classes, labels, scores):
+    """
+    F1 score of the mean precision and recall of the top scoring classes.
+    Args:
+        task (str): task name.
+        classes (list): categories of the task.
+        labels (ndarray): class of every sample.
+        scores (ndarray): scores with dimension `num samples` x `num classes`.
+    """
+    num_preds = np.argmax(scores, axis=1)
 
-    num_labels = np.zeros((len(coco_anns["annotations"])))
-    num_preds = np.zeros((len(coco_anns["annotations"])))
-
-
-    evaluated_frames = []
-    bar = tqdm(total=len(coco_anns["annotations"]))
-    for idx, ann in enumerate(coco_anns["annotations"]):
-        ann_class = int(ann[task])
-
-        num_labels[idx] = ann_class
-
-        if  ann["image_name"] in preds.keys():
-            these_probs = preds[ann["image_name"]]['{}_score_dist'.format(task)]
-            if len(these_probs) == 0:
-                print("Prediction not found for image {}".format(ann["image_name"]))
-                these_probs = np.zeros((1, num_classes))
-            else:
-                evaluated_frames.append(idx)
-            num_preds[idx] = np.argmax(these_probs)
-        else:
-            print("Image {} not found in predictions lists".format(ann["image_name"]))
-            breakpoint()
-        bar.update(1)
-    
-    precision =  precision_score(num_labels, num_preds, average=None)
+    precision =  precision_score(labels, num_preds, average=None)
     mprecision = np.nanmean(precision)
 
-    recall = recall_score(num_labels, num_preds, average=None)
+    recall = recall_score(labels, num_preds, average=None)
     mrecall = np.nanmean(recall)
 
     msummary = {i: precision[i] for i in range(len(precision))}
@@ -86,9 +90,19 @@ def eval_precision(task, coco_anns, preds, img_ann_dict, mask_path):
 
 
     fscore = 2 * (mprecision * mrecall) / (mprecision + mrecall)
-    
+
     cat_names = [f"{cat['name']}" for cat in classes]
     cat_names.append("mP")
     cat_names.append("mR")
-    
-    return fscore, dict(zip(cat_names,list(msummary.values())))
\ No newline at end of file
+
+    return fscore, dict(zip(cat_names,list(msummary.values())))
+
+def eval_classification(task, coco_anns, preds, img_ann_dict, mask_path):
+    image_names, labels = get_classification_labels(task, coco_anns)
+    scores, found = match_predictions(image_names, *_dict_to_arrays(task, preds))
+    return classification_metrics(task, coco_anns[f'{task}_categories'], labels[found], scores[found])
+
+def eval_precision(task, coco_anns, preds, img_ann_dict, mask_path):
+    image_names, labels = get_classification_labels(task, coco_anns)
+    scores, found = match_predictions(image_names, *_dict_to_arrays(task, preds))
+    return precision_metrics(task, coco_anns[f'{task}_categories'], labels[found], scores[found])
@@ -0,0 +1,167 @@
+"""
+Ground truth and predictions of detection and instance segmentation tasks,
+indexed by image and stored as numpy arrays in the Pascal format of the AVA
+evaluator.
+"""
+import logging
+import numpy as np
+from tqdm import tqdm
+
+from .ava_evaluation import standard_fields
+
+
+def _task_labels(ann, task):
+    """
+    Labels of a detection annotation, a list or a single class of the task,
+    or the category of instruments.
+    """
+    if task in ann:
+        if isinstance(ann[task], list):
+            return ann[task]
+        elif isinstance(ann[task], int):
+            return [ann[task]]
+        raise ValueError(f'Annotation {ann[task]} of type {type(ann[task])} is not supported')
+    elif task == 'instruments' and 'category_id' in ann:
+        return [ann['category_id']]
+    return []
+
+
+class InstanceGroundTruth(object):
+    """
+    Boxes, labels and segments of the annotated images, with boxes as
+    normalized [y1,x1,y2,x2]. Images are looked up once in a dictionary
+    by file name.
+    """
+
+    def __init__(self, coco_anns, img_ann_dict, task, segmentation=False):
+        """
+        Args:
+            coco_anns (dict): coco annotations, bboxes are in [x1,y1,w,h].
+            img_ann_dict (dict): annotation indexes of every image.
+            task (str): task name.
+            segmentation (bool): label instances by `category_id` and keep
+                their segments.
+        """
+        images = {img["file_name"]: img for img in coco_anns["images"]}
+        annotations = coco_anns["annotations"]
+
+        self.boxes = {}
+        self.labels = {}
+        self.segments = {} if segmentation else None
+        # For datasets with multiple frame sizes
+        self.sizes = {}
+
+        for img_name, img_idx in tqdm(img_ann_dict.items()):
+            img = images[img_name]
+            im_w, im_h = img["width"], img["height"]
+            self.sizes[img_name] = (im_w, im_h)
+            if len(img_idx) == 0:
+                continue
+
+            anns = [annotations[idx] for idx in img_idx]
+            if segmentation:
+                labels = [[ann['category_id']] for ann in anns]
+            else:
+                labels = [_task_labels(ann, task) for ann in anns]
+            # Each box is repeated once per label
+            repeats = np.array([len(lbl) for lbl in labels], dtype=int)
+
+            bboxes = np.array([ann['bbox'] for ann in anns], dtype=float).reshape(-1, 4)
+            x1 = bboxes[:, 0] / im_w
+            y1 = bboxes[:, 1] / im_h
+            x2 = (bboxes[:, 0] + bboxes[:, 2]) / im_w
+            y2 = (bboxes[:, 1] + bboxes[:, 3]) / im_h
+            self.boxes[img_name] = np.repeat(np.stack([y1, x1, y2, x2], axis=1), repeats, axis=0)
+            self.labels[img_name] = np.array(
+                [act for lbl in labels for act in lbl], dtype=int
+            )
+            if segmentation:
+                self.segments[img_name] = np.array(
+                    [ann['segmentation'] for ann, num in zip(anns, repeats) for _ in range(num)],
+                    dtype=object,
+                )
+
+    def add_to(self, evaluator, excluded_keys=()):
+        """
+        Add the ground truth of every image to a Pascal evaluator.
+        """
+        for image_key, boxes in self.boxes.items():
+            if image_key in excluded_keys:
+                logging.info(
+                    "Found excluded timestamp in ground truth: %s. It will be ignored.",
+                    image_key,
+                )
+                continue
+            groundtruth_dict = {
+                standard_fields.InputDataFields.groundtruth_boxes: boxes,
+                standard_fields.InputDataFields.groundtruth_classes: self.labels[image_key],
+                standard_fields.InputDataFields.groundtruth_difficult: np.zeros(
+                    len(boxes), dtype=bool
+                ),
+            }
+            if self.segments is not None:
+                groundtruth_dict[
+                    standard_fields.InputDataFields.groundtruth_instance_masks
+                ] = self.segments[image_key]
+            evaluator.add_single_ground_truth_image_info(image_key, groundtruth_dict)
+
+
+class InstancePredictions(object):
+    """
+    Predicted boxes, segments and class scores of every image. Every box is
+    kept once with a `num boxes` x `num classes` score matrix and is scored
+    for every class by the evaluator, instead of being copied per class.
+    """
+
+    def __init__(self, preds, task, sizes, segmentation=False):
+        """
+        Args:
+            preds (dict): predicted instances of every image, bboxes are in
+                [x1,y1,x2,y2].
+            task (str): task name.
+            sizes (dict): (width, height) of every evaluated image.
+            segmentation (bool): keep the predicted segments.
+        """
+        self.boxes = {}
+        self.scores = {}
+        self.segments = {} if segmentation else None
+
+        for img_name, (im_w, im_h) in tqdm(sizes.items()):
+            if img_name not in preds:
+                print('{} not predicted'.format(img_name))
+                continue
+            pred_image = preds[img_name]["instances"]
+            if not len(pred_image):
+                continue
+
+            scores = np.array([inst[f'{task}_score_dist'] for inst in pred_image], dtype=float)
+            # Sorted by their highest score
+            order = np.argsort(-scores.max(axis=1), kind="stable")
+            boxes = np.array([pred_image[idx]['bbox'] for idx in order], dtype=float)
+            self.boxes[img_name] = boxes[:, [1, 0, 3, 2]] / np.array([im_h, im_w, im_h, im_w])
+            self.scores[img_name] = scores[order]
+            if segmentation:
+                self.segments[img_name] = np.array(
+                    [pred_image[idx]['segment'] for idx in order], dtype=object
+                )
+
+    def add_to(self, evaluator, excluded_keys=()):
+        """
+        Add the detections of every image to a Pascal evaluator.
+        """
+        for image_key, boxes in tqdm(self.boxes.items()):
+            if image_key in excluded_keys:
+                logging.info(
+                    "Found excluded timestamp in detections: %s. It will be ignored.",
+                    image_key,
+                )
+                continue
+            detections_dict = {
+                standard_fields.DetectionResultFields.detection_boxes: boxes,
+                standard_fields.DetectionResultFields.detection_scores: self.scores[image_key],
+            }
+            if self.segments is not None:
+                detections_dict[
+                    standard_fields.DetectionResultFields.detection_masks
+                ] = self.segments[image_key]
+            evaluator.add_single_detected_image_info(image_key, detections_dict)
@@ -7,7 +7,14 @@ import sklearn
 import argparse
 import pandas as pd
 
-from .classification_eval import eval_classification, eval_precision
+from .classification_eval import (
+    eval_classification,
+    eval_precision,
+    classification_metrics,
+    precision_metrics,
+    get_classification_labels,
+    match_predictions,
+)
 from .detection_eval import eval_detection
 from .semantic_segmentation_eval import eval_segmentation as eval_sem_segmentation
 from .instance_segmentation_eval import eval_segmentation as eval_inst_segmentation
@@ -38,6 +45,11 @@ METRIC_DICT = {'mAP': eval_classification,
                'segmentation': eval_segmentation,
                'f1': eval_precision}
 
+# Metrics computed from arrays of predictions, without a prediction json.
+ARRAY_METRIC_DICT = {'mAP': classification_metrics,
+                     'classification': classification_metrics,
+                     'f1': precision_metrics}
+
 def get_img_ann_dict(coco_anns,task):
     img_ann_dict = {}
     for img in coco_anns["images"]:
@@ -63,7 +75,7 @@ def eval_task(task, metric, coco_anns, preds, masks_path):
 
 def main_per_task(coco_ann_path, pred_path, task, metric, masks_path=None):
     # Load coco anns and preds
-    coco_anns = load_json(coco_ann_path)
+    coco_anns = load_json(coco_ann_path) if type(coco_ann_path)==str else coco_ann_path
     preds = load_json(pred_path) if type(pred_path)==str else pred_path
 
 
@@ -73,4 +85,47 @@ def main_per_task(coco_ann_path, pred_path, task, metric, masks_path=None):
     
     final_metrics = {metric: round(task_eval,8)}
     final_metrics.update(aux_metrics)    
-    return final_metrics
\ No newline at end of file
+    return final_metrics
+
+
+class GroundTruth(object):
+    """
+    COCO ground truth loaded once, with the labels of the classification
+    tasks cached as arrays.
+    """
+
+    def __init__(self, coco_ann_path):
+        self.coco_anns = load_json(coco_ann_path)
+        self._labels = {}
+
+    def classification_labels(self, task):
+        """
+        Image names and classes of the annotations of a task.
+        """
+        if task not in self._labels:
+            self._labels[task] = get_classification_labels(task, self.coco_anns)
+        return self._labels[task]
+
+
+def main_per_task_arrays(groundtruth, task, metric, pred_names, pred_scores):
+    """
+    Evaluate a task from arrays of predictions, for the metrics in
+    `ARRAY_METRIC_DICT`.
+    Args:
+        groundtruth (GroundTruth): the cached ground truth.
+        task (str): task name.
+        metric (str): metric name.
+        pred_names (list): names of the predicted frames.
+        pred_scores (ndarray): scores with dimension `num frames` x `num classes`.
+    """
+    image_names, labels = groundtruth.classification_labels(task)
+    scores, found = match_predictions(image_names, pred_names, pred_scores)
+    task_eval, aux_metrics = ARRAY_METRIC_DICT[metric](
+        task, groundtruth.coco_anns[f'{task}_categories'], labels[found], scores[found]
+    )
+    aux_metrics = dict(zip(aux_metrics.keys(),map(lambda x: round(x,3), aux_metrics.values())))
+    print('{} task {}: {} {}'.format(task, metric, round(task_eval,3), aux_metrics))
+
+    final_metrics = {metric: round(task_eval,8)}
+    final_metrics.update(aux_metrics)
+    return final_metrics
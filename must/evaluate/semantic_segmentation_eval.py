@@ -3,8 +3,60 @@ import skimage.io as io
 from tqdm import tqdm
 import os
 
+from .ava_evaluation import np_rle_ops
 from .utils import decode_rle_to_mask
 
+def paint_rles(rles, labels):
+    """
+    Per class RLE of a semantic map where the masks are painted in order, every
+    mask over the previous ones. Computed on the RLEs from the last mask back:
+    a mask only keeps the pixels not covered by the masks painted after it.
+    """
+    class_rles = {}
+    covered = None
+    for rle, label in zip(reversed(rles), reversed(labels)):
+        visible = rle if covered is None else np_rle_ops.difference(rle, covered)
+        class_rles[label] = np_rle_ops.union([class_rles[label], visible]) if label in class_rles else visible
+        covered = np_rle_ops.union([covered, rle]) if covered is not None else rle
+    return class_rles
+
+def rle_class_areas(gt_segments, gt_labels, instances, height, width):
+    """
+    Predicted area, ground truth area and intersection of every class of an
+    image, computed on the RLEs of the annotations and the predicted instances.
+    """
+    gt_rles = paint_rles([np_rle_ops.to_rle(segment, height, width) for segment in gt_segments], gt_labels)
+    pred_rles = paint_rles([np_rle_ops.to_rle(ins['segmentation'], height, width) for ins in instances],
+                           [ins['category_id'] for ins in instances])
+    class_areas = {}
+    for label in set(gt_rles).union(pred_rles):
+        pred_area = gt_area = intersection = 0
+        if label in pred_rles:
+            pred_area = int(np_rle_ops.area([pred_rles[label]])[0])
+        if label in gt_rles:
+            gt_area = int(np_rle_ops.area([gt_rles[label]])[0])
+        if pred_area > 0 and gt_area > 0:
+            intersection = int(np_rle_ops.area([np_rle_ops.intersection(pred_rles[label], gt_rles[label])])[0])
+        class_areas[label] = (pred_area, gt_area, intersection)
+    return class_areas
+
+def dense_class_areas(gt_img, instances, height, width):
+    """
+    Predicted area, ground truth area and intersection of every class of an
+    image, with the predictions decoded to a dense semantic map. Used with
+    ground truth masks read from images.
+    """
+    sem_im = np.zeros((height,width), dtype=gt_img.dtype)
+    for ins in instances:
+        p_mask = decode_rle_to_mask(ins['segmentation'], 'bool')
+        sem_im[p_mask]=ins['category_id']
+    class_areas = {}
+    for label in set(np.unique(gt_img)).union(np.unique(sem_im)) - {0}:
+        pred_mask = sem_im==label
+        gt_mask = gt_img==label
+        class_areas[label] = (int(pred_mask.sum()), int(gt_mask.sum()), int((pred_mask & gt_mask).sum()))
+    return class_areas
+
 def eval_segmentation(task, coco_anns, preds, img_ann_dict, mask_path=None):
     if 'instruments_categories' in coco_anns:
         cats = coco_anns['instruments_categories']
@@ -23,22 +75,6 @@ def eval_segmentation(task, coco_anns, preds, img_ann_dict, mask_path=None):
         height = image['height']
 
         file_name = image['file_name']
-        if mask_path is not None:
-            gt_img = io.imread(os.path.join(mask_path, file_name.split('.')[0]+'.png'))
-            gt_classes = set(np.unique(gt_img))
-            gt_classes.remove(0)
-        else:
-            image_anns = img_ann_dict[file_name]
-            image_anns = [annotations[ann_idx] for ann_idx in image_anns]
-            gt_classes = set()
-            gt_img = np.zeros((height, width))
-            for im_ann in image_anns:
-                ann_cat = im_ann['instruments'] if 'instruments' in im_ann else im_ann['category_id']
-                gt_classes.add(ann_cat)
-                ann_mask = decode_rle_to_mask(im_ann['segmentation'], 'bool')
-                gt_img[ann_mask] = ann_cat
-        
-        # breakpoint()
         image_preds = preds[file_name]["instances"]
         instances = []
         for pred in image_preds:
@@ -49,22 +85,24 @@ def eval_segmentation(task, coco_anns, preds, img_ann_dict, mask_path=None):
             instances.append({'segmentation': segmentation, 'category_id': category+1, 'score': score})
         instances.sort(key = lambda x: x['score'])
 
-        sem_im = np.zeros((height,width))
-        for ins in instances:
-            p_mask = decode_rle_to_mask(ins['segmentation'], 'bool')
-            sem_im[p_mask]=ins['category_id']
-        pred_classes = set(np.unique(sem_im))
-        pred_classes.remove(0)
+        if mask_path is not None:
+            gt_img = io.imread(os.path.join(mask_path, file_name.split('.')[0]+'.png'))
+            gt_classes = set(np.unique(gt_img))
+            gt_classes.remove(0)
+            class_areas = dense_class_areas(gt_img, instances, height, width)
+        else:
+            image_anns = [annotations[ann_idx] for ann_idx in img_ann_dict[file_name]]
+            gt_labels = [im_ann['instruments'] if 'instruments' in im_ann else im_ann['category_id'] for im_ann in image_anns]
+            gt_classes = set(gt_labels)
+            class_areas = rle_class_areas([im_ann['segmentation'] for im_ann in image_anns], gt_labels, instances, height, width)
+        pred_classes = set(label for label, (pred_area, _, _) in class_areas.items() if pred_area > 0)
 
         iou = []
         gt_iou = []
         for label in cats:
             if label in gt_classes or label in pred_classes:
-                pred_mask = (sem_im==label).astype('uint8')
-                gt_mask = (gt_img==label).astype('uint8')
-
-                intersection = np.sum(pred_mask * gt_mask)
-                union = np.sum(pred_mask) + np.sum(gt_mask) - intersection
+                pred_area, gt_area, intersection = class_areas.get(label, (0, 0, 0))
+                union = np.float64(pred_area + gt_area - intersection)
                 im_IoU = intersection/union
                 assert im_IoU>=0 and im_IoU<=1, im_IoU
                 iou.append(im_IoU)
@@ -6,7 +6,7 @@ import numpy
 import torch
 import torch.nn as nn
 
-from .common import DropPath, Mlp
+from .common import DropPath, Mlp, scaled_dot_product_attention
 
 
 def attention_pool(tensor, pool, thw_shape, has_cls_embed=True, norm=None):
@@ -63,6 +63,8 @@ class MultiScaleAttention(nn.Module):
         mode="conv",
         # If True, perform pool before projection.
         pool_first=False,
+        # If True, use the fused attention kernels.
+        fused_attn=True,
     ):
         super().__init__()
         self.pool_first = pool_first
@@ -70,6 +72,8 @@ class MultiScaleAttention(nn.Module):
         self.num_heads = num_heads
         head_dim = dim // num_heads
         self.scale = head_dim ** -0.5
+        # Fused attention kernels, see `common.scaled_dot_product_attention`.
+        self.fused_attn = fused_attn
         self.has_cls_embed = has_cls_embed
         padding_q = [int(q // 2) for q in kernel_q]
         padding_kv = [int(kv // 2) for kv in kernel_kv]
@@ -252,11 +256,9 @@ class MultiScaleAttention(nn.Module):
                 .permute(0, 2, 1, 3)
             )
 
-        attn = (q @ k.transpose(-2, -1)) * self.scale
-        attn = attn.softmax(dim=-1)
-
         N = q.shape[2]
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
+        x = scaled_dot_product_attention(q, k, v, self.scale, fused=self.fused_attn)
+        x = x.transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         if self.drop_rate > 0.0:
             x = self.proj_drop(x)
@@ -284,6 +286,7 @@ class MultiScaleBlock(nn.Module):
         mode="conv",
         has_cls_embed=True,
         pool_first=False,
+        fused_attn=True,
     ):
         super().__init__()
         self.dim = dim
@@ -305,6 +308,7 @@ class MultiScaleBlock(nn.Module):
             has_cls_embed=has_cls_embed,
             mode=mode,
             pool_first=pool_first,
+            fused_attn=fused_attn,
         )
         self.drop_path = (
             DropPath(drop_path) if drop_path > 0.0 else nn.Identity()
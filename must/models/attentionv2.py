@@ -8,7 +8,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.nn.init import trunc_normal_
 
-from .common import DropPath, Mlp
+from .common import DropPath, Mlp, scaled_dot_product_attention
 
 
 def attention_pool(tensor, pool, thw_shape, has_cls_embed=True, norm=None):
@@ -183,6 +183,8 @@ class MultiScaleAttention(nn.Module):
         rel_pos_zero_init=False,
         residual_pooling=False,
         separate_qkv=False,
+        # If True, use the fused attention kernels.
+        fused_attn=True,
     ):
         super().__init__()
         self.pool_first = pool_first
@@ -192,6 +194,8 @@ class MultiScaleAttention(nn.Module):
         self.dim_out = dim_out
         head_dim = dim_out // num_heads
         self.scale = head_dim**-0.5
+        # Fused attention kernels, see `common.scaled_dot_product_attention`.
+        self.fused_attn = fused_attn
         self.has_cls_embed = has_cls_embed
         self.mode = mode
         padding_q = [int(q // 2) for q in kernel_q]
@@ -304,6 +308,33 @@ class MultiScaleAttention(nn.Module):
 
         self.residual_pooling = residual_pooling
 
+    def _attention_rel_pos(self, q, k, v, q_shape, k_shape):
+        attn = (q * self.scale) @ k.transpose(-2, -1)
+        if self.rel_pos_spatial:
+            attn = cal_rel_pos_spatial(
+                attn,
+                q,
+                k,
+                self.has_cls_embed,
+                q_shape,
+                k_shape,
+                self.rel_pos_h,
+                self.rel_pos_w,
+            )
+
+        if self.rel_pos_temporal:
+            attn = cal_rel_pos_temporal(
+                attn,
+                q,
+                self.has_cls_embed,
+                q_shape,
+                k_shape,
+                self.rel_pos_t,
+            )
+        attn = attn.softmax(dim=-1)
+
+        return attn @ v
+
     def forward(self, x, thw_shape):
         B, N, _ = x.shape
 
@@ -402,35 +433,16 @@ class MultiScaleAttention(nn.Module):
             )
 
         N = q.shape[2]
-        attn = (q * self.scale) @ k.transpose(-2, -1)
-        if self.rel_pos_spatial:
-            attn = cal_rel_pos_spatial(
-                attn,
-                q,
-                k,
-                self.has_cls_embed,
-                q_shape,
-                k_shape,
-                self.rel_pos_h,
-                self.rel_pos_w,
-            )
-
-        if self.rel_pos_temporal:
-            attn = cal_rel_pos_temporal(
-                attn,
-                q,
-                self.has_cls_embed,
-                q_shape,
-                k_shape,
-                self.rel_pos_t,
-            )
-        attn = attn.softmax(dim=-1)
-
-        x = attn @ v
+        if self.rel_pos_spatial or self.rel_pos_temporal:
+            # The relative position biases are added to the attention map.
+            x = self._attention_rel_pos(q, k, v, q_shape, k_shape)
+        else:
+            x = scaled_dot_product_attention(q, k, v, self.scale, fused=self.fused_attn)
 
         if self.residual_pooling:
             if self.has_cls_embed:
-                x[:, :, 1:, :] += q[:, :, 1:, :]
+                # Out of place, the fused kernels keep their output for backward.
+                x = torch.cat((x[:, :, :1, :], x[:, :, 1:, :] + q[:, :, 1:, :]), dim=2)
             else:
                 x = x + q
 
@@ -471,6 +483,7 @@ class MultiScaleBlock(nn.Module):
         residual_pooling=False,
         dim_mul_in_att=False,
         separate_qkv=False,
+        fused_attn=True,
     ):
         super().__init__()
         self.dim = dim
@@ -501,6 +514,7 @@ class MultiScaleBlock(nn.Module):
             rel_pos_zero_init=rel_pos_zero_init,
             residual_pooling=residual_pooling,
             separate_qkv=separate_qkv,
+            fused_attn=fused_attn,
         )
         self.drop_path = (
             DropPath(drop_path) if drop_path > 0.0 else nn.Identity()
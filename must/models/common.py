@@ -2,6 +2,35 @@
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+
+# Fused attention kernels, with an explicit `scale` from torch 2.1 on.
+_HAS_SDPA = tuple(int(v) for v in torch.__version__.split(".")[:2]) >= (2, 1)
+
+
+def scaled_dot_product_attention(q, k, v, scale, fused=True, dropout_p=0.0):
+    """
+    Softmax attention of queries over keys and values.
+    Args:
+        q (tensor): queries with dimension `batch` x `heads` x `q tokens` x `dim`.
+        k (tensor): keys with dimension `batch` x `heads` x `k tokens` x `dim`.
+        v (tensor): values with dimension `batch` x `heads` x `k tokens` x `dim`.
+        scale (float): scale of the dot products.
+        fused (bool): use the fused kernels of
+            `F.scaled_dot_product_attention` if available. They never hold the
+            full `q tokens` x `k tokens` attention map.
+        dropout_p (float): dropout rate of the attention weights.
+    Returns:
+        x (tensor): attended values with dimension `batch` x `heads` x
+            `q tokens` x `dim`.
+    """
+    if fused and _HAS_SDPA:
+        return F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p, scale=scale)
+    attn = (q * scale) @ k.transpose(-2, -1)
+    attn = attn.softmax(dim=-1)
+    if dropout_p > 0.0:
+        attn = F.dropout(attn, p=dropout_p)
+    return attn @ v
 
 
 class Mlp(nn.Module):
@@ -1,5 +1,5 @@
 import torch
-from torch import nn, einsum
+from torch import nn
 import torch.nn.functional as F
 
 from einops import rearrange, repeat
@@ -8,6 +8,8 @@ from einops.layers.torch import Rearrange
 import matplotlib.pyplot as plt
 import numpy as np
 
+from .common import scaled_dot_product_attention
+
 # helpers
 
 def exists(val):
@@ -42,13 +44,14 @@ class FeedForward(nn.Module):
 
 # attention
 class Attention(nn.Module):
-    def __init__(self, dim, heads = 8, dim_head = 64, dropout = 0.):
+    def __init__(self, dim, heads = 8, dim_head = 64, dropout = 0., fused_attn = True):
         super().__init__()
         inner_dim = dim_head *  heads
         self.heads = heads
         self.scale = dim_head ** -0.5
+        # Fused attention kernels, see `common.scaled_dot_product_attention`.
+        self.fused_attn = fused_attn
 
-        self.attend = nn.Softmax(dim = -1)
         self.to_q = nn.Linear(dim, inner_dim, bias = False)
         self.to_kv = nn.Linear(dim, inner_dim * 2, bias = False)
 
@@ -67,38 +70,20 @@ class Attention(nn.Module):
         qkv = (self.to_q(x), *self.to_kv(context).chunk(2, dim = -1))
         q, k, v = map(lambda t: rearrange(t, 'b n (h d) -> b h n d', h = h), qkv)
 
-        dots = einsum('b h i d, b h j d -> b h i j', q, k) * self.scale
-
-        attn = self.attend(dots)
-
-        # accumulated_attn = attn.sum(axis=0)
-        # for head_idx in range(accumulated_attn.shape[0]):
-        #     plt.figure()  # Iterate through attention heads
-        #     attention_map = accumulated_attn[head_idx].detach().cpu().numpy()  # Convert to NumPy array
-        #     plt.imshow(attention_map, cmap='hot', interpolation='nearest')
-        #     plt.title(f'Attention Head {head_idx + 1}')
-        #     plt.colorbar()
-            
-        #     # Save the attention head plot
-        #     plt.savefig(f'attention_plots/Attention_Head_{head_idx}.png')
-            
-        #     # Save the attention map array
-        #     np.save(f'attention_plots/Attention_Head_{head_idx}.npy', attention_map)
-
-        out = einsum('b h i j, b h j d -> b h i d', attn, v)
+        out = scaled_dot_product_attention(q, k, v, self.scale, fused=self.fused_attn)
         out = rearrange(out, 'b h n d -> b n (h d)')
         return self.to_out(out)
 
 # transformer encoder, for small and large patches
 
 class Transformer(nn.Module):
-    def __init__(self, dim, depth, heads, dim_head, mlp_dim, dropout = 0.):
+    def __init__(self, dim, depth, heads, dim_head, mlp_dim, dropout = 0., fused_attn = True):
         super().__init__()
         self.layers = nn.ModuleList([])
         self.norm = nn.LayerNorm(dim)
         for _ in range(depth):
             self.layers.append(nn.ModuleList([
-                PreNorm(dim, Attention(dim, heads = heads, dim_head = dim_head, dropout = dropout)),
+                PreNorm(dim, Attention(dim, heads = heads, dim_head = dim_head, dropout = dropout, fused_attn = fused_attn)),
                 PreNorm(dim, FeedForward(dim, mlp_dim, dropout = dropout))
             ]))
 
@@ -128,12 +113,12 @@ class ProjectInOut(nn.Module):
 # cross attention transformer
 
 class CrossTransformer(nn.Module):
-    def __init__(self, sm_dim, lg_dim, depth, heads, dim_head, dropout):
+    def __init__(self, sm_dim, lg_dim, depth, heads, dim_head, dropout, fused_attn = True):
         super().__init__()
         self.layers = nn.ModuleList([])
         for _ in range(depth):
             self.layers.append(
-                ProjectInOut(sm_dim, lg_dim, PreNorm(lg_dim, Attention(lg_dim, heads = heads, dim_head = dim_head, dropout = dropout))),
+                ProjectInOut(sm_dim, lg_dim, PreNorm(lg_dim, Attention(lg_dim, heads = heads, dim_head = dim_head, dropout = dropout, fused_attn = fused_attn))),
                 #ProjectInOut(lg_dim, sm_dim, PreNorm(sm_dim, Attention(sm_dim, heads = heads, dim_head = dim_head, dropout = dropout)))
             )
 
@@ -163,13 +148,14 @@ class MultiScaleEncoder(nn.Module):
         cross_attn_heads,
         cross_attn_depth,
         cross_attn_dim_head = 64,
-        dropout = 0.
+        dropout = 0.,
+        fused_attn = True
     ):
         super().__init__()
         self.layers = nn.ModuleList([])
         for _ in range(depth):
             self.layers.append(
-                CrossTransformer(sm_dim = sm_dim, lg_dim = lg_dim, depth = cross_attn_depth, heads = cross_attn_heads, dim_head = cross_attn_dim_head, dropout = dropout)
+                CrossTransformer(sm_dim = sm_dim, lg_dim = lg_dim, depth = cross_attn_depth, heads = cross_attn_heads, dim_head = cross_attn_dim_head, dropout = dropout, fused_attn = fused_attn)
                             )
 
     def forward(self, sm_tokens, context):
@@ -5,6 +5,7 @@
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import math
 
 from .cross_vit import *
@@ -12,7 +13,10 @@ import os
 import json
 from .backbones import ConvTransformerBackbone
 
+from .common import scaled_dot_product_attention
 from .utils import PositionalEncoding
+from must.utils.feature_store import FeatureStoreWriter
+import must.utils.distributed as du
 
 
 IDENT_FUNCT_DICT = {
@@ -30,6 +34,62 @@ IDENT_FUNCT_DICT = {
                     }
 
 
+def _stack(params):
+    """
+    Stack the same parameter of every pyramid level into one tensor with a
+    leading `levels` dimension.
+    """
+    return torch.stack(list(params))
+
+
+def _batched_linear(x, weight, bias=None):
+    """
+    Per-level linear projection of stacked levels.
+    Args:
+        x (tensor): inputs with dimension `levels` x ... x `dim in`.
+        weight (tensor): weights with dimension `levels` x `dim out` x `dim in`.
+        bias (tensor): biases with dimension `levels` x `dim out`.
+    Returns:
+        x (tensor): outputs with dimension `levels` x ... x `dim out`.
+    """
+    shape = x.shape
+    x = x.reshape(shape[0], -1, shape[-1])
+    if bias is None:
+        x = torch.bmm(x, weight.transpose(1, 2))
+    else:
+        x = torch.baddbmm(bias.unsqueeze(1), x, weight.transpose(1, 2))
+    return x.reshape(*shape[:-1], weight.shape[1])
+
+
+def _batched_layer_norm(x, norms):
+    """
+    Per-level layer norm of stacked levels, with one `nn.LayerNorm` per level.
+    """
+    x = F.layer_norm(x, norms[0].normalized_shape, eps=norms[0].eps)
+    shape = (x.shape[0],) + (1,) * (x.dim() - 2) + (x.shape[-1],)
+    weight = _stack(norm.weight for norm in norms).reshape(shape)
+    bias = _stack(norm.bias for norm in norms).reshape(shape)
+    return x * weight + bias
+
+
+def _split_heads(x, num_heads):
+    """
+    `levels` x `batch` x `tokens` x `dim` to
+    `levels * batch` x `heads` x `tokens` x `head dim`.
+    """
+    levels, batch, tokens, dim = x.shape
+    x = x.reshape(levels * batch, tokens, num_heads, dim // num_heads)
+    return x.transpose(1, 2)
+
+
+def _merge_heads(x, levels):
+    """
+    Inverse of `_split_heads`.
+    """
+    x = x.transpose(1, 2)
+    return x.reshape(levels, x.shape[0] // levels, x.shape[1], -1)
+
+
 class TransformerBasicHead(nn.Module):
     """
     Frame Classification Head of TAPIS.
@@ -132,7 +192,12 @@ class CrossAttentionModule(nn.Module):
 
         self.mvit_feats_enable = cfg.MVIT_FEATS.ENABLE
         self.mvit_feats_path = cfg.MVIT_FEATS.PATH
+        self.mvit_feats_format = cfg.MVIT_FEATS.FORMAT
+        self.mvit_feats_dtype = cfg.MVIT_FEATS.DTYPE
+        self.feature_writer = None
         self.self_attn_layers = cfg.MULTISCALEATTN.SELF_ATTN_LAYERS
+        self.fused = cfg.MULTISCALEATTN.FUSED
+        self.fused_attn = cfg.MVIT.FUSED_ATTN
 
         self.num_sequences = len(cfg.DATA.MULTI_SAMPLING_RATE)
 
@@ -145,7 +210,8 @@ class CrossAttentionModule(nn.Module):
                                     cross_attn_depth=cfg.MULTISCALEATTN.CROSS_ATTN_DEPTH,
                                     cross_attn_heads=cfg.MULTISCALEATTN.CROSS_ATTN_HEADS,
                                     cross_attn_dim_head=cfg.MULTISCALEATTN.CROSS_ATTN_DIM_HEAD,
-                                    dropout=0.1
+                                    dropout=0.1,
+                                    fused_attn=cfg.MVIT.FUSED_ATTN,
                                     ))
         # Initialize Self-Attention 
         for _ in range(self.num_sequences):
@@ -200,6 +266,14 @@ class CrossAttentionModule(nn.Module):
         json_data = {}
         if self.parallel:
             image_names = [IDENT_FUNCT_DICT[self.dataset_name.lower()](*name) for name in image_names]
+
+        if self.mvit_feats_format == "packed":
+            if self.feature_writer is None:
+                self.feature_writer = FeatureStoreWriter(
+                    self.mvit_feats_path, dtype=self.mvit_feats_dtype, rank=du.get_rank()
+                )
+            self.feature_writer.add(image_names, x.data.float().cpu().numpy())
+            return
         
         for idx, frame_name in enumerate(image_names):
             if frame_name in json_data:
@@ -224,48 +298,142 @@ class CrossAttentionModule(nn.Module):
         return data
     
 
-    def forward(self, x, image_names=None):
-        b_size, seq_dim, embed_dim = x[0].shape
-        all_sequences = x
-
-        sequences = []
-
-        # Prepare sequences
-        for idx in range(self.num_sequences):
-            main_seq = all_sequences[idx]
-            other_seqs = all_sequences[:idx] + all_sequences[idx+1:]
-            sequences.append((main_seq, tuple(other_seqs)))
+    def _self_attention(self, idx):
+        """
+        Self-attention layers of a pyramid level.
+        """
+        if self.self_attn_layers > 1:
+            return list(self.full_sequence_self_attention[idx])
+        return [self.full_sequence_self_attention[idx]]
 
+    def forward_levels(self, x):
+        """
+        Encode the pyramid levels one at a time.
+        Args:
+            x (list): tokens of every level with dimension `batch` x
+                `tokens` x `dim`.
+        Returns:
+            embeddings (tensor): class tokens of all the levels with
+                dimension `batch` x `levels * dim`.
+        """
         embeddings = []
-        tokens = torch.zeros((b_size, len(x), embed_dim)).cuda()
-        
         # Perform cross-attention for each level of the pyramid
-        for idx, (seq_tokens, context) in enumerate(sequences):
-
+        for idx, seq_tokens in enumerate(x):
+            context = tuple(x[:idx]) + tuple(x[idx + 1:])
             encoded_seq = self.multiscale_encoder[idx](seq_tokens, context)
-            context = torch.cat(context, dim=1)
             encoded_seq = torch.cat((encoded_seq, seq_tokens), dim=1)
-            if self.self_attn_layers > 1:
-                for idx_self_attn in range(self.self_attn_layers):
-                    encoded_seq = self.full_sequence_self_attention[idx][idx_self_attn](encoded_seq, 
-                                                                        encoded_seq,
-                                                                        encoded_seq)[0]  
-            else:
-                encoded_seq = self.full_sequence_self_attention[idx](encoded_seq, 
-                                                                    encoded_seq,
-                                                                    encoded_seq)[0]
-        
-            cls_token = encoded_seq[:, 0]
+            for self_attn in self._self_attention(idx):
+                encoded_seq = self_attn(encoded_seq, encoded_seq, encoded_seq)[0]
+            embeddings.append(encoded_seq[:, 0])
+        return torch.stack(embeddings, dim=1).flatten(1)
 
-            tokens[:, idx, :] = cls_token
+    def forward_fused(self, x):
+        """
+        Encode all the pyramid levels at once. The weights of the levels are
+        stacked and every projection is a single batched matmul, and the
+        attention of all the levels is a single call over `levels * batch`.
+        Levels must have the same number of tokens. Same outputs as
+        `forward_levels`.
+        Args:
+            x (list): tokens of every level with dimension `batch` x
+                `tokens` x `dim`.
+        Returns:
+            embeddings (tensor): class tokens of all the levels with
+                dimension `batch` x `levels * dim`.
+        """
+        levels = len(x)
+        seqs = torch.stack(x)
+        # Level i attends to its own normalized tokens and to the raw tokens
+        # of the other levels. The keys are permutation invariant, so the
+        # context keeps the level order with level i in its own slot.
+        own_level = torch.eye(levels, dtype=torch.bool, device=seqs.device)
+        own_level = own_level.reshape(levels, levels, 1, 1, 1)
+
+        encoded = seqs
+        num_encoder_layers = len(self.multiscale_encoder[0].layers)
+        for enc_idx in range(num_encoder_layers):
+            cross_layers = [
+                encoder.layers[enc_idx].layers for encoder in self.multiscale_encoder
+            ]
+            for layer_idx in range(len(cross_layers[0])):
+                # ProjectInOut is an identity, sm_dim and lg_dim are equal.
+                prenorms = [layers[layer_idx].fn for layers in cross_layers]
+                attns = [prenorm.fn for prenorm in prenorms]
+                attn = attns[0]
+
+                normed = _batched_layer_norm(encoded, [prenorm.norm for prenorm in prenorms])
+                context = torch.where(own_level, normed.unsqueeze(1), seqs.unsqueeze(0))
+                context = context.transpose(1, 2).flatten(2, 3)
+
+                q = _batched_linear(normed, _stack(a.to_q.weight for a in attns))
+                k, v = _batched_linear(
+                    context, _stack(a.to_kv.weight for a in attns)
+                ).chunk(2, dim=-1)
+                out = scaled_dot_product_attention(
+                    _split_heads(q, attn.heads),
+                    _split_heads(k, attn.heads),
+                    _split_heads(v, attn.heads),
+                    attn.scale,
+                    fused=attn.fused_attn,
+                )
+                out = _batched_linear(
+                    _merge_heads(out, levels),
+                    _stack(a.to_out[0].weight for a in attns),
+                    _stack(a.to_out[0].bias for a in attns),
+                )
+                encoded = F.dropout(out, p=attn.to_out[1].p, training=self.training) + encoded
+
+        encoded = torch.cat((encoded, seqs), dim=2)
+        self_attn_layers = [self._self_attention(idx) for idx in range(levels)]
+        for layer_idx in range(len(self_attn_layers[0])):
+            mhas = [layers[layer_idx] for layers in self_attn_layers]
+            mha = mhas[0]
+            embed_dim = mha.embed_dim
+            in_weight = _stack(m.in_proj_weight for m in mhas)
+            in_bias = _stack(m.in_proj_bias for m in mhas)
+            # Only the class token of the last layer is used.
+            last = layer_idx == len(self_attn_layers[0]) - 1
+            queries = encoded[:, :, :1] if last else encoded
+
+            q = _batched_linear(queries, in_weight[:, :embed_dim], in_bias[:, :embed_dim])
+            k, v = _batched_linear(
+                encoded, in_weight[:, embed_dim:], in_bias[:, embed_dim:]
+            ).chunk(2, dim=-1)
+            out = scaled_dot_product_attention(
+                _split_heads(q, mha.num_heads),
+                _split_heads(k, mha.num_heads),
+                _split_heads(v, mha.num_heads),
+                mha.head_dim ** -0.5,
+                fused=self.fused_attn,
+                dropout_p=mha.dropout if self.training else 0.0,
+            )
+            encoded = _batched_linear(
+                _merge_heads(out, levels),
+                _stack(m.out_proj.weight for m in mhas),
+                _stack(m.out_proj.bias for m in mhas),
+            )
+        return encoded[:, :, 0].transpose(0, 1).flatten(1)
 
-            embeddings.append(cls_token)
-        # Join the logits from each level 
-        embeddings = torch.stack(embeddings).cuda()
-        embeddings = embeddings.permute(1, 0, 2)
-        embeddings = embeddings.reshape(embeddings.shape[0], -1)
+    def embed(self, x):
+        """
+        Fused embedding of the class tokens of all the pyramid levels, the
+        per-frame features of the MTFE.
+        Args:
+            x (list): tokens of every level with dimension `batch` x
+                `tokens` x `dim`.
+        Returns:
+            embeddings (tensor): fused embeddings with dimension `batch` x
+                `levels * dim`.
+        """
+        if self.fused and len({seq.shape for seq in x}) == 1:
+            embeddings = self.forward_fused(x)
+        else:
+            embeddings = self.forward_levels(x)
         # Fuse the logits from each level
-        fused_embeddings = self.mlp_logits_embedding(embeddings)
+        return self.mlp_logits_embedding(embeddings)
+
+    def forward(self, x, image_names=None):
+        fused_embeddings = self.embed(x)
         logits = self.mlp_classifier(fused_embeddings)
         
         if self.act_func == "sigmoid" or not self.training:
@@ -27,13 +27,6 @@ def round_width(width, multiplier, min_width=1, divisor=1, verbose=False):
     return int(width_out)
 
 
-def validate_checkpoint_wrapper_import(checkpoint_wrapper):
-    """
-    Check if checkpoint_wrapper is imported.
-    """
-    if checkpoint_wrapper is None:
-        raise ImportError("Please install fairscale.")
-
 def calc_mvit_feature_geometry(cfg):
     feat_size = [
         [
@@ -15,6 +15,7 @@ import copy
 
 import torch.nn.functional as F
 from torch.nn.init import trunc_normal_
+from torch.utils.checkpoint import checkpoint
 
 import must.utils.weight_init_helper as init_helper
 from .attention import MultiScaleBlock
@@ -24,18 +25,12 @@ from .utils import (
     calc_mvit_feature_geometry,
     get_3d_sincos_pos_embed,
     round_width,
-    validate_checkpoint_wrapper_import, 
     PositionalEncoding
 )
 
 from . import head_helper, resnet_helper, stem_helper, stem_helperv2
 from .build import MODEL_REGISTRY
 
-try:
-    from fairscale.nn.checkpoint import checkpoint_wrapper
-except ImportError:
-    checkpoint_wrapper = None
-
 from .backbones import ConvTransformerBackbone
 
 _POOL1 = {
@@ -193,9 +188,12 @@ class MViT(nn.Module):
         self.norm_stem = norm_layer(embed_dim) if cfg.MVIT.NORM_STEM else None
 
         self.blocks = nn.ModuleList()
+        # Stage of every block, a new stage starts at every dim multiplier.
+        stage_starts = sorted(stage[0] for stage in cfg.MVIT.DIM_MUL)
+        self.block_stages = [
+            sum(start <= i for start in stage_starts) for i in range(depth)
+        ]
 
-        if cfg.MODEL.ACT_CHECKPOINT:
-            validate_checkpoint_wrapper_import(checkpoint_wrapper)
         for i in range(depth):
             num_heads = round_width(num_heads, head_mul[i])
             embed_dim = round_width(embed_dim, dim_mul[i], divisor=num_heads)
@@ -220,11 +218,17 @@ class MViT(nn.Module):
                 mode=mode,
                 has_cls_embed=self.cls_embed_on,
                 pool_first=pool_first,
+                fused_attn=cfg.MVIT.FUSED_ATTN,
             )
-            if cfg.MODEL.ACT_CHECKPOINT:
-                attention_block = checkpoint_wrapper(attention_block)
             self.blocks.append(attention_block)
 
+        if cfg.MODEL.ACT_CHECKPOINT:
+            self.set_act_checkpoint(
+                cfg.MODEL.ACT_CHECKPOINT_STAGES or set(self.block_stages)
+            )
+        else:
+            self.set_act_checkpoint([])
+
         self.embed_dim = dim_out
         self.norm = norm_layer(self.embed_dim)
         pool_size = _POOL1[cfg.MODEL.ARCH]
@@ -290,15 +294,38 @@ class MViT(nn.Module):
         else:
             return {}
 
+    @property
+    def device(self):
+        # Inputs are moved to the device the model was built on.
+        return self.patch_embed.proj.weight.device
+
     def upload_json_file(self, file_path):
         with open(file_path, 'r') as file:
             data = json.load(file)
         return data
 
 
-    def forward(self, x):
-        out = {}
-        x = x[0].cuda()
+    def set_act_checkpoint(self, stages):
+        """
+        Set the stages whose blocks are run with activation checkpointing in
+        training. Their activations are recomputed in the backward pass
+        instead of being kept, only the inputs of the blocks are stored.
+        Args:
+            stages (iterable): indexes of the checkpointed stages.
+        """
+        stages = set(stages)
+        self.act_checkpoint = [stage in stages for stage in self.block_stages]
+
+    def forward_features(self, x):
+        """
+        Encode a batch of clips with the backbone.
+        Args:
+            x (tensor): clips with dimension `batch` x `channel` x `num frames`
+                x `height` x `width`.
+        Returns:
+            x (tensor): normalized tokens with dimension `batch` x `tokens` x
+                `embed dim`.
+        """
         x = self.patch_embed(x)
 
         T = self.cfg.DATA.NUM_FRAMES // self.patch_stride[0]
@@ -333,10 +360,19 @@ class MViT(nn.Module):
             x = self.norm_stem(x)
 
         thw = [T, H, W]
-        for blk in self.blocks:
-            x, thw = blk(x, thw)
+        act_checkpoint = self.training and torch.is_grad_enabled()
+        for blk, blk_checkpoint in zip(self.blocks, self.act_checkpoint):
+            if act_checkpoint and blk_checkpoint:
+                x, thw = checkpoint(blk, x, thw, use_reentrant=False)
+            else:
+                x, thw = blk(x, thw)
 
         x = self.norm(x)
+        return x
+
+    def forward(self, x):
+        out = {}
+        x = self.forward_features(x[0].to(self.device))
 
         # MuST head classification
         for task in self.tasks:
@@ -384,51 +420,37 @@ class MMViT(MViT):
         self.apply(self._init_weights)
 
 
+    def forward_pathways(self, x_seq):
+        """
+        Encode the clips of every sampling rate with the backbone.
+        Args:
+            x_seq (list): clips of every sampling rate.
+        Returns:
+            outs (list): tokens of every sampling rate.
+        """
+        x_seq = [x.to(self.device) for x in x_seq]
+        if all(x.shape == x_seq[0].shape for x in x_seq):
+            # The pathways of every sampling rate share the backbone, they are
+            # encoded in a single pass over the concatenated batch.
+            return list(self.forward_features(torch.cat(x_seq, dim=0)).split(x_seq[0].shape[0], dim=0))
+        return [self.forward_features(x) for x in x_seq]
+
+    def extract_features(self, x_seq, task):
+        """
+        Per-frame features of the multi-term frame encoder, the fused
+        embeddings of the head of a task.
+        Args:
+            x_seq (list): clips of every sampling rate.
+            task (str): task of the head.
+        Returns:
+            features (tensor): features with dimension `batch` x `dim`.
+        """
+        extra_head = getattr(self, "extra_heads_{}".format(task))
+        return extra_head.embed(self.forward_pathways(x_seq))
+
     def forward(self, x_seq, image_names=None):
-        # breakpoint()
         out = {}
-        outs = []
-        for x in x_seq:
-            x = x.cuda()
-            x = self.patch_embed(x)
-
-            T = self.cfg.DATA.NUM_FRAMES // self.patch_stride[0]
-            H = self.cfg.DATA.TRAIN_CROP_SIZE // self.patch_stride[1]
-            W = self.cfg.DATA.TRAIN_CROP_SIZE // self.patch_stride[2]
-            B, N, C = x.shape
-
-            if self.cls_embed_on:
-                cls_tokens = self.cls_token.expand(
-                    B, -1, -1
-                )  # stole cls_tokens impl from Phil Wang, thanks
-                x = torch.cat((cls_tokens, x), dim=1)
-
-            if self.sep_pos_embed:
-                pos_embed = self.pos_embed_spatial.repeat(
-                    1, self.patch_dims[0], 1
-                ) + torch.repeat_interleave(
-                    self.pos_embed_temporal,
-                    self.patch_dims[1] * self.patch_dims[2],
-                    dim=1,
-                )
-                if self.cls_embed_on:
-                    pos_embed = torch.cat([self.pos_embed_class, pos_embed], 1)
-                x = x + pos_embed
-            else:
-                x = x + self.pos_embed
-
-            if self.drop_rate:
-                x = self.pos_drop(x)
-
-            if self.norm_stem:
-                x = self.norm_stem(x)
-
-            thw = [T, H, W]
-            for blk in self.blocks:
-                x, thw = blk(x, thw)
-
-            x = self.norm(x)
-            outs.append(x)
+        outs = self.forward_pathways(x_seq)
 
         # MuST head classification
         for task in self.tasks:
@@ -456,6 +478,10 @@ class TCM(nn.Module):
 
         encoder_layer = nn.TransformerEncoderLayer(cfg.TEMPORAL_MODULE.TCM_D_MODEL, cfg.TEMPORAL_MODULE.TCM_NUM_HEADS)
         self.encoder = nn.TransformerEncoder(encoder_layer, cfg.TEMPORAL_MODULE.TCM_NUM_LAYERS)
+
+        self.causal = cfg.TEMPORAL_MODULE.CAUSAL
+        self.stream_window = cfg.CHUNKS.CHUNK_SIZE
+        self._stream_cache = {}
     
 
         self.classifier = classifier
@@ -473,17 +499,31 @@ class TCM(nn.Module):
             
                 self.add_module("extra_heads_{}".format(task), extra_head)
         
-    def forward(self, x, features=None, boxes_mask=None, sequence_mask=None):
+    @property
+    def device(self):
+        # Inputs are moved to the device the model was built on.
+        return self.embedding.weight.device
+
+    def forward(self, x, features=None, boxes_mask=None, sequence_mask=None, stream_ids=None):
+        if stream_ids is not None and not self.training:
+            return self.forward_stream(x, stream_ids)
+
         out = {}
         
-        x = x.cuda().float()
+        x = x.to(self.device).float()
 
         x = self.embedding(x)
-        x = self.positional_encoding(x)
+
+        mask = None
+        if self.causal:
+            seq_len = x.shape[1]
+            mask = torch.triu(torch.full((seq_len, seq_len), float("-inf"), device=x.device), diagonal=1)
+        else:
+            x = self.positional_encoding(x)
 
         x = x.permute(1, 0, 2)
 
-        x = self.encoder(x)
+        x = self.encoder(x, mask=mask)
         x = x.permute(1, 0, 2)
 
         for task in self.tasks:
@@ -491,3 +531,67 @@ class TCM(nn.Module):
             out[task] = extra_head(x)
 
         return out
+
+    def reset_stream(self):
+        """
+        Drop the cached states of every video being streamed.
+        """
+        self._stream_cache = {}
+
+    @torch.no_grad()
+    def forward_stream(self, x, stream_ids):
+        """
+        Streaming inference of a causal TCM. Each sample holds the newest frame
+        of a video, which is encoded on the window of the last
+        `CHUNKS.CHUNK_SIZE` frames, as in the online inference with full
+        chunks: the embeddings of the previous frames are cached instead of
+        being loaded and embedded again, and the first frame of a video is
+        repeated to fill its first windows. The windows of the samples of a
+        video are encoded in a single pass.
+        Args:
+            x (tensor): features with shape `batch` x `frames` x `input dim`,
+                only the last frame of each sample is used.
+            stream_ids (tensor or list): video of each sample. Videos must be
+                streamed in order and one after the other.
+        Returns:
+            out (dict): per task predictions with shape `batch` x 1 x `classes`.
+        """
+        assert self.causal, "Streaming inference requires a causal TCM"
+        out = {}
+
+        x = x[:, -1].to(self.device).float()
+        stream_ids = [int(stream_id) for stream_id in stream_ids]
+
+        # Videos that are not in the batch have already been fully streamed.
+        for stream_id in list(self._stream_cache):
+            if stream_id not in stream_ids:
+                del self._stream_cache[stream_id]
+
+        window = self.stream_window
+        mask = torch.triu(torch.full((window, window), float("-inf"), device=x.device), diagonal=1)
+        outputs = []
+        start = 0
+        while start < len(stream_ids):
+            end = start
+            while end < len(stream_ids) and stream_ids[end] == stream_ids[start]:
+                end += 1
+
+            h = self.embedding(x[start:end])
+            past = self._stream_cache.get(stream_ids[start])
+            if past is None:
+                past = h[:1].expand(window - 1, -1)
+            h = torch.cat((past, h))
+            self._stream_cache[stream_ids[start]] = h[h.shape[0] - (window - 1):]
+
+            # One window of `window` frames ending at every new frame.
+            windows = h.unfold(0, window, 1).permute(2, 0, 1)
+            outputs.append(self.encoder(windows, mask=mask)[-1])
+            start = end
+
+        x = torch.cat(outputs).unsqueeze(1)
+
+        for task in self.tasks:
+            extra_head = getattr(self, "extra_heads_{}".format(task))
+            out[task] = extra_head(x)
+
+        return out
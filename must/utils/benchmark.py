@@ -3,16 +3,27 @@
 Functions for benchmarks.
 """
 
+import contextlib
+import cv2
+import json
+import os
 import numpy as np
 import pprint
+import subprocess
+import time
 import torch
 import tqdm
 from fvcore.common.timer import Timer
 
+import must.utils.cpu_inference as cpu_inference
 import must.utils.logging as logging
 import must.utils.misc as misc
+from must.config.defaults import assert_and_infer_cfg, get_cfg
 from must.datasets import loader
+from must.datasets.build import DATASET_REGISTRY, build_dataset
+from must.models import build_model
 from must.utils.env import setup_environment
+from must.utils.feature_store import FeatureStoreWriter, pack_feature_store
 
 logger = logging.get_logger(__name__)
 
@@ -23,7 +34,7 @@ def benchmark_data_loading(cfg):
     Args:
 
         cfg (CfgNode): configs. Details can be found in
-            tapir/config/defaults.py
+            must/config/defaults.py
     """
     # Set up environment.
     setup_environment()
@@ -101,3 +112,766 @@ def benchmark_data_loading(cfg):
             np.std(epoch_times),
         )
     )
+
+
+def _get_inference_input(cfg, batch_size):
+    """
+    Random inputs of a batch for the model of the config.
+    Returns:
+        inputs (list or tensor): inputs of the model.
+        num_frames (int): number of frames of every sample.
+    """
+    if cfg.MODEL.MODEL_NAME == "TCM":
+        num_frames = cfg.TEMPORAL_MODULE.NUM_FRAMES
+        return torch.rand(batch_size, num_frames, cfg.TEMPORAL_MODULE.TCM_INPUT_DIM), num_frames
+
+    clip_shape = (
+        batch_size,
+        3,
+        cfg.DATA.NUM_FRAMES,
+        cfg.DATA.TRAIN_CROP_SIZE,
+        cfg.DATA.TRAIN_CROP_SIZE,
+    )
+    if cfg.MODEL.MODEL_NAME == "MMViT":
+        # One clip per sampling rate.
+        num_rates = len(cfg.DATA.MULTI_SAMPLING_RATE)
+        return [torch.rand(clip_shape) for _ in range(num_rates)], cfg.DATA.NUM_FRAMES * num_rates
+    return [torch.rand(clip_shape)], cfg.DATA.NUM_FRAMES
+
+
+def benchmark_inference(cfg):
+    """
+    Benchmark the inference speed of the model of a config on random inputs,
+    in samples and input frames per second. With `NUM_GPUS: 0` and
+    `CPU_INFERENCE.ENABLE`, the CPU inference mode is used.
+    Args:
+        cfg (CfgNode): configs. Details can be found in
+            must/config/defaults.py
+    Returns:
+        results (dict): throughput of the benchmark.
+    """
+    setup_environment()
+    torch.manual_seed(cfg.RNG_SEED)
+    logging.setup_logging(cfg.OUTPUT_DIR)
+
+    model = build_model(cfg)
+    model.eval()
+    cpu_mode = cpu_inference.is_enabled(cfg)
+    if cpu_mode:
+        model = cpu_inference.setup_cpu_inference(cfg, model)
+
+    batch_size = cfg.TEST.BATCH_SIZE
+    inputs, num_frames = _get_inference_input(cfg, batch_size)
+    device = torch.device("cuda") if cfg.NUM_GPUS else torch.device("cpu")
+    if isinstance(inputs, list):
+        inputs = [clip.to(device) for clip in inputs]
+        if cpu_mode:
+            inputs = cpu_inference.prepare_inputs(cfg, inputs)
+    else:
+        inputs = inputs.to(device)
+
+    def forward():
+        with cpu_inference.inference_context(cfg) if cpu_mode else torch.no_grad():
+            model(inputs)
+        if cfg.NUM_GPUS:
+            torch.cuda.synchronize()
+
+    for _ in range(cfg.BENCHMARK.WARMUP_ITERS):
+        forward()
+
+    iter_times = []
+    for _ in range(cfg.BENCHMARK.NUM_ITERS):
+        timer = Timer()
+        forward()
+        iter_times.append(timer.seconds())
+
+    results = {
+        "model": cfg.MODEL.MODEL_NAME,
+        "device": str(device),
+        "batch_size": batch_size,
+        "threads": torch.get_num_threads(),
+        "bfloat16": bool(cpu_mode and cfg.CPU_INFERENCE.BFLOAT16),
+        "channels_last": bool(cpu_mode and cfg.CPU_INFERENCE.CHANNELS_LAST),
+        "iter_time": float(np.mean(iter_times)),
+        "samples_per_second": batch_size / float(np.mean(iter_times)),
+        "frames_per_second": batch_size * num_frames / float(np.mean(iter_times)),
+    }
+    logger.info(
+        "{} on {}: {:.2f}/{:.2f} (avg/std) seconds per batch of {}, "
+        "{:.2f} samples/s, {:.2f} frames/s.".format(
+            results["model"],
+            results["device"],
+            np.mean(iter_times),
+            np.std(iter_times),
+            batch_size,
+            results["samples_per_second"],
+            results["frames_per_second"],
+        )
+    )
+    return results
+
+
+def _set_fused_attention(model, fused):
+    for module in model.modules():
+        if hasattr(module, "fused_attn"):
+            module.fused_attn = fused
+
+
+def _attention_map_bytes(blk, x, thw):
+    """
+    Size of the attention map of a block, as held by the explicit attention.
+    """
+    attn = blk.attn
+    k_shape = []
+    hook = None
+    if getattr(attn, "pool_k", None) is not None:
+        hook = attn.pool_k.register_forward_hook(
+            lambda module, args, output: k_shape.append(output.shape)
+        )
+    with torch.no_grad():
+        out, _ = blk(x, list(thw))
+    if hook is not None:
+        hook.remove()
+    k_tokens = (
+        int(np.prod(k_shape[0][2:])) + int(attn.has_cls_embed) if k_shape else x.shape[1]
+    )
+    return x.shape[0] * attn.num_heads * out.shape[1] * k_tokens * x.element_size()
+
+
+def benchmark_attention(cfg):
+    """
+    Benchmark every MViT block of a config with the fused attention kernels
+    and with the explicit attention map, on the inputs the blocks get from a
+    random batch. Peak memory is measured on GPU. The size of the attention
+    map held by the explicit attention, which the fused kernels never
+    allocate, is reported for every block.
+    Args:
+        cfg (CfgNode): configs. Details can be found in
+            must/config/defaults.py
+    Returns:
+        results (list): time and memory of every block and attention path.
+    """
+    setup_environment()
+    torch.manual_seed(cfg.RNG_SEED)
+    logging.setup_logging(cfg.OUTPUT_DIR)
+
+    model = build_model(cfg)
+    model.eval()
+    device = torch.device("cuda") if cfg.NUM_GPUS else torch.device("cpu")
+    inputs, _ = _get_inference_input(cfg, cfg.TEST.BATCH_SIZE)
+
+    # Inputs of every block.
+    block_inputs = []
+    hooks = [
+        blk.register_forward_pre_hook(
+            lambda module, args: block_inputs.append((args[0], list(args[1])))
+        )
+        for blk in model.blocks
+    ]
+    with torch.no_grad():
+        model.forward_features(inputs[0].to(device))
+    for hook in hooks:
+        hook.remove()
+
+    results = []
+    for idx, (blk, (x, thw)) in enumerate(zip(model.blocks, block_inputs)):
+        attention_map_bytes = _attention_map_bytes(blk, x, thw)
+        for fused in (False, True):
+            _set_fused_attention(blk, fused)
+
+            def forward():
+                with torch.no_grad():
+                    blk(x, list(thw))
+                if cfg.NUM_GPUS:
+                    torch.cuda.synchronize()
+
+            for _ in range(cfg.BENCHMARK.WARMUP_ITERS):
+                forward()
+            if cfg.NUM_GPUS:
+                torch.cuda.reset_peak_memory_stats()
+                base_memory = torch.cuda.memory_allocated()
+            iter_times = []
+            for _ in range(cfg.BENCHMARK.NUM_ITERS):
+                timer = Timer()
+                forward()
+                iter_times.append(timer.seconds())
+
+            results.append({
+                "block": idx,
+                "fused": fused,
+                "tokens": x.shape[1],
+                "attention_map_mb": attention_map_bytes / 1024 ** 2,
+                "iter_time": float(np.mean(iter_times)),
+                "peak_memory_mb": (
+                    (torch.cuda.max_memory_allocated() - base_memory) / 1024 ** 2
+                    if cfg.NUM_GPUS else None
+                ),
+            })
+            logger.info(
+                "Block {} ({} tokens, {:.1f} MB attention map), {} attention: "
+                "{:.4f} seconds{}.".format(
+                    idx,
+                    x.shape[1],
+                    results[-1]["attention_map_mb"],
+                    "fused" if fused else "explicit",
+                    results[-1]["iter_time"],
+                    ", {:.1f} MB".format(results[-1]["peak_memory_mb"]) if cfg.NUM_GPUS else "",
+                )
+            )
+        _set_fused_attention(blk, True)
+    return results
+
+
+def _saved_activation_bytes(model, forward):
+    """
+    Run a forward pass and measure the activations it keeps for the backward
+    pass: the tensors saved by autograd, excluding parameters, and the inputs
+    of the checkpointed blocks. Shared storages are counted once.
+    Args:
+        model (nn.Module): MViT model.
+        forward (callable): forward pass of the model.
+    Returns:
+        outputs: outputs of the forward pass.
+        num_bytes (int): size of the saved activations.
+    """
+    params = {param.untyped_storage().data_ptr() for param in model.parameters()}
+    storages = {}
+
+    def count(tensor):
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in params:
+            storages[storage.data_ptr()] = storage.nbytes()
+
+    def pack(tensor):
+        count(tensor)
+        return tensor
+
+    hooks = [
+        blk.register_forward_pre_hook(lambda module, args: count(args[0]))
+        for blk, blk_checkpoint in zip(model.blocks, model.act_checkpoint)
+        if blk_checkpoint
+    ]
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        outputs = forward()
+    for hook in hooks:
+        hook.remove()
+    return outputs, sum(storages.values())
+
+
+def benchmark_act_checkpoint(cfg):
+    """
+    Benchmark training steps of an MViT or MMViT config without activation
+    checkpointing and with checkpointing of the first 1, 2, ... stages. The
+    activations kept for the backward pass are reported with the step time,
+    and the peak memory of the step on GPU.
+    Args:
+        cfg (CfgNode): configs. Details can be found in
+            must/config/defaults.py
+    Returns:
+        results (list): time and memory of every checkpointing policy.
+    """
+    setup_environment()
+    torch.manual_seed(cfg.RNG_SEED)
+    logging.setup_logging(cfg.OUTPUT_DIR)
+
+    model = build_model(cfg)
+    model.train()
+    device = torch.device("cuda") if cfg.NUM_GPUS else torch.device("cpu")
+    batch_size = cfg.TRAIN.BATCH_SIZE
+    inputs, _ = _get_inference_input(cfg, batch_size)
+    inputs = [clip.to(device) for clip in inputs]
+
+    num_stages = len(set(model.block_stages))
+    policies = [list(range(num_stages))[:num] for num in range(num_stages + 1)]
+    results = []
+    for stages in policies:
+        model.set_act_checkpoint(stages)
+
+        def step():
+            model.zero_grad(set_to_none=True)
+            preds, activation_bytes = _saved_activation_bytes(model, lambda: model(inputs))
+            loss = sum(pred.float().sum() for pred in preds.values())
+            loss.backward()
+            if cfg.NUM_GPUS:
+                torch.cuda.synchronize()
+            return activation_bytes
+
+        for _ in range(cfg.BENCHMARK.WARMUP_ITERS):
+            step()
+        if cfg.NUM_GPUS:
+            torch.cuda.reset_peak_memory_stats()
+            base_memory = torch.cuda.memory_allocated()
+        iter_times, activation_bytes = [], []
+        for _ in range(cfg.BENCHMARK.NUM_ITERS):
+            timer = Timer()
+            activation_bytes.append(step())
+            iter_times.append(timer.seconds())
+
+        results.append({
+            "model": cfg.MODEL.MODEL_NAME,
+            "batch_size": batch_size,
+            "checkpointed_stages": stages,
+            "iter_time": float(np.mean(iter_times)),
+            "activation_memory_mb": float(np.mean(activation_bytes)) / 1024 ** 2,
+            "peak_memory_mb": (
+                (torch.cuda.max_memory_allocated() - base_memory) / 1024 ** 2
+                if cfg.NUM_GPUS else None
+            ),
+        })
+        logger.info(
+            "{} with checkpointed stages {}: {:.4f} seconds per step, "
+            "{:.1f} MB of activations{}.".format(
+                cfg.MODEL.MODEL_NAME,
+                stages,
+                results[-1]["iter_time"],
+                results[-1]["activation_memory_mb"],
+                ", {:.1f} MB peak".format(results[-1]["peak_memory_mb"]) if cfg.NUM_GPUS else "",
+            )
+        )
+    model.set_act_checkpoint(
+        cfg.MODEL.ACT_CHECKPOINT_STAGES or set(model.block_stages)
+        if cfg.MODEL.ACT_CHECKPOINT else []
+    )
+    return results
+
+
+def _latency_stats(iter_times, batch_size):
+    """
+    Throughput and latency percentiles of timed iterations.
+    """
+    iter_times = np.asarray(iter_times)
+    return {
+        "iter_time": float(iter_times.mean()),
+        "latency_p50": float(np.percentile(iter_times, 50)),
+        "latency_p90": float(np.percentile(iter_times, 90)),
+        "latency_p99": float(np.percentile(iter_times, 99)),
+        "samples_per_second": batch_size / float(iter_times.mean()),
+    }
+
+
+def _peak_memory_mb(step, device):
+    """
+    Peak memory allocated by a call, on top of the memory allocated before
+    it. On CPU, the allocations and frees of the call are traced by the
+    profiler.
+    """
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base_memory = torch.cuda.memory_allocated()
+        step()
+        return (torch.cuda.max_memory_allocated() - base_memory) / 1024 ** 2
+    with torch.profiler.profile(
+        activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True
+    ) as prof:
+        step()
+    events = sorted(prof.events(), key=lambda event: event.time_range.start)
+    usage = np.cumsum([event.self_cpu_memory_usage for event in events])
+    return max(0.0, float(usage.max())) / 1024 ** 2 if len(usage) else 0.0
+
+
+def _time_iters(step, cfg):
+    for _ in range(cfg.BENCHMARK.WARMUP_ITERS):
+        step()
+    iter_times = []
+    for _ in range(cfg.BENCHMARK.NUM_ITERS):
+        timer = Timer()
+        step()
+        iter_times.append(timer.seconds())
+    return iter_times
+
+
+def _sum_outputs(outputs):
+    if isinstance(outputs, dict):
+        outputs = list(outputs.values())
+    if isinstance(outputs, (list, tuple)):
+        return sum(_sum_outputs(output) for output in outputs)
+    return outputs.float().sum()
+
+
+def benchmark_model(cfg):
+    """
+    Benchmark the forward pass (in eval mode, with batches of
+    `TEST.BATCH_SIZE`) and the forward and backward passes (in train mode,
+    with batches of `TRAIN.BATCH_SIZE`) of the model of a config on random
+    inputs.
+    Args:
+        cfg (CfgNode): configs. Details can be found in
+            must/config/defaults.py
+    Returns:
+        results (list): throughput, latency percentiles and peak memory of
+            every pass.
+    """
+    torch.manual_seed(cfg.RNG_SEED)
+    model = build_model(cfg)
+    device = torch.device("cuda") if cfg.NUM_GPUS else torch.device("cpu")
+
+    results = []
+    for mode, batch_size in (
+        ("forward", cfg.TEST.BATCH_SIZE),
+        ("forward_backward", cfg.TRAIN.BATCH_SIZE),
+    ):
+        inputs, num_frames = _get_inference_input(cfg, batch_size)
+        if isinstance(inputs, list):
+            inputs = [clip.to(device) for clip in inputs]
+        else:
+            inputs = inputs.to(device)
+
+        if mode == "forward":
+            model.eval()
+
+            def step():
+                with torch.no_grad():
+                    model(inputs)
+                if cfg.NUM_GPUS:
+                    torch.cuda.synchronize()
+
+        else:
+            model.train()
+
+            def step():
+                model.zero_grad(set_to_none=True)
+                _sum_outputs(model(inputs)).backward()
+                if cfg.NUM_GPUS:
+                    torch.cuda.synchronize()
+
+        results.append({
+            "model": cfg.MODEL.MODEL_NAME,
+            "mode": mode,
+            "device": str(device),
+            "batch_size": batch_size,
+            "threads": torch.get_num_threads(),
+            **_latency_stats(_time_iters(step, cfg), batch_size),
+            "peak_memory_mb": _peak_memory_mb(step, device),
+        })
+        results[-1]["frames_per_second"] = results[-1]["samples_per_second"] * num_frames
+        logger.info(
+            "{} {}: {:.4f} seconds per batch of {} (p50 {:.4f}, p99 {:.4f}), "
+            "{:.2f} samples/s, {:.1f} MB peak.".format(
+                cfg.MODEL.MODEL_NAME,
+                mode,
+                results[-1]["iter_time"],
+                batch_size,
+                results[-1]["latency_p50"],
+                results[-1]["latency_p99"],
+                results[-1]["samples_per_second"],
+                results[-1]["peak_memory_mb"],
+            )
+        )
+    return results
+
+
+# Videos and frame names of the synthetic data of every dataset, as read by
+# the dataset classes.
+_SYNTHETIC_VIDEOS = {
+    "cholec80": (["video01", "video02"], "{video}/{video}_{sec:06d}.jpg"),
+    "heichole": (["video_01", "video_02"], "{video}/{sec:05d}.png"),
+    "misaw": (["CASE001", "CASE002"], "{video}/{sec:05d}.jpg"),
+    # Videos whose keyframes are their frames, see `Grasp.keyframe_mapping`.
+    "grasp": (["CASE021", "CASE041"], "{video}/{sec:09d}.jpg"),
+}
+
+
+def _dataset_family(dataset_name):
+    """
+    Dataset of a dataset class and its variant, e.g. `cholec80` and `chunks`
+    for `Cholec80chunks`.
+    """
+    name = dataset_name.lower()
+    for variant in ("chunks", "ms"):
+        if name.endswith(variant):
+            return name[: -len(variant)], variant
+    return name, ""
+
+
+def write_synthetic_dataset(cfg, root, num_frames=64, frame_size=(240, 320)):
+    """
+    Write synthetic frames, frame lists, annotations and packed features for
+    the dataset of a config (`TRAIN.DATASET`), and point the config to them.
+    Every frame of the synthetic videos is a keyframe, with random labels for
+    the tasks of the config. Existing files are reused.
+    Args:
+        cfg (CfgNode): configs, modified in place.
+        root (str): directory of the synthetic data.
+        num_frames (int): number of frames of every video.
+        frame_size (tuple): height and width of the frames.
+    """
+    family, _ = _dataset_family(cfg.TRAIN.DATASET)
+    videos, frame_name = _SYNTHETIC_VIDEOS[family]
+    root = os.path.abspath(os.path.join(root, family))
+    frame_dir = os.path.join(root, "frames")
+    rng = np.random.RandomState(cfg.RNG_SEED)
+
+    names = [
+        (video_idx, video, sec, frame_name.format(video=video, sec=sec))
+        for video_idx, video in enumerate(videos)
+        for sec in range(num_frames)
+    ]
+    for _, _, _, name in names:
+        path = os.path.join(frame_dir, name)
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Smooth noise, which compresses like real frames.
+            img = rng.randint(0, 256, (frame_size[0] // 8, frame_size[1] // 8, 3)).astype(np.uint8)
+            cv2.imwrite(path, cv2.resize(img, (frame_size[1], frame_size[0])))
+
+    list_dir = os.path.join(root, "frame_lists")
+    ann_dir = os.path.join(root, "annotations")
+    os.makedirs(list_dir, exist_ok=True)
+    os.makedirs(ann_dir, exist_ok=True)
+    for split in ("train", "val"):
+        with open(os.path.join(list_dir, split + ".csv"), "w") as f:
+            f.writelines(
+                "{} {} {} {}\n".format(video, video_idx, sec, name)
+                for video_idx, video, sec, name in names
+            )
+        images = [
+            {
+                "id": idx,
+                "file_name": name,
+                "video_name": video,
+                "frame_num": sec,
+                "width": frame_size[1],
+                "height": frame_size[0],
+            }
+            for idx, (_, video, sec, name) in enumerate(names)
+        ]
+        annotations = [
+            dict(
+                {"id": idx, "image_id": idx},
+                **{
+                    task: int(rng.randint(num_classes))
+                    for task, num_classes in zip(cfg.TASKS.TASKS, cfg.TASKS.NUM_CLASSES)
+                },
+            )
+            for idx in range(len(names))
+        ]
+        with open(os.path.join(ann_dir, split + ".json"), "w") as f:
+            json.dump({"images": images, "annotations": annotations}, f)
+
+    dim = cfg.TEMPORAL_MODULE.TCM_INPUT_DIM
+    feature_dir = os.path.join(root, "features_{}".format(dim))
+    if not os.path.isdir(feature_dir):
+        writer = FeatureStoreWriter(feature_dir)
+        writer.add(
+            [name for _, _, _, name in names],
+            rng.standard_normal((len(names), dim)).astype(np.float32),
+        )
+        pack_feature_store(feature_dir)
+
+    # The chunk datasets read this file relative to the working directory.
+    association_file = os.path.join(os.path.dirname(root), "data", "GraSP", "association_30fps.json")
+    if not os.path.isfile(association_file):
+        os.makedirs(os.path.dirname(association_file), exist_ok=True)
+        with open(association_file, "w") as f:
+            json.dump({}, f)
+
+    cfg.ENDOVIS_DATASET.FRAME_DIR = frame_dir
+    cfg.ENDOVIS_DATASET.FRAME_LIST_DIR = list_dir
+    cfg.ENDOVIS_DATASET.TRAIN_LISTS = "train.csv"
+    cfg.ENDOVIS_DATASET.TEST_LISTS = "val.csv"
+    cfg.ENDOVIS_DATASET.ANNOTATION_DIR = ann_dir
+    cfg.ENDOVIS_DATASET.TRAIN_GT_BOX_JSON = "train.json"
+    cfg.ENDOVIS_DATASET.TEST_GT_BOX_JSON = "val.json"
+    cfg.ENDOVIS_DATASET.INCLUDE_GT = True
+    cfg.ENDOVIS_DATASET.USE_PREDS = False
+    cfg.TEMPORAL_MODULE.FEATURE_PATH_TRAIN = feature_dir
+    cfg.TEMPORAL_MODULE.FEATURE_PATH_VAL = feature_dir
+
+
+@contextlib.contextmanager
+def _working_dir(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def benchmark_dataset(cfg, root, split="train"):
+    """
+    Benchmark the construction of the dataset of a config (`TRAIN.DATASET`)
+    and the loading of its samples, on synthetic data written to `root`.
+    `BENCHMARK.NUM_ITERS` x `TRAIN.BATCH_SIZE` random samples are loaded
+    one by one, after `BENCHMARK.WARMUP_ITERS` samples.
+    Args:
+        cfg (CfgNode): configs. Details can be found in
+            must/config/defaults.py
+        root (str): directory of the synthetic data.
+        split (str): split of the dataset.
+    Returns:
+        result (dict): construction time, throughput and latency percentiles
+            of the samples.
+    """
+    write_synthetic_dataset(cfg, root)
+    with _working_dir(root):
+        timer = Timer()
+        dataset = build_dataset(cfg.TRAIN.DATASET, cfg, split)
+        build_time = timer.seconds()
+
+        num_samples = cfg.BENCHMARK.WARMUP_ITERS + cfg.BENCHMARK.NUM_ITERS * cfg.TRAIN.BATCH_SIZE
+        rng = np.random.RandomState(cfg.RNG_SEED)
+        indices = rng.randint(len(dataset), size=num_samples)
+        sample_times = []
+        for idx in indices:
+            timer = Timer()
+            dataset[int(idx)]
+            sample_times.append(timer.seconds())
+
+    result = {
+        "dataset": type(dataset).__name__,
+        "split": split,
+        "num_samples": len(dataset),
+        "build_time": build_time,
+        **_latency_stats(sample_times[cfg.BENCHMARK.WARMUP_ITERS :], 1),
+    }
+    logger.info(
+        "{} ({} samples): built in {:.2f} seconds, {:.4f} seconds per sample "
+        "(p50 {:.4f}, p99 {:.4f}), {:.1f} samples/s.".format(
+            result["dataset"],
+            result["num_samples"],
+            build_time,
+            result["iter_time"],
+            result["latency_p50"],
+            result["latency_p99"],
+            result["samples_per_second"],
+        )
+    )
+    return result
+
+
+def _load_suite_config(config_file, opts):
+    cfg = get_cfg()
+    cfg.merge_from_file(config_file)
+    cfg.merge_from_list(opts)
+    # The suite runs on CPU.
+    cfg.NUM_GPUS = 0
+    return assert_and_infer_cfg(cfg)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark_suite(
+    config_files, opts, output_file, data_dir, models=True, datasets=True
+):
+    """
+    Benchmark the model of every config and every registered dataset class,
+    and write the results as JSON. Datasets are benchmarked with the config
+    of their dataset and variant: `MViT_PHASES.yaml`, `MMViT_PHASES.yaml` for
+    the `ms` classes or `TCM_PHASES.yaml` for the `chunks` classes. Errors of
+    a config or dataset are recorded and the suite goes on.
+    Args:
+        config_files (list): config files, e.g. `configs/*/*.yaml`.
+        opts (list): options overriding every config, e.g. to shrink the
+            models.
+        output_file (str): path of the JSON results.
+        data_dir (str): directory of the synthetic data of the datasets.
+        models (bool): benchmark the models.
+        datasets (bool): benchmark the datasets.
+    Returns:
+        results (dict): the results written to `output_file`.
+    """
+    assert len(opts) % 2 == 0, "Options must be pairs of keys and values: {}".format(opts)
+    setup_environment()
+    results = {
+        "commit": _git_commit(),
+        "torch": torch.__version__,
+        "threads": torch.get_num_threads(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "opts": list(opts),
+        "models": [],
+        "datasets": [],
+    }
+
+    if models:
+        for config_file in config_files:
+            try:
+                entries = benchmark_model(_load_suite_config(config_file, opts))
+            except Exception as e:
+                logger.exception("Benchmark of {} failed".format(config_file))
+                entries = [{"error": repr(e)}]
+            for entry in entries:
+                results["models"].append(dict({"config": config_file}, **entry))
+
+    if datasets:
+        config_dirs = {
+            os.path.basename(os.path.dirname(path)).lower(): os.path.dirname(path)
+            for path in config_files
+        }
+        for dataset_name, _ in sorted(DATASET_REGISTRY):
+            family, variant = _dataset_family(dataset_name)
+            config_file = os.path.join(
+                config_dirs.get(family, ""),
+                {"": "MViT", "ms": "MMViT", "chunks": "TCM"}[variant] + "_PHASES.yaml",
+            )
+            try:
+                if family not in config_dirs or family not in _SYNTHETIC_VIDEOS:
+                    raise ValueError("No config or synthetic data for {}".format(dataset_name))
+                cfg = _load_suite_config(config_file, opts)
+                cfg.TRAIN.DATASET = cfg.TEST.DATASET = dataset_name.lower()
+                entry = benchmark_dataset(cfg, data_dir)
+            except Exception as e:
+                logger.exception("Benchmark of {} failed".format(dataset_name))
+                entry = {"dataset": dataset_name, "error": repr(e)}
+            results["datasets"].append(dict({"config": config_file}, **entry))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info("Benchmark results written to {}".format(output_file))
+    return results
+
+
+def compare_benchmark_results(old, new, threshold=0.1):
+    """
+    Compare the throughput of two results of `run_benchmark_suite`, e.g. of
+    two commits, and log the entries slower by more than `threshold`.
+    Args:
+        old (dict): reference results.
+        new (dict): new results.
+        threshold (float): relative slowdown reported as a regression.
+    Returns:
+        comparison (list): old and new throughput of every entry in both
+            results, and their ratio.
+    """
+    def index(entries, key):
+        return {
+            tuple(entry.get(field) for field in key): entry["samples_per_second"]
+            for entry in entries
+            if "samples_per_second" in entry
+        }
+
+    comparison = []
+    for section, key in (("models", ("config", "mode")), ("datasets", ("dataset",))):
+        old_entries = index(old.get(section, []), key)
+        for name, throughput in index(new.get(section, []), key).items():
+            if name not in old_entries:
+                continue
+            ratio = throughput / old_entries[name]
+            comparison.append({
+                "section": section,
+                "name": list(name),
+                "old_samples_per_second": old_entries[name],
+                "new_samples_per_second": throughput,
+                "ratio": ratio,
+            })
+            if ratio < 1.0 - threshold:
+                logger.warning(
+                    "Regression in {} {}: {:.2f} -> {:.2f} samples/s ({:.0%}).".format(
+                        section, " ".join(str(part) for part in name), old_entries[name], throughput, ratio - 1.0
+                    )
+                )
+    logger.info(
+        "Compared {} entries between {} and {}.".format(
+            len(comparison), old.get("commit"), new.get("commit")
+        )
+    )
+    return comparison
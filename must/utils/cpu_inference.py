@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+"""
+CPU inference mode.
+
+With `CPU_INFERENCE.ENABLE` and no GPUs, models are evaluated under
+`torch.inference_mode`, with a tuned number of intra-op threads, channels-last
+3D convolutions and, optionally, bfloat16 autocast.
+"""
+
+import contextlib
+import psutil
+import torch
+
+import must.utils.logging as logging
+
+logger = logging.get_logger(__name__)
+
+
+def is_enabled(cfg):
+    """
+    Whether the CPU inference mode is used with the given config.
+    """
+    return cfg.CPU_INFERENCE.ENABLE and cfg.NUM_GPUS == 0
+
+
+def get_num_threads(cfg):
+    """
+    Number of intra-op threads, one per physical core unless configured.
+    Hyper-threads share the vector units of their core and only add
+    contention to the GEMMs.
+    """
+    if cfg.CPU_INFERENCE.NUM_THREADS > 0:
+        return cfg.CPU_INFERENCE.NUM_THREADS
+    return psutil.cpu_count(logical=False) or torch.get_num_threads()
+
+
+def setup_cpu_inference(cfg, model):
+    """
+    Prepare a model for CPU inference.
+    Args:
+        cfg (CfgNode): configs.
+        model (nn.Module): model on CPU.
+    Returns:
+        model (nn.Module): the model in eval mode, with channels-last 3D
+            convolution weights if enabled.
+    """
+    num_threads = get_num_threads(cfg)
+    torch.set_num_threads(num_threads)
+    model.eval()
+    if cfg.CPU_INFERENCE.CHANNELS_LAST:
+        # Only 5D weights (the Conv3d patch embeddings) are converted.
+        model = model.to(memory_format=torch.channels_last_3d)
+    logger.info(
+        "CPU inference with {} threads, channels last {}, bfloat16 {}".format(
+            num_threads, cfg.CPU_INFERENCE.CHANNELS_LAST, cfg.CPU_INFERENCE.BFLOAT16
+        )
+    )
+    return model
+
+
+def prepare_inputs(cfg, inputs):
+    """
+    Convert the 5D clips of nested lists of inputs to channels-last.
+    """
+    if not cfg.CPU_INFERENCE.CHANNELS_LAST:
+        return inputs
+    if isinstance(inputs, (list, tuple)):
+        return [prepare_inputs(cfg, item) for item in inputs]
+    if torch.is_tensor(inputs) and inputs.dim() == 5:
+        return inputs.contiguous(memory_format=torch.channels_last_3d)
+    return inputs
+
+
+@contextlib.contextmanager
+def inference_context(cfg):
+    """
+    Context of the forward passes of the CPU inference mode.
+    """
+    with torch.inference_mode(), torch.autocast(
+        "cpu", dtype=torch.bfloat16, enabled=cfg.CPU_INFERENCE.BFLOAT16
+    ):
+        yield
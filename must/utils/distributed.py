@@ -34,6 +34,45 @@ def all_gather(tensors):
     return output_tensor
 
 
+def all_gather_aligned(tensors):
+    """
+    All gathers tensors whose first dimension may differ across processes.
+    Every tensor is padded to the largest size along its first dimension and
+    gathered with a single tensor collective, without serialization.
+    Args:
+        tensors (list): tensors with the same first dimension on this
+            process, e.g. the predictions and names of the same samples.
+    Returns:
+        output_tensor (list): the tensors of all the processes concatenated
+            in rank order, on the device of the inputs.
+    """
+    world_size = dist.get_world_size()
+    device = tensors[0].device
+    # NCCL only communicates CUDA tensors.
+    if dist.get_backend() == "nccl":
+        comm_device = torch.device("cuda", torch.cuda.current_device())
+    else:
+        comm_device = torch.device("cpu")
+
+    size = torch.tensor([tensors[0].shape[0]], dtype=torch.int64, device=comm_device)
+    size_list = [torch.zeros_like(size) for _ in range(world_size)]
+    dist.all_gather(size_list, size)
+    size_list = [int(size.item()) for size in size_list]
+    max_size = max(size_list)
+
+    output_tensor = []
+    for tensor in tensors:
+        assert tensor.shape[0] == size_list[get_rank()]
+        padded = tensor.new_zeros((max_size,) + tuple(tensor.shape[1:]), device=comm_device)
+        padded[: tensor.shape[0]] = tensor
+        tensor_list = [torch.empty_like(padded) for _ in range(world_size)]
+        dist.all_gather(tensor_list, padded)
+        output_tensor.append(
+            torch.cat([t[:size] for t, size in zip(tensor_list, size_list)], dim=0).to(device)
+        )
+    return output_tensor
+
+
 def all_reduce(tensors, average=True):
     """
     All reduce the provided tensors from all processes across machines.
@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+
+"""
+Packed per-video feature store.
+
+Frame embeddings produced by the MTFE are stored as one contiguous
+`(num_frames, dim)` array per video (`<root>/<video>.npy`), next to a sidecar
+(`<root>/<video>.frames.json`) that lists the frame names in row order. Rows
+are sorted by frame name, so the consecutive keyframes of a chunk map to a
+contiguous slice of a memory-mapped array.
+
+Extraction writes raw per-process parts (`<video>.part<rank>.bin/.txt`)
+through `FeatureStoreWriter`, and `pack_feature_store` merges them into the
+final arrays once every process is done. Parts left by an interrupted
+extraction are truncated to their complete rows by `repair_parts`, and
+`stored_frames` lists the frames that do not need to be extracted again.
+
+`FeatureBank` gathers the features used by a dataset into a single array in
+shared memory, so every dataloader worker and every process of a node reads
+the same copy.
+"""
+
+import argparse
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import torch
+
+import must.utils.logging as logging
+
+logger = logging.get_logger(__name__)
+
+FEATURES_EXT = ".npy"
+FRAMES_EXT = ".frames.json"
+PART_FEATURES_EXT = ".bin"
+PART_FRAMES_EXT = ".txt"
+
+
+def split_frame_name(frame_name):
+    """
+    Split a frame name into its video and frame keys.
+    Args:
+        frame_name (str): path of the frame relative to the frames directory,
+            e.g. `video01/video01_000123.jpg`.
+    Returns:
+        video (str): video key, e.g. `video01`.
+        frame (str): frame key without extension, e.g. `video01_000123`.
+    """
+    video, frame = os.path.split(frame_name)
+    return video, os.path.splitext(frame)[0]
+
+
+def has_packed_video(root, video):
+    """
+    Check whether a video has been packed in the feature store at `root`.
+    """
+    return os.path.isfile(os.path.join(root, video + FEATURES_EXT))
+
+
+class FeatureStoreWriter(object):
+    """
+    Appends frame embeddings to per-video part files. Every process writes its
+    own parts, so no synchronization is needed while extracting.
+    """
+
+    def __init__(self, root, dtype="float32", rank=0):
+        """
+        Args:
+            root (str): directory of the feature store.
+            dtype (str): storage dtype, `float16` or `float32`.
+            rank (int): rank of the process writing the features.
+        """
+        assert dtype in ("float16", "float32"), f"Unsupported feature dtype {dtype}"
+        self.root = root
+        self.dtype = np.dtype(dtype)
+        self.rank = rank
+
+    def _part_path(self, video, ext):
+        return os.path.join(self.root, "{}.part{}{}".format(video, self.rank, ext))
+
+    def add(self, frame_names, features):
+        """
+        Append a batch of embeddings.
+        Args:
+            frame_names (list): frame names relative to the frames directory.
+            features (ndarray): embeddings with shape `len(frame_names)` x `dim`.
+        """
+        assert len(frame_names) == len(features)
+        features = np.ascontiguousarray(features, dtype=self.dtype)
+
+        rows_per_video = {}
+        for idx, name in enumerate(frame_names):
+            video, frame = split_frame_name(name)
+            rows_per_video.setdefault(video, ([], []))
+            rows_per_video[video][0].append(idx)
+            rows_per_video[video][1].append(frame)
+
+        for video, (rows, frames) in rows_per_video.items():
+            os.makedirs(os.path.dirname(self._part_path(video, "")), exist_ok=True)
+            with open(self._part_path(video, PART_FEATURES_EXT), "ab") as f:
+                features[rows].tofile(f)
+            with open(self._part_path(video, PART_FRAMES_EXT), "a") as f:
+                f.write("".join(frame + "\n" for frame in frames))
+
+
+def _part_prefixes(root):
+    """
+    Part files of every video, as `{video path: [part prefixes]}`.
+    """
+    parts = {}
+    for frames_path in glob.glob(os.path.join(root, "**", "*.part*" + PART_FRAMES_EXT), recursive=True):
+        video_path = frames_path[: -len(PART_FRAMES_EXT)].rsplit(".part", 1)[0]
+        parts.setdefault(video_path, []).append(frames_path[: -len(PART_FRAMES_EXT)])
+    return parts
+
+
+def repair_parts(root, dim, dtype="float32"):
+    """
+    Truncate the part files of an interrupted extraction to the rows whose
+    features and frame name were both written. Must be called by a single
+    process before any writer is created.
+    Args:
+        root (str): directory of the feature store.
+        dim (int): dimension of the features.
+        dtype (str): dtype the parts were written with.
+    """
+    row_bytes = dim * np.dtype(dtype).itemsize
+    for part_prefixes in _part_prefixes(root).values():
+        for prefix in part_prefixes:
+            with open(prefix + PART_FRAMES_EXT, "r") as f:
+                frames = f.read()
+            # The last name may have been cut while being written.
+            frames = frames.split("\n")[:-1]
+            features_path = prefix + PART_FEATURES_EXT
+            num_features = (
+                os.path.getsize(features_path) // row_bytes if os.path.isfile(features_path) else 0
+            )
+            num_rows = min(len(frames), num_features)
+            if num_rows == len(frames) and num_rows * row_bytes == os.path.getsize(features_path):
+                continue
+            logger.info("Truncating {} to {} complete rows".format(prefix, num_rows))
+            with open(prefix + PART_FRAMES_EXT, "w") as f:
+                f.write("".join(frame + "\n" for frame in frames[:num_rows]))
+            with open(features_path, "ab") as f:
+                f.truncate(num_rows * row_bytes)
+
+
+def stored_frames(root):
+    """
+    Frames with features in a feature store, packed or in part files.
+    Args:
+        root (str): directory of the feature store.
+    Returns:
+        frames (dict): frame keys of every video, as `{video: set(frames)}`.
+    """
+    frames = {}
+    for frames_path in glob.glob(os.path.join(root, "**", "*" + FRAMES_EXT), recursive=True):
+        video = os.path.relpath(frames_path[: -len(FRAMES_EXT)], root)
+        with open(frames_path, "r") as f:
+            frames.setdefault(video, set()).update(json.load(f)["frames"])
+    for video_path, part_prefixes in _part_prefixes(root).items():
+        video = os.path.relpath(video_path, root)
+        for prefix in part_prefixes:
+            with open(prefix + PART_FRAMES_EXT, "r") as f:
+                frames.setdefault(video, set()).update(f.read().split())
+    return frames
+
+
+def pack_feature_store(root, dtype="float32"):
+    """
+    Merge the part files written by every `FeatureStoreWriter` into one sorted
+    array and frame sidecar per video. Must be called by a single process once
+    all writers are done.
+    Args:
+        root (str): directory of the feature store.
+        dtype (str): dtype the parts were written with.
+    """
+    dtype = np.dtype(dtype)
+    parts = _part_prefixes(root)
+
+    for video_path, part_prefixes in sorted(parts.items()):
+        frames = []
+        features = []
+        for prefix in part_prefixes:
+            with open(prefix + PART_FRAMES_EXT, "r") as f:
+                part_frames = f.read().split()
+            part_features = np.fromfile(prefix + PART_FEATURES_EXT, dtype=dtype)
+            frames.extend(part_frames)
+            features.append(part_features.reshape(len(part_frames), -1))
+
+        # Frames packed by a previous extraction are kept, unless extracted
+        # again.
+        if os.path.isfile(video_path + FEATURES_EXT):
+            with open(video_path + FRAMES_EXT, "r") as f:
+                frames.extend(json.load(f)["frames"])
+            features.append(np.load(video_path + FEATURES_EXT).astype(dtype))
+
+        features = np.concatenate(features)
+        # Frames seen by more than one process (padded distributed samplers)
+        # are stored once.
+        frames, rows = np.unique(np.array(frames), return_index=True)
+
+        tmp_path = video_path + ".tmp" + FEATURES_EXT
+        packed = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=dtype, shape=(len(rows), features.shape[1])
+        )
+        packed[:] = features[rows]
+        packed.flush()
+        del packed
+        os.replace(tmp_path, video_path + FEATURES_EXT)
+
+        with open(video_path + FRAMES_EXT, "w") as f:
+            json.dump({"frames": frames.tolist()}, f)
+
+        for prefix in part_prefixes:
+            os.remove(prefix + PART_FRAMES_EXT)
+            os.remove(prefix + PART_FEATURES_EXT)
+
+    logger.info("Packed features of {} videos in {}".format(len(parts), root))
+
+
+class FeatureStoreReader(object):
+    """
+    Read-only access to a packed feature store. Arrays are memory-mapped on
+    first use, so the reader is cheap to create in every dataloader worker.
+    """
+
+    def __init__(self, root):
+        """
+        Args:
+            root (str): directory of the feature store.
+        """
+        self.root = root
+        self._features = {}
+        self._frame_index = {}
+
+    def _open(self, video):
+        if video not in self._features:
+            video_path = os.path.join(self.root, video)
+            with open(video_path + FRAMES_EXT, "r") as f:
+                frames = json.load(f)["frames"]
+            self._features[video] = np.load(video_path + FEATURES_EXT, mmap_mode="r")
+            self._frame_index[video] = {frame: row for row, frame in enumerate(frames)}
+        return self._features[video], self._frame_index[video]
+
+    def has_video(self, video):
+        return video in self._features or has_packed_video(self.root, video)
+
+    def videos(self):
+        """
+        Keys of the packed videos of the store, read from their frame indexes,
+        including videos nested in sub-directories (e.g. `case/subvideo`).
+        """
+        return sorted(
+            os.path.relpath(frames_path[: -len(FRAMES_EXT)], self.root)
+            for frames_path in glob.glob(os.path.join(self.root, "**", "*" + FRAMES_EXT), recursive=True)
+        )
+
+    def frame_names(self, video):
+        """
+        Frame keys of a video in row order.
+        """
+        return list(self._open(video)[1].keys())
+
+    def get(self, video, frames):
+        """
+        Gather the embeddings of some frames of a video.
+        Args:
+            video (str): video key.
+            frames (list): frame keys without extension.
+        Returns:
+            features (ndarray): float32 embeddings with shape `len(frames)` x `dim`.
+        """
+        features, frame_index = self._open(video)
+        rows = [frame_index[frame] for frame in frames]
+        if len(rows) > 0 and rows == list(range(rows[0], rows[0] + len(rows))):
+            # Consecutive frames: a single slice of the memory map.
+            out = features[rows[0] : rows[-1] + 1]
+        else:
+            out = features[rows]
+        return np.asarray(out, dtype=np.float32)
+
+
+def load_frame_features(root, frame_names, reader=None, out=None):
+    """
+    Load the features of some frames of a packed feature store.
+    Args:
+        root (str): directory of the feature store.
+        frame_names (list): frame names relative to the frames directory.
+        reader (FeatureStoreReader): reader of `root` to reuse, if any.
+        out (ndarray): array to write the features to, if any.
+    Returns:
+        features (ndarray): float32 features with shape
+            `len(frame_names)` x `dim`.
+    """
+    reader = reader if reader is not None else FeatureStoreReader(root)
+    rows_per_video = {}
+    for idx, name in enumerate(frame_names):
+        video, frame = split_frame_name(name)
+        rows_per_video.setdefault(video, ([], []))
+        rows_per_video[video][0].append(idx)
+        rows_per_video[video][1].append(frame)
+
+    features = out
+    for video, (rows, frames) in rows_per_video.items():
+        video_features = reader.get(video, frames)
+        if features is None:
+            features = np.empty((len(frame_names), video_features.shape[1]), dtype=np.float32)
+        features[rows] = video_features
+    return features
+
+
+class FeatureBank(object):
+    """
+    Features of a fixed list of frames in one float32 `(num_frames, dim)`
+    array, stored as a `.npy` file in a shared-memory directory (`/dev/shm`)
+    and memory-mapped read-only. The first process that needs a bank builds
+    it; every other process, and every dataloader worker, maps the same pages,
+    so the features are held once per node. Rows follow the order of the
+    frame list, so samples are gathered with a single fancy-index.
+
+    Banks are named after the feature store and the frame list, followed by
+    the version of the features (the modification times of the stored
+    videos). They are reused by later runs until the features change; the
+    process that builds a new version removes the superseded ones. Processes
+    that still map a removed bank keep reading it until they exit.
+
+    The builder holds a `.lock` file with its PID. Waiting processes remove
+    the lock of a builder that died, and build the bank themselves. When the
+    bank directory has no room for the bank, features are read from the
+    packed store instead, since a full tmpfs would kill the process with
+    SIGBUS while writing the memory map.
+    """
+
+    # Seconds after which a lock without a PID is considered stale.
+    LOCK_TIMEOUT = 60
+
+    def __init__(self, root, frame_names, bank_dir="/dev/shm"):
+        """
+        Args:
+            root (str): directory of the feature store.
+            frame_names (list): frame names relative to the frames directory,
+                in row order.
+            bank_dir (str): directory the bank is stored in.
+        """
+        self.root = root
+        self.bank_dir = bank_dir
+        self.frame_names = frame_names
+        self.prefix = os.path.join(
+            bank_dir, "must_feature_bank_{}_".format(self._key(root, frame_names))
+        )
+        self.path = self.prefix + "{}.npy".format(self._version(root, frame_names))
+        self.features = None
+        self._reader = None
+        if os.path.isfile(self.path) or self._build(frame_names):
+            self.features = np.load(self.path, mmap_mode="r")
+            assert len(self.features) == len(frame_names), f"Corrupted feature bank {self.path}"
+        else:
+            self._reader = FeatureStoreReader(root)
+
+    @staticmethod
+    def _key(root, frame_names):
+        key = hashlib.sha1(os.path.abspath(root).encode())
+        key.update("\n".join(frame_names).encode())
+        return key.hexdigest()[:16]
+
+    @staticmethod
+    def _version(root, frame_names):
+        version = hashlib.sha1()
+        for video in sorted({split_frame_name(name)[0] for name in frame_names}):
+            video_path = os.path.join(root, video)
+            if has_packed_video(root, video):
+                video_path += FEATURES_EXT
+            version.update(str(os.path.getmtime(video_path)).encode())
+        return version.hexdigest()[:8]
+
+    def _lock_is_stale(self, lock_path):
+        """
+        Whether the process that holds a lock is gone.
+        """
+        try:
+            with open(lock_path) as f:
+                pid = f.read().strip()
+            age = time.time() - os.path.getmtime(lock_path)
+        except FileNotFoundError:
+            return False
+        if not pid.isdigit():
+            # The builder may not have written its PID yet.
+            return age > self.LOCK_TIMEOUT
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def _build(self, frame_names):
+        """
+        Build the bank, or wait for the process building it.
+        Returns:
+            (bool): whether the bank was built, False if there is not enough
+                room for it in the bank directory.
+        """
+        lock_path = self.path + ".lock"
+        waiting = False
+        while not os.path.isfile(self.path):
+            try:
+                lock = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._lock_is_stale(lock_path):
+                    logger.warning("Removing stale lock {}".format(lock_path))
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(lock_path)
+                    continue
+                if not waiting:
+                    logger.info("Waiting for feature bank {}".format(self.path))
+                    waiting = True
+                time.sleep(1)
+                continue
+
+            pid = str(os.getpid())
+            try:
+                os.write(lock, pid.encode())
+                if not os.path.isfile(self.path):
+                    self._remove_superseded()
+                    dim = load_frame_features(self.root, frame_names[:1]).shape[1]
+                    if not self._has_room(len(frame_names) * dim * np.dtype(np.float32).itemsize):
+                        return False
+                    self._write(frame_names, dim)
+            finally:
+                os.close(lock)
+                self._release_lock(lock_path, pid)
+        return True
+
+    def _has_room(self, num_bytes):
+        """
+        Whether the bank directory has room for a bank of `num_bytes`.
+        """
+        free = shutil.disk_usage(self.bank_dir).free
+        # Leave room for the header of the `.npy` file.
+        if num_bytes + 4096 <= free:
+            return True
+        logger.warning(
+            "Not enough room in {} for feature bank {} ({:.2f} GB needed, {:.2f} GB free), "
+            "reading the feature store instead".format(
+                self.bank_dir, self.path, num_bytes / 1024 ** 3, free / 1024 ** 3
+            )
+        )
+        return False
+
+    @staticmethod
+    def _release_lock(lock_path, pid):
+        """
+        Remove a lock only if it still holds our PID, it may have been found
+        stale and taken over by another process.
+        """
+        try:
+            with open(lock_path) as f:
+                owner = f.read().strip()
+        except FileNotFoundError:
+            return
+        if owner == pid:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(lock_path)
+
+    def _write(self, frame_names, dim):
+        # Unique per process, in case a lock was wrongly found stale.
+        tmp_path = "{}.{}.tmp.npy".format(self.path, os.getpid())
+        try:
+            bank = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=np.float32, shape=(len(frame_names), dim)
+            )
+            # Written video by video, the features are never held twice.
+            load_frame_features(self.root, frame_names, out=bank)
+            bank.flush()
+            logger.info(
+                "Built feature bank {} with {} frames ({:.2f} GB)".format(
+                    self.path, len(frame_names), bank.nbytes / 1024 ** 3
+                )
+            )
+            del bank
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
+    def _remove_superseded(self):
+        """
+        Remove the other versions of the bank, built before the features
+        changed.
+        """
+        for path in glob.glob(glob.escape(self.prefix) + "*.npy"):
+            if path != self.path and not path.endswith(".tmp.npy"):
+                logger.info("Removing superseded feature bank {}".format(path))
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+
+    def __len__(self):
+        return len(self.frame_names)
+
+    def gather(self, rows):
+        """
+        Gather the features of some rows of the bank.
+        Args:
+            rows (ndarray): row indices.
+        Returns:
+            features (ndarray): float32 features with shape `len(rows)` x `dim`.
+        """
+        if self.features is None:
+            return load_frame_features(
+                self.root, [self.frame_names[row] for row in np.atleast_1d(rows)], reader=self._reader
+            )
+        return np.asarray(self.features[rows])
+
+
+def pack_pth_features(root, dtype="float32"):
+    """
+    Convert a directory of per-frame `<video>/<frame>.pth` features, as saved
+    by previous extractions, into a packed feature store in place.
+    Args:
+        root (str): directory holding one sub-directory of `.pth` files per video.
+        dtype (str): storage dtype of the packed arrays.
+    """
+    writer = FeatureStoreWriter(root, dtype=dtype)
+    for video in sorted(os.listdir(root)):
+        video_dir = os.path.join(root, video)
+        if not os.path.isdir(video_dir):
+            continue
+        frame_names = []
+        features = []
+        for feature_file in sorted(glob.glob(os.path.join(video_dir, "*.pth"))):
+            frame_names.append(os.path.join(video, os.path.basename(feature_file)))
+            features.append(np.concatenate(torch.load(feature_file)))
+        if len(features) > 0:
+            writer.add(frame_names, np.stack(features))
+    pack_feature_store(root, dtype=dtype)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack per-frame .pth features into a feature store.")
+    parser.add_argument("root", help="Directory with one folder of .pth features per video.")
+    parser.add_argument("--dtype", default="float32", choices=["float16", "float32"])
+    args = parser.parse_args()
+    pack_pth_features(args.root, args.dtype)
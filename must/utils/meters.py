@@ -11,6 +11,7 @@ import numpy as np
 import os
 import json
 from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 import torch
 from fvcore.common.timer import Timer
 from sklearn.metrics import average_precision_score
@@ -47,6 +48,191 @@ IDENT_FUNCT_DICT = {
                     'Heicholechunks': lambda x,y: 'video_{:02d}/{:05d}.png'.format(x,y),
                     }
 
+class PredictionBuffer(object):
+    """
+    Growable numpy buffers with the predictions of an epoch: an integer
+    `(video, frame)` id per row and one float32 score matrix per task.
+    Frames named by strings are given the id `(index of the name, -1)`.
+    """
+
+    def __init__(self, tasks, capacity=1024):
+        """
+        Args:
+            tasks (list): tasks whose scores are stored.
+            capacity (int): initial number of rows of the buffers.
+        """
+        self.tasks = tasks
+        self._capacity = capacity
+        self.reset()
+
+    def reset(self):
+        self._size = 0
+        self._ids = np.empty((self._capacity, 2), dtype=np.int64)
+        self._scores = {task: None for task in self.tasks}
+        self._names = []
+        self._name_index = {}
+
+    def __len__(self):
+        return self._size
+
+    def _to_ids(self, names):
+        if len(names) > 0 and isinstance(names[0], str):
+            ids = np.full((len(names), 2), -1, dtype=np.int64)
+            for row, name in enumerate(names):
+                if name not in self._name_index:
+                    self._name_index[name] = len(self._names)
+                    self._names.append(name)
+                ids[row, 0] = self._name_index[name]
+            return ids
+        return np.asarray(names, dtype=np.int64).reshape(-1, 2)
+
+    def _reserve(self, size):
+        capacity = len(self._ids)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        self._ids = np.resize(self._ids, (capacity, 2))
+        for task, scores in self._scores.items():
+            if scores is not None:
+                self._scores[task] = np.resize(scores, (capacity, scores.shape[1]))
+
+    def add(self, preds, names):
+        """
+        Append the predictions of a batch.
+        Args:
+            preds (dict): task -> scores (tensor, ndarray or list) with one
+                row per frame.
+            names (list or ndarray): `(video, frame)` ids or frame names of
+                the rows.
+        """
+        ids = self._to_ids(names)
+        start, end = self._size, self._size + len(ids)
+        self._reserve(end)
+        self._ids[start:end] = ids
+        for task in self.tasks:
+            scores = preds[task]
+            if torch.is_tensor(scores):
+                scores = scores.float().numpy()
+            scores = np.asarray(scores, dtype=np.float32).reshape(len(ids), -1)
+            if self._scores[task] is None:
+                self._scores[task] = np.empty((len(self._ids), scores.shape[1]), dtype=np.float32)
+            self._scores[task][start:end] = scores
+        self._size = end
+
+    def averaged(self, task):
+        """
+        Mean scores of every distinct frame.
+        Args:
+            task (str): task of the scores.
+        Returns:
+            ids (ndarray): the distinct `(video, frame)` ids.
+            scores (ndarray): float64 mean scores of every id.
+        """
+        ids, inverse = np.unique(self._ids[: self._size], axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        scores = np.zeros((len(ids), self._scores[task].shape[1]), dtype=np.float64)
+        np.add.at(scores, inverse, self._scores[task][: self._size])
+        scores /= np.bincount(inverse, minlength=len(ids))[:, None]
+        return ids, scores
+
+    def frame_names(self, ids, ident_funct):
+        """
+        Frame names of some ids.
+        Args:
+            ids (ndarray): `(video, frame)` ids.
+            ident_funct (callable): builds the name of a frame from its video
+                and frame numbers.
+        Returns:
+            names (list): the frame names.
+        """
+        return [
+            self._names[video] if frame == -1 else ident_funct(video, frame)
+            for video, frame in ids.tolist()
+        ]
+
+
+def save_prediction_json(names, scores, task, path):
+    """
+    Save the scores of every frame for a task as
+    `{frame name: {<task>_score_dist: scores}}`.
+    Args:
+        names (list): frame names.
+        scores (ndarray): scores with one row per frame.
+        task (str): task to save.
+        path (str): path of the json file.
+    """
+    task_key_name = f'{task}_score_dist'
+    save_json_dict = {
+        name: {task_key_name: score} for name, score in zip(names, scores.tolist())
+    }
+    with open(path, "w") as outfile:
+        json.dump(save_json_dict, outfile)
+
+
+class PredictionEvaluator(object):
+    """
+    Compute the metrics of the predictions of an epoch. The ground truth is
+    loaded once per run. Metrics in `ARRAY_METRIC_DICT` are computed from the
+    prediction arrays, and the prediction jsons are then written by a
+    background thread if `TASKS.SAVE_PREDICTIONS`. Other metrics are computed
+    from the prediction json.
+    """
+
+    def __init__(self, cfg):
+        """
+        Args:
+            cfg (CfgNode): configs.
+        """
+        self.groundtruth_path = cfg.ENDOVIS_DATASET.TEST_COCO_ANNS
+        self.output_dir = cfg.OUTPUT_DIR
+        self.save_predictions = cfg.TASKS.SAVE_PREDICTIONS
+        self._groundtruth = None
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+
+    @property
+    def groundtruth(self):
+        if self._groundtruth is None:
+            self._groundtruth = grasp_eval.GroundTruth(self.groundtruth_path)
+        return self._groundtruth
+
+    def evaluate(self, predictions, task, metric, ident_funct, epoch):
+        """
+        Evaluate the mean predictions of every frame for a task.
+        Args:
+            predictions (PredictionBuffer): the predictions of the epoch.
+            task (str): task to evaluate.
+            metric (str): metric of the task.
+            ident_funct (callable): builds the name of a frame from its video
+                and frame numbers.
+            epoch (int): the number of current epoch.
+        Returns:
+            metrics (dict): the metrics of the task.
+            path (str or None): path of the prediction json, if saved.
+        """
+        path = os.path.join(self.output_dir, f'epoch_{epoch}_preds_{task}.json')
+        ids, scores = predictions.averaged(task)
+        names = predictions.frame_names(ids, ident_funct)
+        if metric not in grasp_eval.ARRAY_METRIC_DICT:
+            save_prediction_json(names, scores, task, path)
+            return grasp_eval.main_per_task(self.groundtruth.coco_anns, path, task, metric), path
+
+        metrics = grasp_eval.main_per_task_arrays(self.groundtruth, task, metric, names, scores)
+        if not self.save_predictions:
+            return metrics, None
+        self._pending.append(self._writer.submit(save_prediction_json, names, scores, task, path))
+        return metrics, path
+
+    def wait(self):
+        """
+        Wait until the prediction jsons are written.
+        """
+        for future in self._pending:
+            future.result()
+        self._pending = []
+
+
 class SurgeryMeterChunks(object):
     """
     Measure the PSI-AVA train, val, and test stats.
@@ -77,11 +263,10 @@ class SurgeryMeterChunks(object):
         self.iter_timer = Timer()
         self.data_timer = Timer()
         self.net_timer = Timer()
-        self.all_preds = {k: [] for k in self.tasks}
+        self.predictions = PredictionBuffer(self.tasks)
         self.full_map = {}
-        self.all_names = []
         self.overall_iters = overall_iters
-        self.groundtruth = cfg.ENDOVIS_DATASET.TEST_COCO_ANNS
+        self.evaluator = PredictionEvaluator(cfg)
 
         self.output_dir = cfg.OUTPUT_DIR
 
@@ -165,49 +350,26 @@ class SurgeryMeterChunks(object):
         self.loss.reset()
         self.task_loss.reset()
         self.full_map = {}
-        self.all_preds = {task:[] for task in self.tasks}
-        self.all_names = []
+        self.predictions.reset()
 
     def update_stats(self, preds, names, final_loss= None, losses=None, lr=None):
         """
         Update the current stats.
         Args:
-            preds (tensor): prediction embedding.
-            d_names (list): names of the keyframes with detection anns.
-            names (list): names of all the keyframes.
+            preds (dict): task -> chunk predictions with dimension `batch` x
+                `chunk size` x `num classes`.
+            names (tensor): `(video, frame)` ids of the frames of the chunks,
+                with dimension `batch` x `chunk size` x 2.
             final_loss (float): final loss value.
             lr (float): learning rate.
         """ 
-        if (self.eval_train or self.mode in ["val", "test"]) and not self.online_inference:
-            for task in self.tasks:
-                preds[task] = np.array(preds[task]).reshape(-1, np.array(preds[task]).shape[-1])
-                self.all_preds[task].extend(preds[task])
-            if self.parallel:
-                names = [IDENT_FUNCT_DICT[self.dataset_name](*name) for name in names]
-            
-            names = names.reshape(-1, 2)
-            names = [IDENT_FUNCT_DICT[self.dataset_name](*name) for name in names]
-            
-            self.all_names.extend(names)
-
-            assert all(len(names)==len(preds[t]) for t in self.tasks)
-        
-        elif (self.eval_train or self.mode in ["val", "test"]) and self.online_inference:
-            for task in self.tasks:
-                preds_frame = np.array(preds[task])[:,-1,:]
-
-                preds[task] = preds_frame
-                self.all_preds[task].extend(preds[task])
-            if self.parallel:
-                names = [IDENT_FUNCT_DICT[self.dataset_name](*name) for name in names]
-
-            batch_size, seq_len, _= names.shape
-            names = names[:,-1,:]
-            names = [IDENT_FUNCT_DICT[self.dataset_name](*name) for name in names]
-        
-            self.all_names.extend(names)
-            
-            assert all(len(names)==len(preds[t]) for t in self.tasks)
+        if (self.eval_train or self.mode in ["val", "test"]) and preds is not None:
+            names = np.asarray(names)
+            if self.online_inference:
+                # Only the prediction of the last frame of every chunk is kept.
+                preds = {task: np.asarray(preds[task])[:, -1] for task in self.tasks}
+                names = names[:, -1]
+            self.predictions.add(preds, names.reshape(-1, 2))
 
         if losses is not None:
             self.task_loss.add_value(losses)
@@ -222,8 +384,9 @@ class SurgeryMeterChunks(object):
         """
         out_name = {}
         for task,metric in zip(self.tasks, self.metrics):
-            out_name[task] = self.save_json(task, self.all_preds, self.all_names, epoch)
-            self.full_map[task] = grasp_eval.main_per_task(self.groundtruth, out_name[task], task, metric)
+            self.full_map[task], out_name[task] = self.evaluator.evaluate(
+                self.predictions, task, metric, self._ident_funct, epoch
+            )
             if log:
                 stats = {"mode": self.mode, "task": task, "metric": self.full_map[task]}
                 logging.log_json_stats(stats)
@@ -255,37 +418,9 @@ class SurgeryMeterChunks(object):
             
             return metrics_val, mean_map, out_files
 
-    def save_json(self, task, preds, names, epoch):
-        """
-        Save json for the specific task.
-        Args:
-            cur_epoch (int): the number of current epoch.
-        """
-
-        save_json_dict = {}
-        save_json_list = {}
-        assert len(preds[task])==len(names), f'Inconsistent lengths {len(preds[task])} {len(names)}'
-
-        for idx, (pred, name) in enumerate(zip(preds[task], names)):
-            task_key_name = f'{task}_score_dist'
-            if name not in save_json_list:
-                save_json_list[name] = [pred]
-            else:
-                save_json_list[name].append(pred)
-        
-        for name in save_json_list:
-            scores = save_json_list[name]
-            if len(scores) == 1:
-                save_json_dict[name] = {task_key_name:scores[0].tolist()}
-            else:
-                scores = np.mean(scores, axis=0)
-                save_json_dict[name] = {task_key_name:scores.tolist()}
-
-        path_prediction = os.path.join(self.output_dir, f'epoch_{epoch}_preds_{task}.json')
-        with open(path_prediction, "w") as outfile:  
-            json.dump(save_json_dict, outfile) 
-            
-        return path_prediction
+    @property
+    def _ident_funct(self):
+        return IDENT_FUNCT_DICT.get(self.dataset_name)
     
 class SurgeryMeter(object):
     """
@@ -315,11 +450,10 @@ class SurgeryMeter(object):
         self.iter_timer = Timer()
         self.data_timer = Timer()
         self.net_timer = Timer()
-        self.all_preds = {k: [] for k in self.tasks}
+        self.predictions = PredictionBuffer(self.tasks)
         self.full_map = {}
-        self.all_names = []
         self.overall_iters = overall_iters
-        self.groundtruth = cfg.ENDOVIS_DATASET.TEST_COCO_ANNS
+        self.evaluator = PredictionEvaluator(cfg)
 
         self.output_dir = cfg.OUTPUT_DIR
 
@@ -403,31 +537,20 @@ class SurgeryMeter(object):
         self.loss.reset()
         self.task_loss.reset()
         self.full_map = {}
-        self.all_preds = {task:[] for task in self.tasks}
-        self.all_names = []
+        self.predictions.reset()
 
     def update_stats(self, preds, names, final_loss= None, losses=None, lr=None):
         """
         Update the current stats.
         Args:
-            preds (tensor): prediction embedding.
-            d_names (list): names of the keyframes with detection anns.
-            names (list): names of all the keyframes.
+            preds (dict): task -> predictions with one row per keyframe.
+            names (list or tensor): names of the keyframes, or their
+                `(video, frame)` ids.
             final_loss (float): final loss value.
             lr (float): learning rate.
         """ 
-        if self.eval_train or self.mode in ["val", "test"]:
-            
-            for task in self.tasks:
-                self.all_preds[task].extend(preds[task])
-            
-            if self.parallel:
-                names = [IDENT_FUNCT_DICT[self.dataset_name.lower()](*name) for name in names]
-
-            
-            self.all_names.extend(names)
-
-            assert all(len(names)==len(preds[t]) for t in self.tasks)
+        if (self.eval_train or self.mode in ["val", "test"]) and preds is not None:
+            self.predictions.add(preds, names)
 
         if losses is not None:
             self.task_loss.add_value(losses)
@@ -442,8 +565,9 @@ class SurgeryMeter(object):
         """
         out_name = {}
         for task,metric in zip(self.tasks, self.metrics):
-            out_name[task] = self.save_json(task, self.all_preds, self.all_names, epoch)
-            self.full_map[task] = grasp_eval.main_per_task(self.groundtruth, out_name[task], task, metric)
+            self.full_map[task], out_name[task] = self.evaluator.evaluate(
+                self.predictions, task, metric, self._ident_funct, epoch
+            )
             if log:
                 stats = {"mode": self.mode, "task": task, "metric": self.full_map[task]}
                 logging.log_json_stats(stats)
@@ -475,26 +599,9 @@ class SurgeryMeter(object):
             
             return metrics_val, mean_map, out_files
 
-    def save_json(self, task, preds, names, epoch):
-        """
-        Save json for the specific task.
-        Args:
-            cur_epoch (int): the number of current epoch.
-        """
-        save_json_dict = {}
-
-        assert len(preds[task])==len(names), f'Inconsistent lengths {len(preds[task])} {len(names)}'
-        
-        for idx, (pred, name) in enumerate(zip(preds[task], names)):
-            task_key_name = f'{task}_score_dist'
-
-            save_json_dict[name] = {task_key_name:pred}
-
-        path_prediction = os.path.join(self.output_dir, f'epoch_{epoch}_preds_{task}.json')
-        with open(path_prediction, "w") as outfile:  
-            json.dump(save_json_dict, outfile) 
-            
-        return path_prediction
+    @property
+    def _ident_funct(self):
+        return IDENT_FUNCT_DICT.get(self.dataset_name.lower())
 
 class TaskMeter(object):
     """
@@ -36,7 +36,7 @@ run_feature_experiment() {
 
     echo "Running feature extraction: TRAIN=$TRAIN_FOLD, TEST=$TEST_FOLD"
 
-    CUDA_VISIBLE_DEVICES=$CUDA_DEVICES python -B tools/run_net.py \
+    CUDA_VISIBLE_DEVICES=$CUDA_DEVICES python -B tools/extract_features.py \
     --cfg $CONFIG_PATH \
     NUM_GPUS $(echo $CUDA_DEVICES | tr ',' '\n' | wc -l) \
     TRAIN.DATASET "heicholems" \
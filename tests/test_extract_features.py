@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""Extract the features of a few synthetic frames with tools/extract_features.py."""
+
+import importlib.util
+import numpy as np
+import os
+
+from must.config.defaults import assert_and_infer_cfg, get_cfg
+from must.utils.benchmark import write_synthetic_dataset
+from must.utils.feature_store import FeatureStoreReader
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_NUM_FRAMES = 4
+
+
+def _load_tool():
+    spec = importlib.util.spec_from_file_location(
+        "extract_features", os.path.join(_ROOT, "tools", "extract_features.py")
+    )
+    tool = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tool)
+    return tool
+
+
+def _extract(tmp_path, batch_transform):
+    cfg = get_cfg()
+    cfg.merge_from_file(os.path.join(_ROOT, "configs", "cholec80", "MMViT_PHASES.yaml"))
+    cfg.merge_from_list(
+        [
+            "NUM_GPUS", 0,
+            "TRAIN.DATASET", "Cholec80ms",
+            "TEST.DATASET", "Cholec80ms",
+            "OUTPUT_DIR", str(tmp_path),
+            "DATA.NUM_FRAMES", 4,
+            "DATA.SAMPLING_RATE", 1,
+            "DATA.MULTI_SAMPLING_RATE", [1, 2],
+            "DATA.TRAIN_JITTER_SCALES", [64, 80],
+            "DATA.TRAIN_CROP_SIZE", 64,
+            "DATA.TEST_CROP_SIZE", 64,
+            "DATA.BATCH_TRANSFORM", batch_transform,
+            "TEST.BATCH_SIZE", _NUM_FRAMES,
+            "DATA_LOADER.NUM_WORKERS", 0,
+            "DATA_LOADER.PIN_MEMORY", False,
+            "MVIT_FEATS.PATH", str(tmp_path / "features"),
+        ]
+    )
+    write_synthetic_dataset(cfg, str(tmp_path / "data"), num_frames=_NUM_FRAMES, frame_size=(80, 96))
+    cfg = assert_and_infer_cfg(cfg)
+    _load_tool().extract_features(cfg)
+
+    reader = FeatureStoreReader(cfg.MVIT_FEATS.PATH)
+    frames = reader.frame_names("video01")
+    dim = cfg.MULTISCALEATTN.SELF_ATTN_EMBED_DIM * len(cfg.DATA.MULTI_SAMPLING_RATE)
+    features = np.asarray(reader.get("video01", frames))
+    assert features.shape == (len(frames), dim)
+    return frames, features
+
+
+def test_extract_one_batch(tmp_path):
+    frames, features = _extract(tmp_path, False)
+    assert len(frames) == _NUM_FRAMES
+    assert features.shape[0] == _NUM_FRAMES
+    assert np.isfinite(features).all()
+
+
+def test_batch_transform(tmp_path):
+    frames, features = _extract(tmp_path / "per_sample", False)
+    frames_batch, features_batch = _extract(tmp_path / "batch", True)
+    assert frames == frames_batch
+    np.testing.assert_allclose(features, features_batch, rtol=1e-3, atol=1e-3)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""Streaming inference of a causal TCM matches the online inference with full chunks."""
+
+import os
+import torch
+
+from must.config.defaults import assert_and_infer_cfg, get_cfg
+from must.models import build_model
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _build_tcm(window):
+    cfg = get_cfg()
+    cfg.merge_from_file(os.path.join(_ROOT, "configs", "cholec80", "TCM_PHASES.yaml"))
+    cfg.merge_from_list(
+        [
+            "NUM_GPUS", 0,
+            "CHUNKS.CHUNK_SIZE", window,
+            "TEMPORAL_MODULE.CAUSAL", True,
+            "TEMPORAL_MODULE.ONLINE_INFERENCE", True,
+            "TEMPORAL_MODULE.STREAMING", True,
+        ]
+    )
+    cfg = assert_and_infer_cfg(cfg)
+    torch.manual_seed(0)
+    model = build_model(cfg)
+    model.eval()
+    return cfg, model
+
+
+def _windowed(model, features, window):
+    """
+    Predictions of every frame on the chunk of `window` frames ending at it,
+    the first frame being repeated, as built by the online inference datasets.
+    """
+    rows = (torch.arange(len(features)).unsqueeze(1) + torch.arange(1 - window, 1)).clamp(min=0)
+    with torch.no_grad():
+        preds = model(features[rows])
+    return {task: pred[:, -1] for task, pred in preds.items()}
+
+
+def test_streaming_matches_windowed():
+    window = 8
+    cfg, model = _build_tcm(window)
+    videos = [
+        torch.randn(30, cfg.TEMPORAL_MODULE.TCM_INPUT_DIM),
+        torch.randn(5, cfg.TEMPORAL_MODULE.TCM_INPUT_DIM),
+    ]
+    expected = [_windowed(model, features, window) for features in videos]
+
+    # Batches of the streaming loader span the boundaries between videos.
+    features = torch.cat(videos)
+    stream_ids = torch.cat([torch.full((len(v),), idx) for idx, v in enumerate(videos)])
+    model.reset_stream()
+    streamed = {task: [] for task in cfg.TASKS.TASKS}
+    for start in range(0, len(features), 7):
+        x = features[start : start + 7].unsqueeze(1)
+        preds = model(x, stream_ids=stream_ids[start : start + 7])
+        for task, pred in preds.items():
+            streamed[task].append(pred[:, -1])
+
+    for task in cfg.TASKS.TASKS:
+        want = torch.cat([preds[task] for preds in expected])
+        got = torch.cat(streamed[task])
+        torch.testing.assert_close(got, want, rtol=1e-4, atol=1e-5)
+        assert torch.equal(got.argmax(-1), want.argmax(-1))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
+
+"""Benchmarks of the models, datasets and data loading.
+
+`suite` runs the forward and forward+backward passes of the model of every
+config on CPU with random inputs, and loads samples of every registered
+dataset from synthetic frames and features. Throughput, latency percentiles
+and peak memory are written as JSON, and compared with the results of another
+commit with `--compare`. Options after the arguments override every config,
+e.g. `BENCHMARK.NUM_ITERS 5 TRAIN.BATCH_SIZE 2 TEST.BATCH_SIZE 2`.
+
+The other commands benchmark a single config given with `--cfg`:
+    data: the data loading, e.g. with DATA.FUSED_PREPROCESSING True and
+        False to compare the fused clip preprocessing with the per-frame one.
+    inference: the inference speed of the model, e.g. with NUM_GPUS 0 and
+        CPU_INFERENCE.ENABLE True to measure the CPU inference mode.
+    attention: the MViT blocks with fused and explicit attention, with the
+        time and peak GPU memory of every block and the size of the attention
+        map that the fused kernels avoid.
+    act_checkpoint: the step time and the memory kept for the backward pass
+        without activation checkpointing and with the first 1, 2, ... stages
+        checkpointed, to choose `MODEL.ACT_CHECKPOINT_STAGES` for a batch size.
+"""
+import argparse
+import glob
+import json
+import os
+import tempfile
+
+import must.utils.logging as logging
+from must.config.defaults import assert_and_infer_cfg
+from must.utils.benchmark import (
+    benchmark_act_checkpoint,
+    benchmark_attention,
+    benchmark_data_loading,
+    benchmark_inference,
+    compare_benchmark_results,
+    run_benchmark_suite,
+)
+from must.utils.misc import launch_job
+from must.utils.parser import load_config
+
+
+def run_suite(args):
+    """
+    Run the benchmark suite and compare it with older results.
+    """
+    logging.setup_logging()
+    results = run_benchmark_suite(
+        args.configs,
+        args.opts,
+        args.output,
+        args.data_dir,
+        models=not args.skip_models,
+        datasets=not args.skip_datasets,
+    )
+    if args.compare:
+        with open(args.compare) as f:
+            compare_benchmark_results(json.load(f), results)
+
+
+def run_config_benchmark(args):
+    """
+    Run the benchmark of a single config.
+    """
+    cfg = load_config(args)
+    cfg = assert_and_infer_cfg(cfg)
+
+    if args.func is benchmark_data_loading:
+        launch_job(cfg=cfg, init_method=args.init_method, func=benchmark_data_loading)
+    else:
+        args.func(cfg)
+
+
+def _add_config_parser(subparsers, name, func, help):
+    parser = subparsers.add_parser(name, help=help)
+    parser.add_argument(
+        "--shard_id",
+        help="The shard id of current node, Starts from 0 to num_shards - 1",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--num_shards",
+        help="Number of shards using by the job",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--init_method",
+        help="Initialization method, includes TCP or shared file-system",
+        default="tcp://localhost:9999",
+        type=str,
+    )
+    parser.add_argument(
+        "--cfg", dest="cfg_file", required=True, type=str, help="Path to the config file"
+    )
+    parser.add_argument(
+        "opts",
+        help="See must/config/defaults.py for all options",
+        default=None,
+        nargs=argparse.REMAINDER,
+    )
+    parser.set_defaults(run=run_config_benchmark, func=func)
+
+
+def main():
+    """
+    Main function to run the benchmarks.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the models and datasets.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    suite = subparsers.add_parser("suite", help="Benchmark the models and datasets of the configs.")
+    suite.add_argument(
+        "--configs",
+        nargs="+",
+        default=sorted(glob.glob("configs/*/*.yaml")),
+        help="Config files of the models, and of the datasets of their folders.",
+    )
+    suite.add_argument("--output", default="benchmark_suite.json", help="Path of the JSON results.")
+    suite.add_argument(
+        "--data-dir",
+        default=os.path.join(tempfile.gettempdir(), "must_benchmark_data"),
+        help="Directory of the synthetic frames and features.",
+    )
+    suite.add_argument("--skip-models", action="store_true")
+    suite.add_argument("--skip-datasets", action="store_true")
+    suite.add_argument("--compare", default="", help="JSON results to compare with.")
+    suite.add_argument("opts", default=[], nargs=argparse.REMAINDER)
+    suite.set_defaults(run=run_suite)
+
+    _add_config_parser(
+        subparsers, "data", benchmark_data_loading, "Benchmark the data loading of a config."
+    )
+    _add_config_parser(
+        subparsers, "inference", benchmark_inference, "Benchmark the inference speed of a config."
+    )
+    _add_config_parser(
+        subparsers, "attention", benchmark_attention,
+        "Benchmark the MViT blocks of a config with fused and explicit attention.",
+    )
+    _add_config_parser(
+        subparsers, "act_checkpoint", benchmark_act_checkpoint,
+        "Benchmark the activation checkpointing policies of a config.",
+    )
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+"""Build the pre-resized frame cache of a config.
+
+Frames of the train and test frame lists are resized to the size used by the
+preprocessing and stored in ENDOVIS_DATASET.FRAME_CACHE_DIR. Train and test
+with ENDOVIS_DATASET.IMG_PROC_BACKEND frame_cache to read from it.
+"""
+from must.config.defaults import assert_and_infer_cfg
+from must.datasets.frame_cache import build_frame_cache
+from must.utils.parser import load_config, parse_args
+import must.utils.logging as logging
+
+
+def main():
+    """
+    Main function to build the frame cache.
+    """
+    args = parse_args()
+    cfg = load_config(args)
+    cfg = assert_and_infer_cfg(cfg)
+    assert cfg.ENDOVIS_DATASET.FRAME_CACHE_DIR, "Set ENDOVIS_DATASET.FRAME_CACHE_DIR"
+
+    logging.setup_logging(cfg.OUTPUT_DIR)
+    build_frame_cache(cfg, num_threads=max(1, cfg.DATA_LOADER.NUM_WORKERS))
+
+
+if __name__ == "__main__":
+    main()
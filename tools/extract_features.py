@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates. All Rights Reserved.
+
+"""Extract the per-frame features of the multi-term frame encoder.
+
+The frames of the TEST split are sharded across processes and written to the
+packed feature store at MVIT_FEATS.PATH. Frames whose features are already
+stored are skipped, so an interrupted extraction resumes where it stopped.
+Unlike running tools/run_net.py with MVIT_FEATS.ENABLE, no meters,
+predictions or evaluation are computed.
+"""
+
+import contextlib
+import numpy as np
+import os
+import pprint
+import torch
+from fvcore.common.timer import Timer
+
+import must.utils.checkpoint as cu
+import must.utils.cpu_inference as cpu_inference
+import must.utils.distributed as du
+import must.utils.logging as logging
+from must.config.defaults import assert_and_infer_cfg
+from must.datasets.batch_transform import BatchTransform
+from must.datasets.build import build_dataset
+from must.datasets.loader import detection_collate
+from must.models import build_model
+from must.utils.feature_store import (
+    FeatureStoreWriter,
+    pack_feature_store,
+    repair_parts,
+    split_frame_name,
+    stored_frames,
+)
+from must.utils.misc import launch_job
+from must.utils.parser import load_config, parse_args
+
+logger = logging.get_logger(__name__)
+
+
+def _frame_names(dataset):
+    """
+    Name of the keyframe of every sample of a dataset, relative to the frames
+    directory.
+    """
+    names = []
+    for idx in range(len(dataset)):
+        video_idx, _, sec, _ = dataset._keyframe_indices[idx]
+        names.append(dataset._keyframe_name(dataset._video_idx_to_name[video_idx], sec))
+    return names
+
+
+def _pending_samples(frame_names, stored):
+    """
+    Indexes of the samples whose keyframe has no stored features.
+    """
+    pending = []
+    for idx, name in enumerate(frame_names):
+        video, frame = split_frame_name(name)
+        if frame not in stored.get(video, ()):
+            pending.append(idx)
+    return pending
+
+
+@torch.no_grad()
+def extract_features(cfg):
+    """
+    Extract the features of the keyframes of the test split with the MTFE.
+    Args:
+        cfg (CfgNode): configs. Details can be found in
+            must/config/defaults.py
+    """
+    assert cfg.MVIT_FEATS.PATH, "Set MVIT_FEATS.PATH"
+    assert cfg.MVIT_FEATS.FORMAT == "packed", "Only packed feats can be extracted"
+    du.init_distributed_training(cfg)
+    np.random.seed(cfg.RNG_SEED)
+    torch.manual_seed(cfg.RNG_SEED)
+    logging.setup_logging(cfg.OUTPUT_DIR)
+    logger.info("Extract features with config:")
+    logger.info(pprint.pformat(cfg))
+
+    model = build_model(cfg)
+    cu.load_test_checkpoint(cfg, model)
+    model.eval()
+    cpu_mode = cpu_inference.is_enabled(cfg)
+    if cpu_mode:
+        model = cpu_inference.setup_cpu_inference(cfg, model)
+    model = model.module if hasattr(model, "module") else model
+    task = cfg.MVIT_FEATS.TASK or cfg.TASKS.TASKS[0]
+    dim = cfg.MULTISCALEATTN.SELF_ATTN_EMBED_DIM * len(cfg.DATA.MULTI_SAMPLING_RATE)
+
+    # Parts of an interrupted extraction are repaired before any process
+    # lists the stored frames or writes new ones.
+    os.makedirs(cfg.MVIT_FEATS.PATH, exist_ok=True)
+    if du.is_root_proc():
+        repair_parts(cfg.MVIT_FEATS.PATH, dim, dtype=cfg.MVIT_FEATS.DTYPE)
+    du.synchronize()
+    # The `val` split reads TEST_LISTS with the evaluation preprocessing.
+    dataset = build_dataset(cfg.TEST.DATASET, cfg, "val")
+    frame_names = _frame_names(dataset)
+    pending = _pending_samples(frame_names, stored_frames(cfg.MVIT_FEATS.PATH))
+    du.synchronize()
+
+    # Contiguous shards keep the frames of a video in few processes.
+    shard = np.array_split(np.array(pending, dtype=int), du.get_world_size())[du.get_rank()]
+    logger.info(
+        "{} of {} frames already extracted, {} frames in this shard".format(
+            len(frame_names) - len(pending), len(frame_names), len(shard)
+        )
+    )
+
+    loader = torch.utils.data.DataLoader(
+        torch.utils.data.Subset(dataset, shard.tolist()),
+        batch_size=max(1, cfg.TEST.BATCH_SIZE // max(1, cfg.NUM_GPUS)),
+        shuffle=False,
+        num_workers=cfg.DATA_LOADER.NUM_WORKERS,
+        pin_memory=cfg.DATA_LOADER.PIN_MEMORY,
+        collate_fn=detection_collate,
+    )
+    writer = FeatureStoreWriter(cfg.MVIT_FEATS.PATH, dtype=cfg.MVIT_FEATS.DTYPE, rank=du.get_rank())
+    chunk_names, chunk_features = [], []
+    num_done = 0
+    batch_transform = BatchTransform(cfg, "val") if cfg.DATA.BATCH_TRANSFORM else None
+    timer = Timer()
+    for cur_iter, (inputs, _, _, _) in enumerate(loader):
+        if batch_transform is not None:
+            inputs = batch_transform(inputs)
+        if cpu_mode:
+            inputs = cpu_inference.prepare_inputs(cfg, inputs)
+        with cpu_inference.inference_context(cfg) if cpu_mode else contextlib.nullcontext():
+            features = model.extract_features(inputs, task)
+
+        batch_size = len(features)
+        chunk_names.extend(frame_names[idx] for idx in shard[num_done : num_done + batch_size])
+        chunk_features.append(features.float().cpu().numpy())
+        num_done += batch_size
+
+        if len(chunk_names) >= cfg.MVIT_FEATS.CHUNK_SIZE or num_done == len(shard):
+            writer.add(chunk_names, np.concatenate(chunk_features))
+            chunk_names, chunk_features = [], []
+
+        if (cur_iter + 1) % cfg.LOG_PERIOD == 0 or num_done == len(shard):
+            logger.info(
+                "{}/{} frames, {:.2f} frames/s".format(
+                    num_done, len(shard), num_done / max(timer.seconds(), 1e-6)
+                )
+            )
+
+    # Merge the features written by every process into one array per video.
+    du.synchronize()
+    if du.is_root_proc():
+        pack_feature_store(cfg.MVIT_FEATS.PATH, dtype=cfg.MVIT_FEATS.DTYPE)
+    du.synchronize()
+    logger.info(
+        "Extracted {} frames in {:.2f} seconds".format(num_done, timer.seconds())
+    )
+
+
+def main():
+    """
+    Main function to spawn the feature extraction processes.
+    """
+    args = parse_args()
+    cfg = load_config(args)
+    cfg = assert_and_infer_cfg(cfg)
+
+    launch_job(cfg=cfg, init_method=args.init_method, func=extract_features)
+
+
+if __name__ == "__main__":
+    main()
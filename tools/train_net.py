@@ -3,6 +3,7 @@
 
 """Train a video classification model."""
 
+import contextlib
 import random
 import numpy as np
 import shutil
@@ -13,12 +14,15 @@ import torch
 import must.models.losses as losses
 import must.models.optimizer as optim
 import must.utils.checkpoint as cu
+import must.utils.cpu_inference as cpu_inference
 import must.utils.distributed as du
 import must.utils.logging as logging
 import must.utils.misc as misc
 
 from must.datasets import loader
+from must.datasets.batch_transform import BatchTransform
 from must.models import build_model
+from must.utils.feature_store import pack_feature_store
 from must.utils.meters import EpochTimer, SurgeryMeter, SurgeryMeterChunks
 import torch.backends.cudnn as cudnn
 import torch.backends.cudnn
@@ -58,6 +62,7 @@ def train_epoch(
     loss_dict = {task:losses.get_loss_func(loss_funs[t_id])(reduction=cfg.SOLVER.REDUCTION) for t_id,task in enumerate(tasks)}
     type_dict = {task:losses.get_loss_type(loss_funs[t_id],cfg.MODEL.PRECISION) for t_id,task in enumerate(tasks)}
     loss_weights = cfg.TASKS.LOSS_WEIGHTS
+    batch_transform = BatchTransform(cfg, "train") if cfg.DATA.BATCH_TRANSFORM else None
     for cur_iter, (inputs, labels, data, image_names) in enumerate(train_loader):
 
         # Transfer the data to the current GPU device.
@@ -86,6 +91,9 @@ def train_epoch(
 
         train_meter.data_toc()
 
+        if batch_transform is not None:
+            inputs = batch_transform(inputs)
+
         with torch.cuda.amp.autocast(enabled=cfg.TRAIN.MIXED_PRECISION):
             sequence_mask = data["sequence_mask"] if cfg.TEMPORAL_MODULE.CHUNKS else None
             if sequence_mask is not None:
@@ -151,6 +159,7 @@ def train_epoch(
     train_meter.log_epoch_stats(cur_epoch)
     train_meter.reset()
 
+
 @torch.no_grad()
 def eval_epoch(val_loader, model, val_meter, cur_epoch, cfg):
     """
@@ -168,8 +177,17 @@ def eval_epoch(val_loader, model, val_meter, cur_epoch, cfg):
     model.eval()
     val_meter.iter_tic()
     complete_tasks = cfg.TASKS.TASKS
-    region_tasks = {task for task in cfg.TASKS.TASKS if task in cfg.ENDOVIS_DATASET.REGION_TASKS}
 
+    if cfg.TEMPORAL_MODULE.STREAMING:
+        model.reset_stream()
+
+    batch_transform = BatchTransform(cfg, "val") if cfg.DATA.BATCH_TRANSFORM else None
+    cpu_mode = cpu_inference.is_enabled(cfg)
+
+    # With several GPUs, every process keeps its own predictions and they are
+    # gathered once at the end of the epoch.
+    local_preds = {task: [] for task in complete_tasks}
+    local_names = []
     for cur_iter, (inputs, labels, data, image_names) in enumerate(val_loader):
         if cfg.NUM_GPUS:
             for idx, input in enumerate(inputs[0]):
@@ -192,39 +210,63 @@ def eval_epoch(val_loader, model, val_meter, cur_epoch, cfg):
                     
         val_meter.data_toc()
 
+        if batch_transform is not None:
+            inputs = batch_transform(inputs)
+
         sequence_mask = data["sequence_mask"] if cfg.TEMPORAL_MODULE.CHUNKS else None
 
-        # If calculation of features from the MTFE is enabled
-        if cfg.MVIT_FEATS.ENABLE:
-            preds = model(inputs, image_names)
-    
-        else:
-            if sequence_mask is not None:
-                preds = model(inputs, sequence_mask)
+        if cpu_mode:
+            inputs = cpu_inference.prepare_inputs(cfg, inputs)
+
+        with cpu_inference.inference_context(cfg) if cpu_mode else contextlib.nullcontext():
+            # If calculation of features from the MTFE is enabled
+            if cfg.MVIT_FEATS.ENABLE:
+                preds = model(inputs, image_names)
+
+            elif cfg.TEMPORAL_MODULE.STREAMING:
+                # Stream the newest frame of every sample, keyed by its video.
+                preds = model(inputs, sequence_mask, stream_ids=image_names[:, -1, 0])
+
             else:
-                preds = model(inputs)
-        
+                if sequence_mask is not None:
+                    preds = model(inputs, sequence_mask)
+                else:
+                    preds = model(inputs)
+
+        if cpu_mode:
+            # bfloat16 predictions are stored as float32.
+            preds = {task: preds[task].float() for task in complete_tasks}
+
         if cfg.NUM_GPUS:
             preds = {task: preds[task].cpu() for task in complete_tasks}
 
             if cfg.NUM_GPUS>1:
-                image_names = image_names.cpu()
-                image_names = torch.cat(du.all_gather_unaligned(image_names),dim=0).tolist()
-
-                for task in preds:
-                    preds[task] = torch.cat(du.all_gather_unaligned(preds[task]), dim=0)
+                for task in complete_tasks:
+                    local_preds[task].append(preds[task])
+                local_names.append(image_names.cpu())
 
         val_meter.iter_toc()
 
-        for task in complete_tasks:
-            if task not in region_tasks:
-                preds[task] = preds[task].tolist()
-        
         # Update and log stats.
-        val_meter.update_stats(preds, image_names)
+        if cfg.NUM_GPUS <= 1:
+            val_meter.update_stats(preds, image_names)
         val_meter.log_iter_stats(cur_epoch, cur_iter)
         val_meter.iter_tic()
 
+    if cfg.NUM_GPUS > 1:
+        gathered = du.all_gather_aligned(
+            [torch.cat(local_preds[task], dim=0) for task in complete_tasks]
+            + [torch.cat(local_names, dim=0)]
+        )
+        val_meter.update_stats(dict(zip(complete_tasks, gathered[:-1])), gathered[-1])
+
+    # Merge the features written by every process into one array per video.
+    if cfg.MVIT_FEATS.ENABLE and cfg.MVIT_FEATS.FORMAT == "packed":
+        du.synchronize()
+        if du.is_root_proc():
+            pack_feature_store(cfg.MVIT_FEATS.PATH, dtype=cfg.MVIT_FEATS.DTYPE)
+        du.synchronize()
+
     if cfg.NUM_GPUS > 1:
         if du.is_master_proc():
             task_map, mean_map, out_files = val_meter.log_epoch_stats(cur_epoch)
@@ -304,6 +346,9 @@ def train(cfg):
     # Perform final test
     if cfg.TEST.ENABLE:
         logger.info("Evaluating epoch: {}".format(start_epoch + 1))
+        if not cfg.TRAIN.ENABLE and cpu_inference.is_enabled(cfg):
+            # Evaluation-only run, the model is not trained afterwards.
+            model = cpu_inference.setup_cpu_inference(cfg, model)
         map_task, mean_map, out_files = eval_epoch(val_loader, model, val_meter, start_epoch, cfg)
         if not cfg.TRAIN.ENABLE:
             return
@@ -383,7 +428,9 @@ def train(cfg):
         if is_eval_epoch:
             map_task, mean_map, out_files = eval_epoch(val_loader, model, val_meter, cur_epoch, cfg)
             if (cfg.NUM_GPUS > 1 and du.is_master_proc()) or cfg.NUM_GPUS == 1:
-                main_path = os.path.split(list(out_files.values())[0])[0]
+                # Prediction jsons may still be being written.
+                val_meter.evaluator.wait()
+                main_path = os.path.normpath(cfg.OUTPUT_DIR)
                 fold = main_path.split('/')[-1]
                 best_preds_path = main_path.replace(fold, fold+'/best_predictions')
                 if not os.path.exists(best_preds_path):
@@ -401,6 +448,8 @@ def train(cfg):
                         scaler if cfg.TRAIN.MIXED_PRECISION else None,
                         )
                     for task in complete_tasks:
+                        if out_files[task] is None:
+                            continue
                         file = out_files[task].split('/')[-1]
                         copy_path = os.path.join(best_preds_path, file.replace('epoch', 'best_all') )
                         shutil.copyfile(out_files[task], copy_path)
@@ -409,9 +458,10 @@ def train(cfg):
                     if list(map_task[task].values())[0] > best_task_map[task]:
                         best_task_map[task] = list(map_task[task].values())[0]
                         logger.info("Best {} map at epoch {}".format(task, cur_epoch))
-                        file = out_files[task].split('/')[-1]
-                        copy_path = os.path.join(best_preds_path, file.replace('epoch', 'best') )
-                        shutil.copyfile(out_files[task], copy_path)
+                        if out_files[task] is not None:
+                            file = out_files[task].split('/')[-1]
+                            copy_path = os.path.join(best_preds_path, file.replace('epoch', 'best') )
+                            shutil.copyfile(out_files[task], copy_path)
                         cu.save_best_checkpoint(
                             cfg.OUTPUT_DIR,
                             model,
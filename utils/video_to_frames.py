@@ -0,0 +1,244 @@
+"""
+Extract the frames of the surgery videos of Cholec80, HeiChole, MISAW and
+GraSP into the frame folders read by the dataloaders.
+
+Videos are processed in parallel, one per process, and every process writes
+its frames from a pool of background threads while the next frames are
+decoded. The black margins of the Cholec80 videos are cropped with a box
+detected with numpy reductions, once per video or every `--crop-every`
+frames.
+
+Example:
+    python utils/video_to_frames.py cholec80 ./cholec80/videos ./data/cholec80/frames --num-workers 8
+    python utils/video_to_frames.py misaw ./MISAW/original-data ./data/misaw/frames --annotations ./MISAW/annotations
+"""
+
+import argparse
+import glob
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import pandas as pd
+
+
+def crop_box(image, threshold=15, blur=19, border=10):
+    """
+    Box of the non-black region of a frame, the region outside of the black
+    margins of the endoscope.
+    Args:
+        image (ndarray): BGR frame.
+        threshold (int): gray level below which pixels are black.
+        blur (int): size of the median filter removing noise from the mask.
+        border (int): columns ignored at the left and right sides.
+    Returns:
+        box (tuple): (top, bottom, left, right), or None if the frame is black.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, mask = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY)
+    mask = cv2.medianBlur(mask, blur)[:, border : mask.shape[1] - border] != 0
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0)) + border
+    return rows[0], rows[-1], cols[0], cols[-1]
+
+
+def _cholec80_resize(frame, height=300):
+    return cv2.resize(frame, (int(frame.shape[1] / frame.shape[0] * height), height))
+
+
+def _cholec80_crop(frame, box, size=(250, 250)):
+    if box is not None:
+        top, bottom, left, right = box
+        frame = frame[top:bottom, left:right]
+    return cv2.resize(frame, size)
+
+
+def _misaw_annotations(video, split):
+    annotations = video.replace(".mp4", "_annotation.txt")
+    return pd.read_csv(os.path.join(split, "Procedural decription", annotations), sep="\t")
+
+
+DATASETS = {
+    # Video folder, frame name and frame options of every dataset.
+    "cholec80": {
+        "videos": lambda root: sorted(glob.glob(os.path.join(root, "*.mp4"))),
+        "folder": lambda idx, stem: stem,
+        "frame": lambda stem, num: "{}_{:06d}.jpg".format(stem, num),
+        "fps": 0,
+        "crop": True,
+    },
+    "heichole": {
+        "videos": lambda root: sorted(glob.glob(os.path.join(root, "*.mp4"))),
+        "folder": lambda idx, stem: "video_{:02d}".format(int(stem.split("Hei-Chole")[1])),
+        "frame": lambda stem, num: "{:05d}.png".format(num),
+        "fps": 1,
+        "crop": False,
+    },
+    "misaw": {
+        "videos": lambda root: [
+            path
+            for split in ("train", "test")
+            for path in sorted(glob.glob(os.path.join(root, split, "Video", "*.mp4")))
+        ],
+        "folder": lambda idx, stem: "CASE{:03d}".format(idx + 1),
+        "frame": lambda stem, num: "{:05d}.jpg".format(num),
+        "fps": 0,
+        "size": (920, 540),
+        "crop": False,
+    },
+    "grasp": {
+        "videos": lambda root: sorted(glob.glob(os.path.join(root, "*.mp4"))),
+        "folder": lambda idx, stem: stem,
+        "frame": lambda stem, num: "{:09d}.jpg".format(num),
+        "fps": 0,
+        "crop": False,
+    },
+}
+
+
+class FrameWriter(object):
+    """
+    Encodes and writes frames from a queue in background threads. OpenCV
+    releases the GIL while encoding, so the threads run in parallel with the
+    decoding.
+    """
+
+    def __init__(self, num_threads=4, max_pending=64):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(num_threads)]
+        self._errors = []
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            path, frame = item
+            if not cv2.imwrite(path, frame):
+                self._errors.append(path)
+
+    def write(self, path, frame):
+        self._queue.put((path, frame))
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._errors:
+            raise IOError("Failed to write {} frames, e.g. {}".format(len(self._errors), self._errors[0]))
+
+
+def extract_video(args):
+    """
+    Extract the frames of a video.
+    Args:
+        args (tuple): dataset name, video index, video path, output directory,
+            options.
+    Returns:
+        folder (str): frame folder of the video.
+        num_frames (int): number of written frames.
+    """
+    dataset, video_idx, video_path, output_dir, opts = args
+    spec = DATASETS[dataset]
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    folder = spec["folder"](video_idx, stem)
+    os.makedirs(os.path.join(output_dir, folder), exist_ok=True)
+
+    capture = cv2.VideoCapture(video_path)
+    video_fps = capture.get(cv2.CAP_PROP_FPS)
+    fps = spec["fps"] if opts["fps"] is None else opts["fps"]
+    # Frames are named after their sample when subsampled, as in HeiChole.
+    stride = int(np.ceil(video_fps / fps)) if fps > 0 else 1
+
+    writer = FrameWriter(opts["write_threads"])
+    box = None
+    frame_idx = 0
+    num_written = 0
+    names = []
+    while True:
+        if frame_idx % stride != 0:
+            if not capture.grab():
+                break
+            frame_idx += 1
+            continue
+        ok, frame = capture.read()
+        if not ok:
+            break
+        if spec["crop"]:
+            frame = _cholec80_resize(frame)
+            crop_every = opts["crop_every"]
+            if (crop_every > 0 and num_written % crop_every == 0) or (crop_every == 0 and box is None):
+                box = crop_box(frame)
+            frame = _cholec80_crop(frame, box)
+        elif "size" in spec:
+            frame = cv2.resize(frame, spec["size"])
+        name = os.path.join(output_dir, folder, spec["frame"](stem, frame_idx // stride))
+        writer.write(name, frame)
+        names.append(name)
+        num_written += 1
+        frame_idx += 1
+    capture.release()
+    writer.close()
+
+    if dataset == "misaw" and opts["annotations"]:
+        split = os.path.dirname(os.path.dirname(video_path))
+        df = _misaw_annotations(os.path.basename(video_path), split)
+        assert len(df) == len(names), "{} frames and {} annotations in {}".format(len(names), len(df), video_path)
+        pd.DataFrame(
+            {"filename": names, "phase": df["Phase"].tolist(), "step": df["Step"].tolist()}
+        ).to_csv(os.path.join(opts["annotations"], folder + ".csv"), index=False)
+    return folder, num_written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the frames of the surgery videos.")
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("videos", help="Directory of the original videos.")
+    parser.add_argument("output", help="Directory of the frame folders.")
+    parser.add_argument("--num-workers", type=int, default=os.cpu_count(), help="Videos extracted in parallel.")
+    parser.add_argument("--write-threads", type=int, default=2, help="Writer threads of every video.")
+    parser.add_argument("--fps", type=float, default=None, help="Extracted frames per second, all frames if 0.")
+    parser.add_argument(
+        "--crop-every",
+        type=int,
+        default=1,
+        help="Frames between two detections of the crop box, once per video if 0.",
+    )
+    parser.add_argument("--annotations", default="", help="Directory of the MISAW annotation files.")
+    args = parser.parse_args()
+
+    videos = DATASETS[args.dataset]["videos"](args.videos)
+    assert len(videos) > 0, "No videos found in {}".format(args.videos)
+    if args.annotations:
+        os.makedirs(args.annotations, exist_ok=True)
+    opts = {
+        "fps": args.fps,
+        "crop_every": args.crop_every,
+        "write_threads": args.write_threads,
+        "annotations": args.annotations,
+    }
+    jobs = [(args.dataset, idx, path, args.output, opts) for idx, path in enumerate(videos)]
+
+    start = time.time()
+    total = 0
+    with ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+        for idx, (folder, num_frames) in enumerate(executor.map(extract_video, jobs)):
+            total += num_frames
+            print("[{}/{}] {}: {} frames".format(idx + 1, len(jobs), folder, num_frames))
+    elapsed = time.time() - start
+    print("Extracted {} frames of {} videos in {:.1f}s ({:.1f} frames/s)".format(
+        total, len(jobs), elapsed, total / max(elapsed, 1e-6)
+    ))
+
+
+if __name__ == "__main__":
+    main()